@@ -1,8 +1,6 @@
 import streamlit as st
-from picchange import img_cryptography
-from stegnography import steganography_function
-from watermark import watermark_
-from home import home_
+from debug_panel import profiling_panel, profiling_toggle
+from startup import PAGES, render_page
 
 # Set the page configuration at the very top of the script
 
@@ -13,18 +11,18 @@ st.sidebar.write("Choose a feature to proceed:")
 # Add a selectbox in the sidebar for selecting the functionality
 feature_choice = st.sidebar.selectbox(
     "Select the functionality:",
-    ("Home", "Cryptography", "Steganography", "Watermarking")
+    tuple(PAGES)
 )
 
+# Optional timing of every operation stage, shown below the page
+profiling_enabled = profiling_toggle()
+
 # Main App Title
 st.title("ImageSecure Suite: Your Ultimate Image Security Solution.")
 
-# Trigger the corresponding function based on the selected option
-if feature_choice == "Home":
-    home_()
-elif feature_choice == "Cryptography":
-    img_cryptography()
-elif feature_choice == "Steganography":
-    steganography_function()
-else:
-    watermark_()
+# Trigger the corresponding function based on the selected option; each page's
+# module (and the libraries it needs) is imported the first time it is opened
+render_page(feature_choice)
+
+if profiling_enabled:
+    profiling_panel()
@@ -0,0 +1,56 @@
+import os
+
+import streamlit as st
+from imagesecure import profiling
+from startup import startup_report
+
+# The profiler is shared by every session of the server process: switching or resetting
+# it affects all visitors and its timings describe their operations, so the switch and
+# the panel are only shown to operators who start the app with IMAGESECURE_DEBUG_PANEL=1
+DEBUG_PANEL = os.environ.get("IMAGESECURE_DEBUG_PANEL", "0") == "1"
+
+
+# Function to show the profiling switch in the sidebar; returns True while profiling is on
+def profiling_toggle():
+    if not DEBUG_PANEL:
+        return False
+    enabled = st.sidebar.checkbox("Profile operations (debug)", value=profiling.is_enabled(), key="profiling")
+    if enabled:
+        profiling.enable()
+    else:
+        profiling.disable()
+    return enabled
+
+
+def profiling_panel():
+    """
+    Shows the time, bytes and pixels recorded for every operation stage in this
+    server process, with the trace and metrics available for download, and how
+    long each page took to load the first time it was opened. Shown only with
+    IMAGESECURE_DEBUG_PANEL=1.
+    """
+    if not DEBUG_PANEL:
+        return
+    with st.expander("Startup"):
+        st.table([
+            {"Page": row["page"], "Import (ms)": f"{row['import_s'] * 1000:.0f}",
+             "First render (ms)": f"{row['first_render_s'] * 1000:.0f}", "Since app load (s)": f"{row['since_start_s']:.2f}"}
+            for row in startup_report()
+        ])
+    with st.expander("Profiling", expanded=True):
+        rows = profiling.summary()
+        if not rows:
+            st.caption("No operations recorded yet. Run an operation with profiling on.")
+            return
+        st.table([
+            {"Stage": row["span"], "Calls": row["calls"], "Total (ms)": f"{row['seconds'] * 1000:.1f}",
+             "Mean (ms)": f"{row['mean_ms']:.2f}", "MB": f"{row['bytes'] / 1e6:.2f}", "MP": f"{row['pixels'] / 1e6:.2f}",
+             "MB/s": f"{row['mb_per_s']:.1f}" if row["mb_per_s"] else "", "MP/s": f"{row['mp_per_s']:.1f}" if row["mp_per_s"] else ""}
+            for row in rows
+        ])
+        col1, col2, col3 = st.columns(3)
+        col1.download_button("Download JSON trace", profiling.trace_json(), "imagesecure_trace.json", mime="application/json")
+        col2.download_button("Download Prometheus metrics", profiling.prometheus_text(), "imagesecure_metrics.prom", mime="text/plain")
+        if col3.button("Reset"):
+            profiling.reset()
+            st.rerun()
@@ -1,5 +1,14 @@
 import streamlit as st
 
+
+# Function to load an illustration once per server rather than on every rerun.
+# The files are already web-sized JPEGs, so their bytes are shown as they are:
+# decoding them here would load the image operations on a cold start on Home
+@st.cache_data(show_spinner=False)
+def illustration(path):
+    with open(path, "rb") as f:
+        return f.read()
+
 # Set up the page
 def home_():
     
@@ -11,7 +20,7 @@ def home_():
         col1, col2 = st.columns([1, 1])
 
         with col1:
-            st.image("Data-Encryption-Descryption-1024x631.jpg", use_column_width=True, caption="Image Encryption Illustration")
+            st.image(illustration("Data-Encryption-Descryption-1024x631.jpg"), use_column_width=True, caption="Image Encryption Illustration")
 
         with col2:
             st.subheader("Image Encryption & Decryption")
@@ -34,14 +43,14 @@ def home_():
             )
 
         with col2:
-            st.image("steganography-malware-hidden-in-source-code.jpg", use_column_width=True, caption="Steganography Illustration")
+            st.image(illustration("steganography-malware-hidden-in-source-code.jpg"), use_column_width=True, caption="Steganography Illustration")
 
     # Section 3: Watermarking
     with st.container():
         col1, col2 = st.columns([1, 1])
 
         with col1:
-            st.image("images.jpg", use_column_width=True, caption="Watermarking Illlustration")
+            st.image(illustration("images.jpg"), use_column_width=True, caption="Watermarking Illlustration")
 
         with col2:
             st.subheader("Watermarking")
@@ -0,0 +1,60 @@
+"""
+Core image security operations used by the Streamlit app and the batch CLI.
+
+Names are imported from their submodule on first use, so importing one part of
+the package (imagesecure.preview for the UI, say) does not load cryptography
+and every image operation with it.
+"""
+import importlib
+
+# Public name -> submodule defining it
+_EXPORTS = {
+    "encrypt_image": "crypto",
+    "decrypt_image": "crypto",
+    "generate_key": "crypto",
+    "encrypt_stream": "crypto",
+    "decrypt_stream": "crypto",
+    "is_stream_encrypted": "crypto",
+    "encrypt_indexed": "crypto",
+    "decrypt_indexed": "crypto",
+    "decrypt_range": "crypto",
+    "decrypt_file": "crypto",
+    "encrypt_tiles": "tiles",
+    "decrypt_tiles": "tiles",
+    "is_tiled_encrypted": "tiles",
+    "TiledImage": "tiles",
+    "Raster": "raster",
+    "open_preview": "raster",
+    "encode_image": "stego",
+    "decode_image": "stego",
+    "decode_payload": "stego",
+    "embedding_capacity": "stego",
+    "lsb_analysis": "stego",
+    "hide_stream": "stego_stream",
+    "reveal_stream": "stego_stream",
+    "PayloadAssembler": "stego_stream",
+    "add_visible_watermark": "watermark",
+    "add_invisible_watermark": "watermark",
+    "detect_invisible_watermark": "watermark",
+    "SignatureIndex": "watermark_index",
+    "verify_watermark": "watermark_index",
+    "verify_watermarks": "watermark_index",
+    "embed_robust_watermark": "robust_watermark",
+    "detect_robust_watermark": "robust_watermark",
+    "add_robust_watermark": "robust_watermark",
+    "detect_robust_watermark_image": "robust_watermark",
+}
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    # Cached as a module attribute, so later lookups skip this function
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,254 @@
+"""
+Headless batch processing of whole directory trees.
+
+Files are processed on a process pool, one task per file. Every finished
+file is appended to a JSON-lines manifest in the output directory, so an
+interrupted job can be re-run and will skip the files that already succeeded
+with the same options.
+A failing file is recorded in the manifest and never stops the rest of the job;
+if a worker process dies, the files it had in flight are recorded as failed and
+the job goes on in a new pool.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+from .crypto import encrypt_indexed, decrypt_file, generate_key
+from .stego import encode_image
+from .watermark import add_visible_watermark, add_invisible_watermark, watermark_file
+from .robust_watermark import add_robust_watermark
+from .workers import ProcessPool, capture_errors, print_progress
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+MANIFEST_NAME = ".imagesecure-manifest.jsonl"
+
+
+def _encrypt(source, destination, options):
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        # Files already run one per process, so chunks are not spread over more threads
+        encrypt_indexed(src, dst, options["key"], workers=1)
+
+
+def _decrypt(source, destination, options):
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        decrypt_file(src, dst, options["key"], workers=1)
+
+
+def _stego(source, destination, options):
+    encoded = encode_image(source, options["message"], options.get("bits", 1), options.get("channels", 3))
+    with open(destination, "wb") as dst:
+        dst.write(encoded.getbuffer())
+
+
+def _watermark(source, destination, options):
+    watermarked, image_format = watermark_file(source, add_visible_watermark, options["text"], options["size"], options["opacity"])
+    watermarked.save(destination, format=image_format)
+
+
+def _invisible_watermark(source, destination, options):
+    watermarked, image_format = watermark_file(source, add_invisible_watermark, options["text"])
+    watermarked.save(destination, format=image_format)
+
+
+def _robust_watermark(source, destination, options):
+    watermarked, image_format = watermark_file(source, add_robust_watermark, options["text"], options.get("key", 0))
+    watermarked.save(destination, format=image_format)
+
+
+# operation name -> (worker, input extensions, output name for a relative input path)
+OPERATIONS = {
+    "encrypt": (_encrypt, IMAGE_EXTENSIONS, lambda rel: rel.with_name(rel.name + ".bin")),
+    "decrypt": (_decrypt, {".bin"}, lambda rel: rel.with_suffix("")),
+    "stego": (_stego, IMAGE_EXTENSIONS, lambda rel: rel.with_suffix(".png")),
+    "watermark": (_watermark, IMAGE_EXTENSIONS, lambda rel: rel),
+    "invisible-watermark": (_invisible_watermark, IMAGE_EXTENSIONS, lambda rel: rel.with_suffix(".png")),
+    "robust-watermark": (_robust_watermark, IMAGE_EXTENSIONS, lambda rel: rel),
+}
+
+
+def _write_output(worker, source, destination, options):
+    partial = destination.with_name(destination.name + ".part")
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        # Write to a side file first so an interrupted job never leaves a truncated output behind
+        worker(source, partial, options)
+        os.replace(partial, destination)
+    except Exception:
+        try:
+            partial.unlink()
+        except OSError:
+            pass
+        raise
+
+
+def run_task(operation, source, destination, options):
+    """Runs one operation on one file inside a worker process. Returns None on success or an error message."""
+    return capture_errors(_write_output, OPERATIONS[operation][0], source, Path(destination), options)[1]
+
+
+def find_inputs(source_dir, extensions):
+    """Yields the paths of the matching files under source_dir, relative to it, in sorted order."""
+    source_dir = Path(source_dir)
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if Path(name).suffix.lower() in extensions:
+                yield (Path(root) / name).relative_to(source_dir)
+
+
+def load_manifest(manifest_path):
+    """Returns the latest manifest record for every relative path, or {} if there is no manifest."""
+    records = {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash; the file is simply processed again
+                    continue
+                records[record["path"]] = record
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def options_digest(options, salt):
+    """
+    Digest of a job's options, recorded in the manifest so that a resumed job only
+    skips files done with the same options. The options hold secrets (AES keys,
+    messages to hide), so this is a salted scrypt hash that makes guessing them
+    from the manifest expensive.
+    """
+    return hashlib.scrypt(repr(sorted(options.items())).encode("utf-8"), salt=salt, n=2**14, r=8, p=1, dklen=16).hex()
+
+
+def _is_done(record, operation, digests, stat):
+    return (
+        record is not None
+        and record.get("status") == "ok"
+        and record.get("operation") == operation
+        and record.get("options_digest") is not None
+        and record.get("options_digest") == digests.get(record.get("options_salt"))
+        and record.get("size") == stat.st_size
+        and record.get("mtime_ns") == stat.st_mtime_ns
+    )
+
+
+def run_batch(operation, source_dir, output_dir, options, workers=None, manifest_path=None,
+              resume=True, progress=None):
+    """
+    Applies an operation to every matching file under source_dir, mirroring the
+    directory layout into output_dir. Returns a (succeeded, failed, skipped) tuple.
+    progress, if given, is called as progress(done, total, relative_path, error).
+    """
+    _, extensions, output_name = OPERATIONS[operation]
+    source_dir = Path(source_dir)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = Path(manifest_path) if manifest_path else output_dir / MANIFEST_NAME
+    previous = load_manifest(manifest_path) if resume else {}
+    # The options digest under every salt found in the manifest; new records reuse one of
+    # those salts, so a manifest normally holds a single one
+    salts = sorted({record["options_salt"] for record in previous.values() if record.get("options_salt")})
+    digests = {salt: options_digest(options, bytes.fromhex(salt)) for salt in salts}
+    salt = salts[0] if salts else os.urandom(16).hex()
+    digest = digests[salt] if salts else options_digest(options, bytes.fromhex(salt))
+
+    pending = []
+    skipped = 0
+    for rel in find_inputs(source_dir, extensions):
+        stat = (source_dir / rel).stat()
+        if _is_done(previous.get(rel.as_posix()), operation, digests, stat) and (output_dir / output_name(rel)).exists():
+            skipped += 1
+            continue
+        pending.append((rel, stat))
+
+    total = len(pending)
+    counts = {"succeeded": 0, "failed": 0}
+    with open(manifest_path, "a", encoding="utf-8") as manifest, ProcessPool(workers) as pool:
+        def finished(item, task_error, pool_error):
+            # pool_error is set when the worker process died (e.g. killed for memory); the
+            # pool is replaced and the rest of the job goes on
+            rel, stat = item
+            error = pool_error or task_error
+            counts["succeeded" if error is None else "failed"] += 1
+            record = {
+                "path": rel.as_posix(),
+                "operation": operation,
+                "options_salt": salt,
+                "options_digest": digest,
+                "status": "ok" if error is None else "error",
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            }
+            if error is not None:
+                record["error"] = error
+            manifest.write(json.dumps(record) + "\n")
+            manifest.flush()
+
+            if progress is not None:
+                progress(counts["succeeded"] + counts["failed"], total, rel.as_posix(), error)
+
+        tasks = (((rel, stat), (operation, str(source_dir / rel), str(output_dir / output_name(rel)), options))
+                 for rel, stat in pending)
+        pool.map_bounded(run_task, tasks, finished)
+
+    return counts["succeeded"], counts["failed"], skipped
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m imagesecure",
+        description="Encrypt, decrypt, hide messages in or watermark every image in a directory tree.",
+    )
+    parser.add_argument("operation", choices=sorted(OPERATIONS))
+    parser.add_argument("source", help="directory to read input files from")
+    parser.add_argument("destination", help="directory to write results to (the layout of source is mirrored)")
+    parser.add_argument("--key", help="AES key for encrypt/decrypt (defaults to the IMAGESECURE_KEY environment variable)")
+    parser.add_argument("--key-length", type=int, choices=[16, 24, 32], default=16, help="AES key length in bytes")
+    parser.add_argument("--message", help="secret message for stego")
+    parser.add_argument("--bits", type=int, choices=[1, 2, 3, 4], default=1, help="low bits per channel used by stego")
+    parser.add_argument("--alpha", action="store_true", help="also hide stego data in the alpha channel")
+    parser.add_argument("--text", help="watermark text for watermark/invisible-watermark/robust-watermark")
+    parser.add_argument("--watermark-key", default="0", help="key that spreads the robust-watermark bits")
+    parser.add_argument("--size", type=int, default=50, help="visible watermark font size")
+    parser.add_argument("--opacity", type=int, default=128, help="visible watermark opacity (0-255)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (defaults to the number of CPUs)")
+    parser.add_argument("--manifest", help="job manifest path (defaults to a file in the destination directory)")
+    parser.add_argument("--no-resume", action="store_true", help="process every file even if the manifest lists it as done")
+    parser.add_argument("--quiet", action="store_true", help="do not print per-file progress")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    options = {}
+    if args.operation in ("encrypt", "decrypt"):
+        key_input = args.key or os.environ.get("IMAGESECURE_KEY")
+        if not key_input:
+            parser.error(f"{args.operation} needs --key or IMAGESECURE_KEY")
+        options["key"] = generate_key(key_input, args.key_length)
+    elif args.operation == "stego":
+        if not args.message:
+            parser.error("stego needs --message")
+        options.update(message=args.message, bits=args.bits, channels=4 if args.alpha else 3)
+    else:
+        if not args.text:
+            parser.error(f"{args.operation} needs --text")
+        options.update(text=args.text, size=args.size, opacity=args.opacity, key=args.watermark_key)
+
+    succeeded, failed, skipped = run_batch(
+        args.operation, args.source, args.destination, options,
+        workers=args.workers,
+        manifest_path=args.manifest,
+        resume=not args.no_resume,
+        progress=None if args.quiet else print_progress,
+    )
+    print(f"{succeeded} succeeded, {failed} failed, {skipped} skipped (already done)", file=sys.stderr)
+    return 1 if failed else 0
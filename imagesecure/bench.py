@@ -0,0 +1,324 @@
+"""
+Reproducible benchmarks and regression checks for every image operation.
+
+Each (operation, image size) case runs on a seeded synthetic image in a fresh
+worker process, so its peak RSS is not polluted by earlier cases. A case
+records latency percentiles over several runs, throughput in megapixels per
+second and memory use: the growth of the peak RSS over the memory held once
+the inputs are prepared, which is what the operation itself needs. Results can
+be saved as a baseline and later runs compared against it; the run fails when a
+case gets slower (or its operation uses more memory) than the baseline by more
+than the given threshold.
+
+    python -m imagesecure.bench --sizes 0.1 1 12 50 --output baseline.json
+    python -m imagesecure.bench --sizes 0.1 1 12 50 --baseline baseline.json --threshold 0.2
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from .crypto import encrypt_image, decrypt_image, encrypt_stream, decrypt_stream, encrypt_indexed, decrypt_indexed
+from .stego import encode_image, decode_image, lsb_analysis
+from .tiles import TiledImage, encrypt_tiles
+from .watermark import add_visible_watermark, add_invisible_watermark, detect_invisible_watermark
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = (0.1, 1, 4)
+# RSS growth below this many MB is within allocator noise and never a regression
+RSS_SLACK_MB = 16
+BENCH_KEY = b"0123456789abcdef"
+BENCH_MESSAGE = "benchmark message " * 64
+BENCH_WATERMARK = "ImageSecure"
+
+
+def synthetic_image(megapixels, seed=0):
+    """Deterministic 3:2 RGB test image with gradients, blocks and sensor-like noise."""
+    width = max(1, int(round(math.sqrt(megapixels * 1e6 * 3 / 2))))
+    height = max(1, int(round(megapixels * 1e6 / width)))
+    rng = np.random.default_rng(seed)
+    x = np.arange(width, dtype=np.uint16)
+    y = np.arange(height, dtype=np.uint16)[:, None]
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    for channel in range(3):
+        # uint16 arithmetic wraps cheaply and keeps memory at a few bytes per pixel
+        gradient = (x * (channel + 1) // 16 + y * (3 - channel) // 16 + (x // 64) * (y // 64) * 7)
+        pixels[..., channel] = (gradient & 0xFF).astype(np.uint8)
+    pixels += rng.integers(0, 4, size=pixels.shape, dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def _png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    buffer.seek(0)
+    return buffer
+
+
+def _rewind(buffer):
+    buffer.seek(0)
+    return buffer
+
+
+# Every case turns a synthetic image into a zero-argument callable, so only the
+# operation itself is timed and its inputs are prepared once
+def _case_encode_image(image):
+    png = _png(image)
+    return lambda: encode_image(_rewind(png), BENCH_MESSAGE)
+
+
+def _case_decode_image(image):
+    encoded = encode_image(_png(image), BENCH_MESSAGE)
+    return lambda: decode_image(_rewind(encoded))
+
+
+def _case_lsb_analysis(image):
+    png = _png(image)
+    return lambda: lsb_analysis(_rewind(png))
+
+
+def _case_add_visible_watermark(image):
+    return lambda: add_visible_watermark(image, BENCH_WATERMARK, 50, 128)
+
+
+def _case_add_invisible_watermark(image):
+    return lambda: add_invisible_watermark(image, BENCH_WATERMARK)
+
+
+def _case_detect_invisible_watermark(image):
+    marked = add_invisible_watermark(image, BENCH_WATERMARK)
+    return lambda: detect_invisible_watermark(marked, len(BENCH_WATERMARK))
+
+
+def _case_encrypt_image(image):
+    data = _png(image).getvalue()
+    return lambda: encrypt_image(data, BENCH_KEY)
+
+
+def _case_decrypt_image(image):
+    data = encrypt_image(_png(image).getvalue(), BENCH_KEY)
+    return lambda: decrypt_image(data, BENCH_KEY)
+
+
+def _case_encrypt_stream(image):
+    png = _png(image)
+    return lambda: encrypt_stream(_rewind(png), io.BytesIO(), BENCH_KEY)
+
+
+def _case_decrypt_stream(image):
+    encrypted = io.BytesIO()
+    encrypt_stream(_png(image), encrypted, BENCH_KEY)
+    return lambda: decrypt_stream(_rewind(encrypted), io.BytesIO(), BENCH_KEY)
+
+
+def _case_encrypt_indexed(image):
+    png = _png(image)
+    return lambda: encrypt_indexed(_rewind(png), io.BytesIO(), BENCH_KEY)
+
+
+def _case_decrypt_indexed(image):
+    encrypted = io.BytesIO()
+    encrypt_indexed(_png(image), encrypted, BENCH_KEY)
+    return lambda: decrypt_indexed(_rewind(encrypted), io.BytesIO(), BENCH_KEY)
+
+
+def _case_encrypt_tiles(image):
+    return lambda: encrypt_tiles(image, io.BytesIO(), BENCH_KEY)
+
+
+def _case_decrypt_tile_viewport(image):
+    encrypted = io.BytesIO()
+    encrypt_tiles(image, encrypted, BENCH_KEY)
+    # A 1024x768 viewport in the middle of the image, as a tiled viewer would request
+    left, top = max(0, image.width // 2 - 512), max(0, image.height // 2 - 384)
+    box = (left, top, left + 1024, top + 768)
+    return lambda: TiledImage(_rewind(encrypted), BENCH_KEY).read_region(box)
+
+
+CASES = {
+    "encode_image": _case_encode_image,
+    "decode_image": _case_decode_image,
+    "lsb_analysis": _case_lsb_analysis,
+    "add_visible_watermark": _case_add_visible_watermark,
+    "add_invisible_watermark": _case_add_invisible_watermark,
+    "detect_invisible_watermark": _case_detect_invisible_watermark,
+    "encrypt_image": _case_encrypt_image,
+    "decrypt_image": _case_decrypt_image,
+    "encrypt_stream": _case_encrypt_stream,
+    "decrypt_stream": _case_decrypt_stream,
+    "encrypt_indexed": _case_encrypt_indexed,
+    "decrypt_indexed": _case_decrypt_indexed,
+    "encrypt_tiles": _case_encrypt_tiles,
+    "decrypt_tile_viewport": _case_decrypt_tile_viewport,
+}
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where unsupported."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _reset_peak_rss():
+    """
+    Lowers the recorded peak RSS to the current RSS where the platform allows it
+    (Linux), so memory that preparing a case used and freed again does not hide
+    the peak of the operation itself.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _percentile(samples, percent):
+    ordered = sorted(samples)
+    rank = max(0, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def run_case(operation, megapixels, repeat=5, seed=0):
+    """Times one operation on one synthetic image size and returns its result record."""
+    image = synthetic_image(megapixels, seed)
+    run = CASES[operation](image)
+    _reset_peak_rss()
+    rss_before = _peak_rss_mb()
+    # One untimed warm-up run loads lazy imports and fills caches the way real use does
+    run()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    rss_after = _peak_rss_mb()
+    p50 = _percentile(samples, 50)
+    return {
+        "operation": operation,
+        "megapixels": megapixels,
+        "width": image.width,
+        "height": image.height,
+        "runs": repeat,
+        "mean_ms": sum(samples) / len(samples),
+        "p50_ms": p50,
+        "p90_ms": _percentile(samples, 90),
+        "p99_ms": _percentile(samples, 99),
+        "throughput_mp_s": megapixels / (p50 / 1000) if p50 else None,
+        "peak_rss_mb": rss_after,
+        # Memory the operation needs on top of its prepared inputs
+        "rss_growth_mb": None if rss_before is None else rss_after - rss_before,
+    }
+
+
+def run_benchmarks(operations, sizes, repeat=5, isolate=True, progress=None):
+    """Runs every (operation, size) case, each in a fresh process unless isolate is False."""
+    results = []
+    for megapixels in sizes:
+        for operation in operations:
+            if isolate:
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    result = pool.submit(run_case, operation, megapixels, repeat).result()
+            else:
+                result = run_case(operation, megapixels, repeat)
+            results.append(result)
+            if progress is not None:
+                progress(result)
+    return results
+
+
+def _environment():
+    import cryptography
+    import PIL
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "cryptography": cryptography.__version__,
+    }
+
+
+def compare(results, baseline, threshold=0.2, rss_threshold=0.25):
+    """
+    Compares results with baseline results and returns a list of regression messages.
+    A case regresses when its median latency grows by more than threshold, or its
+    RSS growth by more than rss_threshold (fractions, so 0.2 means 20%) and more than
+    RSS_SLACK_MB. The whole-process peak is not compared: it is mostly the inputs.
+    """
+    previous = {(r["operation"], r["megapixels"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["operation"], result["megapixels"]))
+        if before is None:
+            continue
+        name = f"{result['operation']} @ {result['megapixels']} MP"
+        if result["p50_ms"] > before["p50_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p50 {before['p50_ms']:.1f} ms -> {result['p50_ms']:.1f} ms")
+        growth, growth_before = result["rss_growth_mb"], before.get("rss_growth_mb")
+        if growth is not None and growth_before is not None and growth > max(growth_before * (1 + rss_threshold), growth_before + RSS_SLACK_MB):
+            regressions.append(f"{name}: RSS growth {growth_before:.0f} MB -> {growth:.0f} MB")
+    return regressions
+
+
+def _print_result(result):
+    rss = "n/a" if result["peak_rss_mb"] is None else f"{result['peak_rss_mb']:.0f} MB (+{result['rss_growth_mb']:.0f} MB)"
+    throughput = "n/a" if result["throughput_mp_s"] is None else f"{result['throughput_mp_s']:.1f}"
+    print(
+        f"{result['operation']:<28} {result['megapixels']:>6} MP  "
+        f"p50 {result['p50_ms']:>9.1f} ms  p90 {result['p90_ms']:>9.1f} ms  p99 {result['p99_ms']:>9.1f} ms  "
+        f"{throughput:>8} MP/s  peak RSS {rss}",
+        flush=True,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m imagesecure.bench", description="Benchmark the image operations.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=list(DEFAULT_SIZES), help="image sizes in megapixels (0.1 to 50)")
+    parser.add_argument("--ops", nargs="+", choices=sorted(CASES), default=list(CASES), help="operations to benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    parser.add_argument("--output", help="write the results as JSON (use as a later --baseline)")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed median latency growth over the baseline (0.2 = 20%%)")
+    parser.add_argument("--rss-threshold", type=float, default=0.25, help="allowed growth of the memory an operation uses over the baseline")
+    parser.add_argument("--no-isolate", action="store_true", help="run every case in this process (peak RSS becomes cumulative)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.ops, args.sizes, args.repeat, isolate=not args.no_isolate, progress=_print_result)
+    report = {"environment": _environment(), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.rss_threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions against the baseline.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+In-memory output buffers with an optional spill to an anonymous temporary file.
+
+Outputs are written to a SpillBuffer instead of named files in the working
+directory, so concurrent users never share a path and nothing is written to
+disk for ordinary sizes. Past the spill threshold the content moves to an
+unnamed temporary file, so very large outputs do not sit in RAM.
+"""
+import io
+import mmap
+import os
+import tempfile
+
+# Outputs larger than this many bytes are moved to a temporary file
+SPILL_THRESHOLD = int(os.environ.get("IMAGESECURE_SPILL_MB", "64")) * 1024 * 1024
+
+
+class SpillBuffer(io.RawIOBase):
+    """
+    Readable, writable and seekable binary buffer. It is a RawIOBase, so it can be
+    handed to anything that reads files, including PIL and st.download_button.
+    """
+
+    def __init__(self, spill_threshold=SPILL_THRESHOLD):
+        super().__init__()
+        self.spill_threshold = spill_threshold
+        self._file = io.BytesIO()
+
+    @property
+    def in_memory(self):
+        return isinstance(self._file, io.BytesIO)
+
+    @property
+    def memory_size(self):
+        """Bytes of RAM held by the content (0 once it has spilled to disk)."""
+        return self._file.getbuffer().nbytes if self.in_memory else 0
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _spill(self):
+        spilled = tempfile.TemporaryFile()
+        spilled.write(self._file.getbuffer())
+        spilled.seek(self._file.tell())
+        self._file = spilled
+
+    def write(self, data):
+        if self.in_memory and self.spill_threshold is not None:
+            end = self._file.tell() + memoryview(data).nbytes
+            if end > self.spill_threshold:
+                self._spill()
+        return self._file.write(data)
+
+    def readinto(self, buffer):
+        return self._file.readinto(buffer)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def getbuffer(self):
+        """
+        Zero-copy read-only view of the whole content: the in-memory buffer itself,
+        or a memory map of the temporary file once spilled. Release the view (or use
+        it in a with block) before writing again.
+        """
+        if self.in_memory:
+            return self._file.getbuffer().toreadonly()
+        self._file.flush()
+        if os.fstat(self._file.fileno()).st_size == 0:
+            return memoryview(b"")
+        return memoryview(mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
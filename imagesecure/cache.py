@@ -0,0 +1,101 @@
+"""
+Size-bounded memoization of decoded images and operation results.
+
+Entries are keyed by a digest of the input content plus the operation
+parameters, so identical work is never repeated, and the least recently used
+entries are evicted once the cached values exceed the byte budget.
+"""
+import hashlib
+import os
+import sys
+from collections import OrderedDict
+
+from PIL import Image
+
+from .buffers import SpillBuffer
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Cache keys are keyed hashes, so a key seen outside this process cannot be used to test guesses
+_KEY_SALT = os.urandom(16)
+
+
+def content_digest(data):
+    """Hex digest of a bytes-like object (bytes, bytearray or memoryview), without copying it."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def make_key(operation, digest, *params):
+    """
+    Cache key for an operation on the content with the given digest. The parameters
+    are hashed too, so secrets such as AES keys never sit in the cache in plain form;
+    pass large or secret values (a payload to hide) as their content_digest.
+    """
+    return hashlib.blake2b(repr((operation, digest, params)).encode("utf-8"), digest_size=16, key=_KEY_SALT).hexdigest()
+
+
+def sizeof(value):
+    """Approximate memory held by a cached value, in bytes."""
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, SpillBuffer):
+        return value.memory_size
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(sizeof(item) for item in value)
+    if hasattr(value, "getbuffer"):
+        return value.getbuffer().nbytes
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """LRU cache bounded by the total size of its values rather than their count."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def put(self, key, value):
+        """Stores a value, evicting the least recently used entries to stay under max_bytes."""
+        size = sizeof(value)
+        self.discard(key)
+        if size > self.max_bytes:
+            # Would evict everything else and still not fit
+            return
+        self._entries[key] = (value, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.nbytes -= evicted_size
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for key, calling compute() and caching its result on a miss. Errors are not cached."""
+        if key in self._entries:
+            return self.get(key)
+        value = compute()
+        self.put(key, value)
+        return value
@@ -0,0 +1,361 @@
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.exceptions import InvalidTag
+import io
+import os
+import struct
+
+from .profiling import profiled, span
+from .workers import ordered_map
+
+# Streaming container: MAGIC | chunk size (4 bytes) | nonce prefix (7 bytes), followed by
+# AES-GCM sealed chunks of `chunk size` plaintext bytes, each carrying a 16-byte tag.
+# Every chunk nonce is the prefix, a 4-byte chunk counter and a final-chunk flag, so
+# chunks cannot be reordered, dropped or truncated without failing authentication.
+STREAM_MAGIC = b"ISS1"
+STREAM_HEADER = struct.Struct(">4sI7s")
+STREAM_CHUNK_SIZE = 64 * 1024
+TAG_SIZE = 16
+
+# Indexed container: MAGIC | chunk size (4 bytes) | salt (16 bytes) | plaintext length
+# (8 bytes), followed by the same sealed chunks. The header is the chunk index: every
+# chunk but the last holds exactly `chunk size` bytes, so chunk i starts at header +
+# i * (chunk size + 16). Chunks are sealed and opened in parallel, and any byte range
+# can be decrypted without touching the rest of the file. Each file is sealed under
+# its own key, derived with HKDF-SHA256 from the key and the random salt, so nonces
+# never repeat across files however many are written under one key.
+INDEXED_MAGIC = b"ISS3"
+INDEXED_HEADER = struct.Struct(">4sI16sQ")
+INDEXED_CHUNK_SIZE = 1024 * 1024
+# Earlier indexed files (read only) have a 7-byte nonce prefix instead of the salt and
+# use the key directly
+LEGACY_INDEXED_MAGIC = b"ISS2"
+LEGACY_INDEXED_HEADER = struct.Struct(">4sI7sQ")
+_INDEXED_HEADERS = {INDEXED_MAGIC: INDEXED_HEADER, LEGACY_INDEXED_MAGIC: LEGACY_INDEXED_HEADER}
+
+# Largest chunk size accepted from a header, so a hostile file cannot force a huge allocation
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+# Function to add padding to the image bytes
+def pad_data(data):
+    try:
+        padder = padding.PKCS7(128).padder()  # AES block size is 128 bits (16 bytes)
+        padded_data = padder.update(data) + padder.finalize()
+        return padded_data
+    except Exception as e:
+        raise ValueError(f"Padding Error: {e}")
+
+
+# Function to remove padding after decryption
+def unpad_data(data):
+    try:
+        unpadder = padding.PKCS7(128).unpadder()
+        unpadded_data = unpadder.update(data) + unpadder.finalize()
+        return unpadded_data
+    except Exception as e:
+        raise ValueError(f"Unpadding Error: {e}")
+
+
+# Function to encrypt image using AES with a user-provided key
+@profiled("encrypt_image")
+def encrypt_image(image_bytes, key):
+    try:
+        cipher = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
+        encryptor = cipher.encryptor()
+
+        # Pad the image bytes before encryption
+        with span("encrypt_image.pad", nbytes=len(image_bytes)):
+            padded_bytes = pad_data(image_bytes)
+        with span("encrypt_image.aes", nbytes=len(padded_bytes)):
+            encrypted_bytes = encryptor.update(padded_bytes) + encryptor.finalize()
+        return encrypted_bytes
+    except Exception as e:
+        raise ValueError(f"Encryption Error: {e}")
+
+
+# Function to decrypt image using AES with a user-provided key
+@profiled("decrypt_image")
+def decrypt_image(encrypted_bytes, key):
+    try:
+        cipher = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
+        decryptor = cipher.decryptor()
+        with span("decrypt_image.aes", nbytes=len(encrypted_bytes)):
+            decrypted_bytes = decryptor.update(encrypted_bytes) + decryptor.finalize()
+
+        # Remove padding after decryption
+        with span("decrypt_image.unpad", nbytes=len(decrypted_bytes)):
+            unpadded_bytes = unpad_data(decrypted_bytes)
+        return unpadded_bytes
+    except ValueError as e:
+        raise ValueError(f"Decryption Error: Invalid padding or incorrect key - {e}")
+    except Exception as e:
+        raise ValueError(f"Decryption Error: {e}")
+
+
+# Function to generate the AES key based on user input
+def generate_key(key_input, length):
+    try:
+        key = key_input.encode('utf-8')
+        if len(key) < length:
+            # Pad the key with null bytes if it's shorter than the selected length
+            key = key.ljust(length, b'\0')
+        elif len(key) > length:
+            # Truncate the key if it's longer than the selected length
+            key = key[:length]
+        return key
+    except Exception as e:
+        raise ValueError(f"Key Generation Error: {e}")
+
+
+def _chunk_nonce(prefix, index, final):
+    return prefix + struct.pack(">IB", index, 1 if final else 0)
+
+
+def derive_file_key(key, salt, info):
+    """The 256-bit key one file is sealed under, derived with HKDF-SHA256 from the user's key and its salt."""
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=info).derive(key)
+
+
+def _check_chunk_size(chunk_size):
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"The chunk size must be between 1 and {MAX_CHUNK_SIZE} bytes.")
+
+
+def is_stream_encrypted(header_bytes):
+    """Returns True if the bytes start with the streaming container header."""
+    return header_bytes[:len(STREAM_MAGIC)] == STREAM_MAGIC
+
+
+@profiled("encrypt_stream")
+def encrypt_stream(source, destination, key, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Encrypts a readable file-like object into a writable one with chunked AES-GCM.
+    Only one chunk is held in memory at a time, whatever the input size.
+    Returns the number of bytes written.
+    """
+    _check_chunk_size(chunk_size)
+    aesgcm = AESGCM(key)
+    header = STREAM_HEADER.pack(STREAM_MAGIC, chunk_size, os.urandom(7))
+    prefix = header[-7:]
+    destination.write(header)
+    written = len(header)
+
+    index = 0
+    chunk = source.read(chunk_size)
+    while True:
+        # Read one chunk ahead so the last chunk can be flagged as final
+        next_chunk = source.read(chunk_size)
+        final = not next_chunk
+        sealed = aesgcm.encrypt(_chunk_nonce(prefix, index, final), chunk, header)
+        destination.write(sealed)
+        written += len(sealed)
+        if final:
+            return written
+        chunk = next_chunk
+        index += 1
+
+
+@profiled("decrypt_stream")
+def decrypt_stream(source, destination, key):
+    """
+    Decrypts a streaming container produced by encrypt_stream chunk by chunk.
+    Raises ValueError on a wrong key, a corrupted chunk or a truncated stream.
+    Returns the number of plaintext bytes written.
+    """
+    header = source.read(STREAM_HEADER.size)
+    if len(header) != STREAM_HEADER.size or not is_stream_encrypted(header):
+        raise ValueError("Decryption Error: not a streaming encrypted file")
+    _, chunk_size, prefix = STREAM_HEADER.unpack(header)
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError("Decryption Error: corrupted header")
+    aesgcm = AESGCM(key)
+
+    written = 0
+    index = 0
+    sealed = source.read(chunk_size + TAG_SIZE)
+    while True:
+        next_sealed = source.read(chunk_size + TAG_SIZE)
+        final = not next_sealed
+        try:
+            chunk = aesgcm.decrypt(_chunk_nonce(prefix, index, final), sealed, header)
+        except InvalidTag:
+            raise ValueError("Decryption Error: incorrect key or corrupted data")
+        destination.write(chunk)
+        written += len(chunk)
+        if final:
+            return written
+        sealed = next_sealed
+        index += 1
+
+
+def is_indexed_encrypted(header_bytes):
+    """Returns True if the bytes start with an indexed container header (of any version)."""
+    return bytes(header_bytes[:len(INDEXED_MAGIC)]) in _INDEXED_HEADERS
+
+
+def indexed_header_size(header_bytes):
+    """Size of the indexed container header whose first 4 bytes (the magic) are given."""
+    layout = _INDEXED_HEADERS.get(bytes(header_bytes[:len(INDEXED_MAGIC)]))
+    if layout is None:
+        raise ValueError("Decryption Error: not an indexed encrypted file")
+    return layout.size
+
+
+def _indexed_cipher(key, header):
+    """The AES-GCM instance and nonce prefix sealing the chunks of the indexed container with this header."""
+    if header[:len(LEGACY_INDEXED_MAGIC)] == LEGACY_INDEXED_MAGIC:
+        return AESGCM(key), header[8:15]
+    file_key = derive_file_key(key, header[8:24], INDEXED_MAGIC + b" chunks")
+    # The key is used by this file only, so the chunk counter alone keeps nonces unique
+    return AESGCM(file_key), bytes(7)
+
+
+def _chunk_count(length, chunk_size):
+    # An empty plaintext is still sealed as one (empty) final chunk
+    return max(1, -(-length // chunk_size))
+
+
+def read_indexed_header(source):
+    """
+    Reads an indexed container header (of any version) from source.
+    Returns (header, chunk size, plaintext length).
+    """
+    magic = source.read(len(INDEXED_MAGIC))
+    header = magic + source.read(indexed_header_size(magic) - len(magic))
+    layout = _INDEXED_HEADERS[magic]
+    if len(header) != layout.size:
+        raise ValueError("Decryption Error: truncated header")
+    _, chunk_size, _, length = layout.unpack(header)
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError("Decryption Error: corrupted header")
+    return header, chunk_size, length
+
+
+def indexed_sealer(key, length, chunk_size=INDEXED_CHUNK_SIZE):
+    """
+    Starts an indexed container for `length` plaintext bytes, for callers that
+    receive the plaintext piece by piece. Returns (header, seal, chunk count);
+    seal(index, chunk) returns sealed chunk `index` and is safe to call from threads.
+    """
+    _check_chunk_size(chunk_size)
+    count = _chunk_count(length, chunk_size)
+    header = INDEXED_HEADER.pack(INDEXED_MAGIC, chunk_size, os.urandom(16), length)
+    aesgcm, prefix = _indexed_cipher(key, header)
+
+    def seal(index, chunk):
+        return aesgcm.encrypt(_chunk_nonce(prefix, index, index == count - 1), chunk, header)
+    return header, seal, count
+
+
+def indexed_opener(key, header):
+    """
+    Opens the chunks of an indexed container given its header bytes.
+    Returns (open_chunk, chunk count, chunk size, plaintext length); open_chunk(index,
+    sealed) returns the plaintext of chunk `index` and is safe to call from threads.
+    """
+    header, chunk_size, length = read_indexed_header(io.BytesIO(header))
+    aesgcm, prefix = _indexed_cipher(key, header)
+    count = _chunk_count(length, chunk_size)
+
+    def open_chunk(index, sealed):
+        expected = min(chunk_size, length - index * chunk_size) + TAG_SIZE
+        if len(sealed) != expected:
+            raise ValueError("Decryption Error: truncated data")
+        try:
+            return aesgcm.decrypt(_chunk_nonce(prefix, index, index == count - 1), sealed, header)
+        except InvalidTag:
+            raise ValueError("Decryption Error: incorrect key or corrupted data")
+    return open_chunk, count, chunk_size, length
+
+
+@profiled("encrypt_indexed")
+def encrypt_indexed(source, destination, key, chunk_size=INDEXED_CHUNK_SIZE, workers=None):
+    """
+    Encrypts a seekable file-like object (from its current position to the end)
+    into the indexed container, sealing chunks in parallel on `workers` threads.
+    Returns the number of bytes written.
+    """
+    position = source.tell()
+    length = source.seek(0, os.SEEK_END) - position
+    source.seek(position)
+
+    header, seal, count = indexed_sealer(key, length, chunk_size)
+    destination.write(header)
+    written = len(header)
+
+    # Chunks are read lazily, only as fast as the pool consumes them
+    chunks = ((index, source.read(chunk_size)) for index in range(count))
+    with span("encrypt_indexed.seal", nbytes=length):
+        for sealed in ordered_map(seal, chunks, workers):
+            destination.write(sealed)
+            written += len(sealed)
+    return written
+
+
+@profiled("decrypt_indexed")
+def decrypt_indexed(source, destination, key, workers=None):
+    """
+    Decrypts a whole indexed container, opening chunks in parallel on `workers`
+    threads. The source is read sequentially and need not be seekable.
+    Raises ValueError on a wrong key, corrupted or truncated data.
+    Returns the number of plaintext bytes written.
+    """
+    open_chunk, count, chunk_size, _ = indexed_opener(key, read_indexed_header(source)[0])
+
+    chunks = ((index, source.read(chunk_size + TAG_SIZE)) for index in range(count))
+    written = 0
+    with span("decrypt_indexed.open") as stage:
+        for chunk in ordered_map(open_chunk, chunks, workers):
+            destination.write(chunk)
+            written += len(chunk)
+        stage.add(nbytes=written)
+    if source.read(1):
+        raise ValueError("Decryption Error: unexpected data after the last chunk")
+    return written
+
+
+@profiled("decrypt_range")
+def decrypt_range(source, key, start, size, workers=None):
+    """
+    Decrypts only plaintext bytes [start, start + size) of a seekable indexed
+    container; only the chunks overlapping the range are read and authenticated.
+    The range is clipped to the end of the plaintext. Returns bytes.
+    """
+    source.seek(0)
+    header = read_indexed_header(source)[0]
+    open_chunk, _, chunk_size, length = indexed_opener(key, header)
+    start = max(0, start)
+    end = min(length, start + max(0, size))
+    if start >= end:
+        return b""
+
+    first, last = start // chunk_size, (end - 1) // chunk_size
+
+    def read_chunk(index):
+        source.seek(len(header) + index * (chunk_size + TAG_SIZE))
+        return index, source.read(chunk_size + TAG_SIZE)
+
+    chunks = (read_chunk(index) for index in range(first, last + 1))
+    plaintext = b"".join(ordered_map(open_chunk, chunks, workers))
+    offset = start - first * chunk_size
+    return plaintext[offset:offset + end - start]
+
+
+def decrypt_file(source, destination, key, workers=None):
+    """
+    Decrypts any file written by this package: the indexed container, the
+    streaming container or the legacy AES-ECB format, told apart by the header.
+    Returns the number of plaintext bytes written.
+    """
+    magic = source.read(len(INDEXED_MAGIC))
+    source.seek(-len(magic), os.SEEK_CUR)
+    if is_indexed_encrypted(magic):
+        return decrypt_indexed(source, destination, key, workers)
+    if is_stream_encrypted(magic):
+        return decrypt_stream(source, destination, key)
+    # Legacy AES-ECB file: read and decrypt in one piece
+    return destination.write(decrypt_image(source.read(), key))
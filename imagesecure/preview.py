@@ -0,0 +1,67 @@
+"""Bounded-size previews, whose cost does not grow with the size of the image."""
+import io
+import math
+
+import numpy as np
+from PIL import Image
+
+from .profiling import span
+from .raster import open_preview
+
+# Longest side of generated previews, in pixels
+PREVIEW_MAX_SIZE = 512
+# Longest side of images shown on screen: a full-width column on a high-DPI display
+DISPLAY_MAX_SIZE = 1280
+DISPLAY_QUALITY = 85
+
+
+def ciphertext_preview(ciphertext, image_size, max_size=PREVIEW_MAX_SIZE):
+    """
+    Grayscale thumbnail of ciphertext laid out row by row over an image of
+    image_size (width, height), as if each byte were one pixel; pixels past the
+    end of the ciphertext are black.
+
+    ciphertext is any bytes-like object (e.g. SpillBuffer.getbuffer()). Only the
+    bytes that land on a thumbnail pixel are read, so neither a full-size array
+    nor a copy of the ciphertext is ever made.
+    """
+    width, height = image_size
+    step = max(1, math.ceil(max(width, height) / max_size))
+    data = np.frombuffer(ciphertext, dtype=np.uint8)
+
+    # Byte offset of the top-left source pixel of every thumbnail pixel
+    rows = np.arange(0, height, step, dtype=np.int64)
+    cols = np.arange(0, width, step, dtype=np.int64)
+    offsets = rows[:, None] * width + cols[None, :]
+
+    thumbnail = np.zeros(offsets.shape, dtype=np.uint8)
+    inside = offsets < data.size
+    thumbnail[inside] = data[offsets[inside]]
+    return Image.fromarray(thumbnail, mode="L")
+
+
+def display_preview(source, max_size=DISPLAY_MAX_SIZE, format=None, quality=DISPLAY_QUALITY):
+    """
+    Encoded copy of an image, no larger than max_size on its longest side, for
+    on-screen display; returns bytes. source is a path, a file-like object or a
+    PIL image. Files are decoded at reduced scale where the format allows (see
+    open_preview), so showing a large upload never decodes it in full.
+
+    Opaque images are encoded as JPEG and images with transparency as PNG, the
+    two formats Streamlit passes to the browser without re-encoding; format
+    (e.g. "WEBP") overrides the choice.
+    """
+    with span("display_preview.decode"):
+        preview = open_preview(source, max_size)
+    alpha = preview.mode in ("RGBA", "LA", "PA") or "transparency" in preview.info
+    format = format or ("PNG" if alpha else "JPEG")
+    if format == "JPEG":
+        if preview.mode not in ("L", "RGB"):
+            preview = preview.convert("RGB")
+    elif preview.mode not in ("L", "LA", "RGB", "RGBA"):
+        preview = preview.convert("RGBA" if alpha else "RGB")
+    output = io.BytesIO()
+    with span("display_preview.encode", pixels=preview.width * preview.height) as stage:
+        preview.save(output, format=format, quality=quality)
+        stage.add(nbytes=output.tell())
+    return output.getvalue()
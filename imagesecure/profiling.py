@@ -0,0 +1,203 @@
+"""
+Opt-in timing spans and byte/pixel counters for the stages of every operation.
+
+    from imagesecure import profiling
+    profiling.enable()
+    encode_image(...)
+    print(profiling.prometheus_text())
+
+Operations are decorated with profiled(name) and wrap each stage (decoding,
+the pixel work, AES, PNG encoding...) in `with span("name.stage", pixels=n):`.
+Spans nest per thread and are aggregated per name; the most recent MAX_SPANS
+are also kept for export as a JSON trace (Chrome trace event format, viewable
+in chrome://tracing or Perfetto) and totals as Prometheus text metrics.
+
+Profiling is off unless IMAGESECURE_PROFILE=1 or enable() is called. Off, a
+span costs one flag check and returns a shared no-op object. Spans are
+recorded per process: work done in batch or service worker processes is not
+seen by the parent.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Number of most recent spans kept for traces
+MAX_SPANS = 10000
+
+_enabled = os.environ.get("IMAGESECURE_PROFILE", "0") == "1"
+_lock = threading.Lock()
+_spans = deque(maxlen=MAX_SPANS)
+# name -> [calls, nanoseconds, bytes, pixels, errors]
+_totals = {}
+_local = threading.local()
+
+
+def enable():
+    """Turns profiling on for this process."""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Turns profiling off; recorded spans are kept until reset()."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Forgets every recorded span and total."""
+    with _lock:
+        _spans.clear()
+        _totals.clear()
+
+
+class _NullSpan:
+    """Returned by span() while profiling is off."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, nbytes=0, pixels=0):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """One timed stage. add() counts bytes and pixels found out while it runs."""
+    __slots__ = ("name", "nbytes", "pixels", "start", "duration", "thread", "depth", "error")
+
+    def __init__(self, name, nbytes=0, pixels=0):
+        self.name = name
+        self.nbytes = nbytes
+        self.pixels = pixels
+        self.error = False
+
+    def add(self, nbytes=0, pixels=0):
+        self.nbytes += nbytes
+        self.pixels += pixels
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault("stack", [])
+        self.depth = len(stack)
+        stack.append(self)
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter_ns() - self.start
+        _local.stack.pop()
+        self.error = exc_type is not None
+        with _lock:
+            _spans.append(self)
+            totals = _totals.setdefault(self.name, [0, 0, 0, 0, 0])
+            totals[0] += 1
+            totals[1] += self.duration
+            totals[2] += self.nbytes
+            totals[3] += self.pixels
+            totals[4] += self.error
+        return False
+
+
+def span(name, nbytes=0, pixels=0):
+    """Context manager timing one stage named name, counting nbytes and pixels."""
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, nbytes, pixels)
+
+
+def profiled(name):
+    """Decorator wrapping every call of a function in a span named name."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def summary():
+    """
+    Totals per span name, sorted by name: calls, errors, seconds, mean milliseconds,
+    bytes, pixels and the resulting MB/s and MP/s (None where nothing was counted).
+    """
+    with _lock:
+        totals = {name: list(values) for name, values in _totals.items()}
+    rows = []
+    for name, (calls, nanoseconds, nbytes, pixels, errors) in sorted(totals.items()):
+        seconds = nanoseconds / 1e9
+        rows.append({
+            "span": name,
+            "calls": calls,
+            "errors": errors,
+            "seconds": seconds,
+            "mean_ms": seconds * 1000 / calls,
+            "bytes": nbytes,
+            "pixels": pixels,
+            "mb_per_s": nbytes / 1e6 / seconds if nbytes and seconds else None,
+            "mp_per_s": pixels / 1e6 / seconds if pixels and seconds else None,
+        })
+    return rows
+
+
+def _label(name):
+    return name.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text(prefix="imagesecure"):
+    """Totals in the Prometheus text exposition format."""
+    metrics = [
+        ("span_seconds_total", "Time spent in each operation stage.", "seconds"),
+        ("span_calls_total", "Number of times each operation stage ran.", "calls"),
+        ("span_errors_total", "Number of times each operation stage raised.", "errors"),
+        ("span_bytes_total", "Bytes processed by each operation stage.", "bytes"),
+        ("span_pixels_total", "Pixels processed by each operation stage.", "pixels"),
+    ]
+    rows = summary()
+    lines = []
+    for metric, description, field in metrics:
+        lines.append(f"# HELP {prefix}_{metric} {description}")
+        lines.append(f"# TYPE {prefix}_{metric} counter")
+        for row in rows:
+            lines.append(f'{prefix}_{metric}{{span="{_label(row["span"])}"}} {row[field]}')
+    return "\n".join(lines) + "\n"
+
+
+def trace():
+    """The recorded spans as a Chrome trace event format dictionary (times in microseconds)."""
+    with _lock:
+        spans = list(_spans)
+    pid = os.getpid()
+    events = []
+    for recorded in sorted(spans, key=lambda item: item.start):
+        events.append({
+            "name": recorded.name,
+            "ph": "X",
+            "ts": recorded.start / 1000,
+            "dur": recorded.duration / 1000,
+            "pid": pid,
+            "tid": recorded.thread,
+            "args": {"bytes": recorded.nbytes, "pixels": recorded.pixels, "depth": recorded.depth, "error": recorded.error},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def trace_json():
+    """trace() serialized as JSON."""
+    return json.dumps(trace())
@@ -0,0 +1,194 @@
+"""
+Shared image I/O: lazy decoding, row-strip access, memory-mapped pixel arrays
+and cheap previews.
+
+Operations that touch only part of an image (stego headers and payloads, the
+LSB watermark) read and write just the rows they need, so no full-size NumPy
+copy of the raster is ever made. Operations that need every pixel get a single
+array filled strip by strip; past MEMMAP_THRESHOLD bytes it is a memory map of
+an anonymous temporary file, whose pages the OS can write out and drop, so a
+100+ MP image does not keep several resident copies.
+
+Limit: Pillow decodes a file in one pass, so only the leading rows of a PNG
+can be decoded on their own. The first strip read past them decodes the whole
+image once, into a single Pillow copy kept for every later strip: about 4 bytes
+per pixel for RGB and RGBA (some 190 MB for a 48 MP photo) on top of the NumPy
+strips, whatever the strip size.
+"""
+import functools
+import io
+import os
+import tempfile
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from .profiling import span
+
+# Full pixel arrays larger than this many bytes are memory-mapped
+MEMMAP_THRESHOLD = int(os.environ.get("IMAGESECURE_MEMMAP_MB", "256")) * 1024 * 1024
+# Target size of one strip of rows, in bytes
+STRIP_BYTES = 8 * 1024 * 1024
+# Pillow releases whose PNG loader the leading-rows decode has been checked against
+PARTIAL_DECODE_PILLOW = ((9, 1), (13, 0))
+
+
+@functools.lru_cache(maxsize=None)
+def partial_png_decode_supported():
+    """
+    True if leading PNG rows can be decoded on their own with this Pillow. The
+    decode narrows the loader's tile and size, which is not public API, so it is
+    only used on the checked releases and once a small image has decoded the
+    same way in full and in part; otherwise every read decodes the whole image.
+    """
+    version = tuple(int(part) for part in PIL.__version__.split(".")[:2])
+    if not PARTIAL_DECODE_PILLOW[0] <= version < PARTIAL_DECODE_PILLOW[1]:
+        return False
+    sample = io.BytesIO()
+    pixels = np.arange(7 * 5 * 3, dtype=np.uint8).reshape(7, 5, 3) * 7
+    Image.fromarray(pixels).save(sample, format="PNG")
+    try:
+        head = _decode_head(Image.open(sample), 4)
+    except Exception:
+        return False
+    return head is not None and np.array_equal(np.array(head), pixels[:4])
+
+
+def _decode_head(image, bottom):
+    """
+    Rows [0, bottom) of a PNG that has not been decoded yet, decoding only those rows
+    from a second handle on its file; None where the image does not allow it.
+    """
+    if (image.format != "PNG" or len(image.tile) != 1 or image.info.get("interlace")
+            or getattr(image, "is_animated", False)):
+        return None
+    # zlib streams decode front to back, so the decoder stops once the shorter extent is filled
+    head = Image.open(image.filename or image.fp)
+    codec, _, offset, args = head.tile[0]
+    head.tile = [(codec, (0, 0, image.width, bottom), offset, args)]
+    head._size = (image.width, bottom)
+    head.load()
+    return head
+
+
+def empty_array(shape, dtype=np.uint8, threshold=MEMMAP_THRESHOLD):
+    """Uninitialised array, memory-mapped from an anonymous temporary file when large."""
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if threshold is None or nbytes <= threshold or nbytes == 0:
+        return np.empty(shape, dtype=dtype)
+    # The file is already unlinked; the mapping keeps it alive until the array is freed
+    with tempfile.TemporaryFile() as backing:
+        return np.memmap(backing, dtype=dtype, mode="w+", shape=shape)
+
+
+class Raster:
+    """
+    Image opened for strip-wise access. source is a path, a file-like object or a
+    PIL image. mode is the mode pixels are returned in: a mode name, a function
+    of the image's own mode returning one, or None to keep the image's mode.
+    Strips are converted one at a time, so the whole image is never converted at once.
+    """
+
+    def __init__(self, source, mode=None):
+        # A PIL image passed in belongs to the caller and is copied before any write
+        self._owned = not isinstance(source, Image.Image)
+        # Files given as objects belong to the caller too and are never closed here
+        self._opened_path = isinstance(source, (str, os.PathLike))
+        self.image = Image.open(source) if self._owned else source
+        if callable(mode):
+            mode = mode(self.image.mode)
+        self.mode = mode or self.image.mode
+        self.size = self.image.size
+        self.width, self.height = self.size
+        self.bands = Image.getmodebands(self.mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def strip_rows(self):
+        """Number of rows per strip, so that a strip holds about STRIP_BYTES."""
+        return max(1, STRIP_BYTES // max(1, self.width * self.bands))
+
+    def _head(self, bottom):
+        """Rows [0, bottom) decoded on their own, or None if only a full decode will do."""
+        if bottom >= self.height or not getattr(self.image, "tile", None) or not partial_png_decode_supported():
+            return None
+        return _decode_head(self.image, bottom)
+
+    def rows(self, top, bottom):
+        """
+        Pixels of rows [top, bottom) as a new (rows, width[, bands]) uint8 array.
+        Leading rows of a PNG are decoded alone; any other rows decode the whole
+        image once (see the module docstring).
+        """
+        # Decoding and conversion are timed here for every operation that reads pixels
+        with span("raster.rows", pixels=(bottom - top) * self.width):
+            strip = self._head(bottom) if top == 0 else None
+            if strip is None:
+                strip = self.image.crop((0, top, self.width, bottom))
+            if strip.mode != self.mode:
+                strip = strip.convert(self.mode)
+            return np.array(strip)
+
+    def span(self, start, stop):
+        """Pixels [start, stop) in row-major order as a (count, bands) array, decoding only their rows."""
+        top, bottom = start // self.width, -(-stop // self.width)
+        flat = self.rows(top, bottom).reshape(-1, self.bands)
+        return flat[start - top * self.width:stop - top * self.width]
+
+    def strips(self, rows=None):
+        """Yields (top, pixels) for consecutive strips of rows covering the image."""
+        rows = rows or self.strip_rows
+        for top in range(0, self.height, rows):
+            yield top, self.rows(top, min(self.height, top + rows))
+
+    def pixels(self, threshold=MEMMAP_THRESHOLD):
+        """
+        All pixels as one (height, width[, bands]) array, filled strip by strip;
+        memory-mapped when larger than threshold bytes.
+        """
+        shape = (self.height, self.width) if self.bands == 1 else (self.height, self.width, self.bands)
+        array = empty_array(shape, threshold=threshold)
+        for top, strip in self.strips():
+            array[top:top + strip.shape[0]] = strip
+        return array
+
+    def paste(self, top, pixels):
+        """Writes rows of pixels (as returned by rows) back into the image, starting at row top."""
+        if self.image.mode != self.mode:
+            self.image = self.image.convert(self.mode)
+            self._owned = True
+        elif not self._owned:
+            self.image = self.image.copy()
+            self._owned = True
+        self.image.paste(Image.fromarray(pixels), (0, top))
+
+    def close(self):
+        """Releases the decoded raster, closing the file only if it was opened from a path."""
+        if self._opened_path:
+            self.image.close()
+        self.image = None
+
+
+def open_preview(source, max_size):
+    """
+    Decodes a copy of an image no larger than max_size on its longest side. JPEGs
+    are decoded directly at 1/2, 1/4 or 1/8 scale (Image.draft) and other formats
+    are shrunk with Image.reduce before the final resampling, so the cost follows
+    the preview size rather than the image size where the format allows it.
+    """
+    if isinstance(source, Image.Image):
+        # Never resize the caller's image in place; reduce() makes a small copy directly
+        factor = max(1, max(source.size) // (2 * max_size))
+        # reduce() does not handle palette and bilevel images; thumbnail() still does
+        preview = source.reduce(factor) if factor > 1 and source.mode not in ("P", "1") else source.copy()
+    else:
+        preview = Image.open(source)
+    # thumbnail applies draft() and reduce() itself when reducing_gap is set
+    preview.thumbnail((max_size, max_size), reducing_gap=2.0)
+    return preview
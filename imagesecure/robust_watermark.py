@@ -0,0 +1,164 @@
+"""
+Invisible watermark in the block-DCT domain that survives JPEG re-compression.
+
+The text is framed into a fixed-size codeword (length byte, zero-padded
+payload, CRC-32), so detection is blind: it needs neither the original image
+nor the text length. Every codeword bit is repeated across many mid-frequency
+DCT coefficients of 8x8 luminance blocks, spread over the whole image by a
+keyed permutation, and embedded with quantization index modulation (QIM).
+Detection sums the soft decisions of all copies of a bit, which corrects the
+bit errors caused by compression, noise or local edits, and the CRC rejects
+images that carry no watermark.
+
+All functions work on stacks of same-size images, shape (count, height, width, 3),
+so a whole batch is processed with one set of array operations.
+"""
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from .profiling import profiled, span
+from .raster import Raster
+
+BLOCK = 8
+# Mid-frequency coefficients used in every block: robust to JPEG quantization, yet invisible
+COEFFICIENTS = ((1, 2), (2, 1), (2, 2))
+# QIM quantization step; larger is more robust and more visible
+DEFAULT_STRENGTH = 24.0
+
+MAX_PAYLOAD = 31
+CODEWORD_BYTES = 1 + MAX_PAYLOAD + 4
+CODEWORD_BITS = CODEWORD_BYTES * 8
+# Fewest copies of each codeword bit the image must be able to hold
+MIN_REPEAT = 3
+
+
+def _dct_matrix(size=BLOCK):
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix()
+# DCT basis image of every coefficient used: coefficient = sum(block * basis)
+_BASES = np.stack([np.outer(_DCT[u], _DCT[v]) for u, v in COEFFICIENTS]).astype(np.float32)
+
+
+def _as_stack(images):
+    """Accepts a PIL image, a (height, width, 3) array or a (count, height, width, 3) stack."""
+    if isinstance(images, Image.Image):
+        # Converted strip by strip into one array, memory-mapped when large
+        with span("robust_watermark.load", pixels=images.width * images.height):
+            images = Raster(images, "RGB").pixels()
+    images = np.asarray(images)
+    if images.ndim == 3:
+        images = images[None]
+    if images.ndim != 4 or images.shape[-1] != 3:
+        raise ValueError("Expected RGB images of shape (height, width, 3) or (count, height, width, 3).")
+    return images
+
+
+def _luminance_blocks(stack):
+    """Luminance of the stack cut into 8x8 blocks: (count, block rows, block columns, 8, 8)."""
+    count, height, width, _ = stack.shape
+    rows, cols = height // BLOCK, width // BLOCK
+    pixels = stack[:, :rows * BLOCK, :cols * BLOCK].astype(np.float32)
+    luma = pixels[..., 0] * 0.299 + pixels[..., 1] * 0.587 + pixels[..., 2] * 0.114
+    return luma.reshape(count, rows, BLOCK, cols, BLOCK).transpose(0, 1, 3, 2, 4)
+
+
+def _slot_bits(slot_count, key):
+    """Codeword bit index carried by each coefficient slot, spread by a keyed permutation."""
+    if slot_count < CODEWORD_BITS * MIN_REPEAT:
+        minimum = CODEWORD_BITS * MIN_REPEAT // len(COEFFICIENTS) * BLOCK * BLOCK
+        raise ValueError(f"The image is too small for a robust watermark (needs at least {minimum} pixels).")
+    # Keys are compared as text, so 1234 and "1234" select the same spreading
+    seed = zlib.crc32(str(key).encode("utf-8"))
+    return np.random.default_rng(seed).permutation(slot_count) % CODEWORD_BITS
+
+
+def _codeword(watermark_text):
+    payload = watermark_text.encode("utf-8")
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"The watermark text must be at most {MAX_PAYLOAD} bytes in UTF-8.")
+    body = bytes([len(payload)]) + payload.ljust(MAX_PAYLOAD, b"\0")
+    return np.unpackbits(np.frombuffer(body + struct.pack(">I", zlib.crc32(body)), dtype=np.uint8))
+
+
+@profiled("embed_robust_watermark")
+def embed_robust_watermark(images, watermark_text, key=0, strength=DEFAULT_STRENGTH):
+    """
+    Embeds watermark_text (at most 31 UTF-8 bytes) into a stack of same-size RGB images.
+    Returns a uint8 stack of the same shape as the input stack.
+    """
+    stack = _as_stack(images)
+    pixels = stack.shape[0] * stack.shape[1] * stack.shape[2]
+    with span("embed_robust_watermark.dct", pixels=pixels):
+        blocks = _luminance_blocks(stack)
+        count, rows, cols = blocks.shape[:3]
+        bits = _codeword(watermark_text)[_slot_bits(rows * cols * len(COEFFICIENTS), key)]
+        bits = bits.reshape(rows, cols, len(COEFFICIENTS))
+
+        # QIM: move every coefficient to the nearest point of the lattice of its bit
+        coefficients = np.einsum("nrcxy,kxy->nrck", blocks, _BASES)
+        dither = (bits.astype(np.float32) - 0.5) * (strength / 2)
+        target = np.round((coefficients - dither) / strength) * strength + dither
+
+    with span("embed_robust_watermark.apply", pixels=pixels):
+        # Changing one DCT coefficient by d adds d times its basis image to the block
+        delta = np.einsum("nrck,kxy->nrxcy", target - coefficients, _BASES)
+        delta = delta.reshape(count, rows * BLOCK, cols * BLOCK)
+
+        # Equal changes to R, G and B change the luminance only; one channel at a time keeps
+        # the float temporaries at a third of the stack size
+        marked = stack.copy()
+        region = marked[:, :rows * BLOCK, :cols * BLOCK]
+        for channel in range(3):
+            region[..., channel] = np.clip(np.round(region[..., channel] + delta), 0, 255)
+    return marked
+
+
+@profiled("detect_robust_watermark")
+def detect_robust_watermark(images, key=0, strength=DEFAULT_STRENGTH):
+    """
+    Blindly extracts the watermark from a stack of same-size RGB images.
+    Returns one (text, confidence) pair per image; text is None when the image
+    carries no valid watermark. Confidence (0..1) is the mean agreement between
+    the copies of each bit.
+    """
+    stack = _as_stack(images)
+    with span("detect_robust_watermark.dct", pixels=stack.shape[0] * stack.shape[1] * stack.shape[2]):
+        blocks = _luminance_blocks(stack)
+        count, rows, cols = blocks.shape[:3]
+        slot_bits = _slot_bits(rows * cols * len(COEFFICIENTS), key)
+
+        # Soft decision of every slot: +1 on the lattice of bit 1, -1 on the lattice of bit 0
+        coefficients = np.einsum("nrcxy,kxy->nrck", blocks, _BASES).reshape(count, -1)
+        soft = np.sin(2 * np.pi * coefficients / strength)
+
+    copies = np.bincount(slot_bits, minlength=CODEWORD_BITS)
+    results = []
+    for image_soft in soft:
+        votes = np.bincount(slot_bits, weights=image_soft, minlength=CODEWORD_BITS) / copies
+        codeword = np.packbits(votes > 0).tobytes()
+        confidence = float(np.abs(votes).mean())
+        body, checksum = codeword[:-4], struct.unpack(">I", codeword[-4:])[0]
+        if zlib.crc32(body) != checksum or body[0] > MAX_PAYLOAD:
+            results.append((None, confidence))
+            continue
+        results.append((body[1:1 + body[0]].decode("utf-8", errors="replace"), confidence))
+    return results
+
+
+# Function to embed a robust invisible watermark in a single image
+def add_robust_watermark(image, watermark_text, key=0, strength=DEFAULT_STRENGTH):
+    return Image.fromarray(embed_robust_watermark(image, watermark_text, key, strength)[0])
+
+
+# Function to detect a robust invisible watermark in a single image
+def detect_robust_watermark_image(image, key=0, strength=DEFAULT_STRENGTH):
+    return detect_robust_watermark(image, key, strength)[0]
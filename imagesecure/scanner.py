@@ -0,0 +1,412 @@
+"""
+Batch steganalysis of whole image collections, with a content-addressed index.
+
+    python -m imagesecure.scanner scan uploads/ --index scan.sqlite
+    python -m imagesecure.scanner report --index scan.sqlite --suspicious
+
+Every image is hashed (BLAKE2b) and analysed with lsb_analysis on a process
+pool. Results are stored in an SQLite index keyed by the content hash, and a
+second table maps each scanned path to its hash with the size and mtime seen,
+so a re-scan only hashes files whose size or mtime changed and only analyses
+content the index has not seen (renamed, copied or re-uploaded files are
+recognised by their hash). Files that disappeared since the last scan of a
+directory are dropped from the path table; files that could not be read are
+kept in it with the error (and an empty digest), and are read again on the
+next scan.
+
+The index is plain SQLite and can be queried directly:
+
+    files(path, size, mtime_ns, digest, scan_id, error)
+    results(digest, detector_version, status, error, width, height, suspicious,
+            estimate, lsb_ones, chi_square, rs, sample_pair, region_max, report, analyzed_at)
+    scans(id, root, started_at, finished_at, files, hashed, analyzed, failed, removed)
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+from .batch import IMAGE_EXTENSIONS, find_inputs
+from .stego import lsb_analysis
+from .workers import ProcessPool, capture_errors, print_progress
+
+DEFAULT_INDEX = "imagesecure-scan.sqlite"
+# Bumped whenever the detectors change, so stored results are recomputed
+DETECTOR_VERSION = 1
+# Results are committed in groups, so an interrupted scan keeps most of its work
+COMMIT_EVERY = 64
+HASH_BLOCK = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    digest TEXT PRIMARY KEY,
+    detector_version INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    width INTEGER,
+    height INTEGER,
+    suspicious INTEGER,
+    estimate REAL,
+    lsb_ones REAL,
+    chi_square REAL,
+    rs REAL,
+    sample_pair REAL,
+    region_max REAL,
+    report TEXT,
+    analyzed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    scan_id INTEGER NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_digest ON files (digest);
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    files INTEGER,
+    hashed INTEGER,
+    analyzed INTEGER,
+    failed INTEGER,
+    removed INTEGER
+);
+"""
+
+# Summary columns of a result, as returned by analyze_file
+RESULT_COLUMNS = ("width", "height", "suspicious", "estimate", "lsb_ones", "chi_square", "rs", "sample_pair", "region_max")
+# Columns returned by ScanIndex.query, in order
+REPORT_COLUMNS = ("path", "size", "digest", "status", "error") + RESULT_COLUMNS + ("analyzed_at",)
+
+
+def file_digest(path):
+    """Hex BLAKE2b digest of a file's content (the same hash as cache.content_digest), read in blocks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _analyze(path):
+    lsb_percentage, report = lsb_analysis(path)
+    if report is None:
+        raise ValueError("The image is empty.")
+    channels = report["channels"].values()
+    width, height = report["size"]
+    return {
+        "status": "ok",
+        "error": None,
+        "width": width,
+        "height": height,
+        "suspicious": int(report["suspicious"]),
+        "estimate": report["estimate"],
+        "lsb_ones": lsb_percentage[1] / 100,
+        # The chi-square attack only flags an image when every channel is equalised
+        "chi_square": min(channel["chi_square"] for channel in channels),
+        "rs": sum(channel["rs"] for channel in channels) / len(channels),
+        "sample_pair": sum(channel["sample_pair"] for channel in channels) / len(channels),
+        "region_max": max((region["rs"] + region["sample_pair"]) / 2 for region in report["regions"]),
+        "report": json.dumps(report),
+    }
+
+
+def analyze_file(path):
+    """
+    Runs the detectors on one file inside a worker process. Returns a dict of
+    the results columns (without digest), with status "error" if it failed.
+    """
+    result, error = capture_errors(_analyze, path)
+    return result if error is None else {"status": "error", "error": error}
+
+
+# Status and error of a file row joined with its result: a read error comes first
+_STATUS = "CASE WHEN f.error IS NOT NULL THEN 'error' ELSE r.status END"
+_REPORT_SELECT = {"path": "f.path", "size": "f.size", "digest": "f.digest",
+                  "status": f"{_STATUS} AS status", "error": "COALESCE(f.error, r.error) AS error"}
+
+
+def _prefix_match(column):
+    # Paths under a directory, without LIKE so that % and _ in names are not wildcards
+    return f"({column} = ? OR substr({column}, 1, length(?)) = ?)"
+
+
+class ScanIndex:
+    """The SQLite index of scanned files and steganalysis results."""
+
+    def __init__(self, path=DEFAULT_INDEX):
+        self.path = str(path)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.row_factory = sqlite3.Row
+        # Reports can be read while a scan is writing
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(_SCHEMA)
+        if "error" not in {row["name"] for row in self.connection.execute("PRAGMA table_info(files)")}:
+            # Indexes written before unreadable files were kept
+            self.connection.execute("ALTER TABLE files ADD COLUMN error TEXT")
+            self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def file(self, path):
+        """The files row of a path, or None."""
+        return self.connection.execute("SELECT * FROM files WHERE path = ?", (path,)).fetchone()
+
+    def has_result(self, digest, retry_errors=False):
+        """True if content with this digest was analysed by the current detectors."""
+        row = self.connection.execute("SELECT detector_version, status FROM results WHERE digest = ?", (digest,)).fetchone()
+        return (row is not None and row["detector_version"] == DETECTOR_VERSION
+                and not (retry_errors and row["status"] != "ok"))
+
+    def put_file(self, path, size, mtime_ns, digest, scan_id, error=None):
+        """Records a scanned path; a file that could not be read has an empty digest and the error."""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, digest, scan_id, error) VALUES (?, ?, ?, ?, ?, ?)",
+            (path, size, mtime_ns, digest, scan_id, error))
+
+    def put_result(self, digest, result):
+        row = {column: result.get(column) for column in RESULT_COLUMNS}
+        row.update(digest=digest, status=result["status"], error=result.get("error"), report=result.get("report"),
+                   detector_version=DETECTOR_VERSION, analyzed_at=time.time())
+        columns = ", ".join(row)
+        self.connection.execute(f"INSERT OR REPLACE INTO results ({columns}) VALUES ({', '.join('?' * len(row))})",
+                                tuple(row.values()))
+
+    def start_scan(self, root):
+        cursor = self.connection.execute("INSERT INTO scans (root, started_at) VALUES (?, ?)", (root, time.time()))
+        self.connection.commit()
+        return cursor.lastrowid
+
+    def finish_scan(self, scan_id, root, stats):
+        """Drops the paths under root not seen by this scan and records the scan's counts."""
+        removed = self.connection.execute(
+            f"DELETE FROM files WHERE {_prefix_match('path')} AND scan_id != ?",
+            (root, root + "/", root + "/", scan_id)).rowcount
+        stats["removed"] = removed
+        self.connection.execute(
+            "UPDATE scans SET finished_at = ?, files = ?, hashed = ?, analyzed = ?, failed = ?, removed = ? WHERE id = ?",
+            (time.time(), stats["files"], stats["hashed"], stats["analyzed"], stats["failed"], removed, scan_id))
+        self.connection.commit()
+
+    def query(self, under=None, suspicious=None, min_estimate=None, status=None, limit=None):
+        """
+        Rows of REPORT_COLUMNS for the scanned files, most suspicious first; files
+        that could not be read have status "error" and their read error. under
+        restricts them to a directory; suspicious, min_estimate and status ("ok",
+        "error" or "pending" for files without a current result) filter them.
+        """
+        conditions, params = [], []
+        if under is not None:
+            under = _normalize(under)
+            conditions.append(_prefix_match("f.path"))
+            params += [under, under + "/", under + "/"]
+        if suspicious is not None:
+            conditions.append("r.suspicious = ?")
+            params.append(int(suspicious))
+        if min_estimate is not None:
+            conditions.append("r.estimate >= ?")
+            params.append(min_estimate)
+        if status == "pending":
+            conditions.append("f.error IS NULL AND (r.digest IS NULL OR r.detector_version != ?)")
+            params.append(DETECTOR_VERSION)
+        elif status is not None:
+            conditions.append(f"{_STATUS} = ?")
+            params.append(status)
+        columns = ", ".join(_REPORT_SELECT.get(column, f"r.{column}") for column in REPORT_COLUMNS)
+        sql = f"SELECT {columns} FROM files f LEFT JOIN results r ON r.digest = f.digest"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY r.suspicious DESC, r.estimate DESC, f.path"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def summary(self, under=None):
+        """Counts of files, distinct contents, suspicious files, failures and pending files."""
+        condition, params = "", []
+        if under is not None:
+            under = _normalize(under)
+            condition = "WHERE " + _prefix_match("f.path")
+            params = [under, under + "/", under + "/"]
+        row = self.connection.execute(f"""
+            SELECT COUNT(*) AS files,
+                   COUNT(DISTINCT NULLIF(f.digest, '')) AS contents,
+                   COALESCE(SUM(r.suspicious = 1 AND r.status = 'ok'), 0) AS suspicious,
+                   COALESCE(SUM({_STATUS} = 'error'), 0) AS failed,
+                   COALESCE(SUM(f.error IS NULL AND (r.digest IS NULL OR r.detector_version != {DETECTOR_VERSION})), 0) AS pending
+            FROM files f LEFT JOIN results r ON r.digest = f.digest {condition}""", params).fetchone()
+        return dict(row)
+
+
+def _normalize(path):
+    return Path(path).resolve().as_posix()
+
+
+def scan(root, index, workers=None, rehash=False, retry_errors=False, extensions=IMAGE_EXTENSIONS, progress=None):
+    """
+    Scans every image under root into the index (a ScanIndex). Files whose size and
+    mtime match the index are not read again unless rehash is set; content already
+    analysed is not analysed again unless its result is an error and retry_errors
+    is set. progress, if given, is called as progress(done, total, path, error)
+    for every file analysed and every file that could not be read. Returns a dict of counts: files, hashed, analyzed,
+    reused, failed, removed.
+    """
+    root = _normalize(root)
+    scan_id = index.start_scan(root)
+    stats = {"files": 0, "hashed": 0, "analyzed": 0, "reused": 0, "failed": 0, "removed": 0}
+
+    # Paths whose size and mtime are unchanged keep their recorded digest
+    to_hash = []
+    digests = {}
+    for rel in find_inputs(root, extensions):
+        path = f"{root}/{rel.as_posix()}"
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stats["files"] += 1
+        row = index.file(path)
+        if (not rehash and row is not None and row["error"] is None
+                and row["size"] == stat.st_size and row["mtime_ns"] == stat.st_mtime_ns):
+            index.put_file(path, stat.st_size, stat.st_mtime_ns, row["digest"], scan_id)
+            digests[path] = row["digest"]
+        else:
+            to_hash.append((path, stat))
+    index.connection.commit()
+
+    with ProcessPool(workers) as pool:
+        def hashed(item, result, pool_error):
+            path, stat = item
+            digest, error = result if pool_error is None else (None, pool_error)
+            if digest is None:
+                # Kept in this scan, so it is reported as failed instead of dropped
+                index.put_file(path, stat.st_size, stat.st_mtime_ns, "", scan_id, error)
+                stats["failed"] += 1
+                if progress is not None:
+                    progress(stats["hashed"] + stats["failed"], len(to_hash), path, error)
+            else:
+                stats["hashed"] += 1
+                index.put_file(path, stat.st_size, stat.st_mtime_ns, digest, scan_id)
+                digests[path] = digest
+            if (stats["hashed"] + stats["failed"]) % COMMIT_EVERY == 0:
+                index.connection.commit()
+
+        pool.map_bounded(capture_errors, (((path, stat), (file_digest, path)) for path, stat in to_hash), hashed)
+        index.connection.commit()
+
+        # One file per content that has no current result
+        pending = {}
+        for path, digest in digests.items():
+            if digest not in pending and not index.has_result(digest, retry_errors):
+                pending[digest] = path
+        stats["reused"] = len(digests) - len(pending)
+        paths = {path: digest for digest, path in pending.items()}
+
+        def analyzed(path, result, pool_error):
+            if pool_error is not None:
+                result = {"status": "error", "error": pool_error}
+            index.put_result(paths[path], result)
+            stats["analyzed"] += 1
+            if result["status"] != "ok":
+                stats["failed"] += 1
+            if stats["analyzed"] % COMMIT_EVERY == 0:
+                index.connection.commit()
+            if progress is not None:
+                progress(stats["analyzed"], len(paths), path, result.get("error"))
+
+        pool.map_bounded(analyze_file, ((path, (path,)) for path in paths), analyzed)
+
+    index.finish_scan(scan_id, root, stats)
+    return stats
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return "" if value is None else str(value)
+
+
+def write_report(rows, output, format="table"):
+    """Writes query rows as an aligned table, JSON lines or CSV."""
+    if format == "json":
+        for row in rows:
+            output.write(json.dumps(row) + "\n")
+        return
+    columns = ("path", "status", "suspicious", "estimate", "chi_square", "rs", "sample_pair", "region_max", "error")
+    if format == "csv":
+        writer = csv.DictWriter(output, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+        return
+    table = [columns] + [tuple(_format_value(row[column]) for column in columns) for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    for line in table:
+        output.write("  ".join(value.ljust(width) for value, width in zip(line, widths)).rstrip() + "\n")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m imagesecure.scanner",
+                                     description="Scan image collections for LSB steganography and report on the results.")
+    parser.add_argument("--index", default=DEFAULT_INDEX, help=f"SQLite index path (default {DEFAULT_INDEX})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = commands.add_parser("scan", help="analyse every image under the given directories")
+    scan_parser.add_argument("directories", nargs="+")
+    scan_parser.add_argument("--workers", type=int, default=None, help="worker processes (defaults to the number of CPUs)")
+    scan_parser.add_argument("--rehash", action="store_true", help="hash every file even if its size and mtime are unchanged")
+    scan_parser.add_argument("--retry-errors", action="store_true", help="analyse content whose last analysis failed again")
+    scan_parser.add_argument("--quiet", action="store_true", help="do not print per-file progress")
+
+    report_parser = commands.add_parser("report", help="list scanned files, most suspicious first")
+    report_parser.add_argument("--under", help="only files under this directory")
+    report_parser.add_argument("--suspicious", action="store_true", help="only files flagged as suspicious")
+    report_parser.add_argument("--min-estimate", type=float, help="only files with at least this estimated embedding rate")
+    report_parser.add_argument("--status", choices=["ok", "error", "pending"], help="only files with this result status")
+    report_parser.add_argument("--limit", type=int, help="at most this many files")
+    report_parser.add_argument("--format", choices=["table", "json", "csv"], default="table")
+    report_parser.add_argument("--summary", action="store_true", help="print only the counts")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    with ScanIndex(args.index) as index:
+        if args.command == "scan":
+            failed = 0
+            for directory in args.directories:
+                stats = scan(directory, index, workers=args.workers, rehash=args.rehash,
+                             retry_errors=args.retry_errors, progress=None if args.quiet else print_progress)
+                failed += stats["failed"]
+                print(f"{directory}: {stats['files']} files, {stats['hashed']} hashed, {stats['analyzed']} analysed, "
+                      f"{stats['reused']} reused from the index, {stats['failed']} failed, {stats['removed']} removed",
+                      file=sys.stderr)
+            return 1 if failed else 0
+
+        if args.summary:
+            print(json.dumps(index.summary(args.under)))
+            return 0
+        rows = index.query(under=args.under, suspicious=True if args.suspicious else None,
+                           min_estimate=args.min_estimate, status=args.status, limit=args.limit)
+        write_report(rows, sys.stdout, args.format)
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
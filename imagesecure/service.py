@@ -0,0 +1,625 @@
+"""
+Asynchronous HTTP API for the image operations, built on asyncio streams only.
+
+    python -m imagesecure.service --port 8080
+
+Every operation is a POST whose request body is the input file; options go in
+the query string and the AES key in the X-Key header:
+
+    POST /encrypt                      X-Key; ?key_length=16|24|32
+    POST /decrypt                      X-Key; ?key_length=16|24|32
+    POST /stego/encode                 ?message=...&bits=1..4&alpha=1
+    POST /stego/decode
+    POST /stego/analyze
+    POST /watermark/visible            ?text=...&size=50&opacity=128
+    POST /watermark/invisible          ?text=...
+    POST /watermark/invisible/detect   ?length=...
+    POST /watermark/robust             ?text=...&key=...
+    POST /watermark/robust/detect      ?key=...
+    GET  /health
+
+Encryption and decryption stream: the body is sealed or opened chunk by chunk
+on a thread pool as it arrives and the result is sent back with chunked
+transfer encoding, so memory use does not depend on the file size. Image
+operations run on a process pool. Small requests for the same operation and
+options that arrive within a few milliseconds of each other are sent to the
+pool as one task, which amortises the cost of a process round trip. If a
+worker process dies, the requests it was serving are answered 503 with
+Retry-After and the pool is replaced for the requests after them.
+
+At most max_pending requests are admitted at once; the rest are answered
+503 with Retry-After before their body is read, so an overloaded service
+pushes back on its callers instead of queueing without bound.
+"""
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+from .crypto import (
+    INDEXED_CHUNK_SIZE,
+    INDEXED_MAGIC,
+    TAG_SIZE,
+    decrypt_file,
+    generate_key,
+    indexed_header_size,
+    indexed_opener,
+    indexed_sealer,
+    is_indexed_encrypted,
+)
+from .robust_watermark import add_robust_watermark, detect_robust_watermark_image
+from .stego import decode_payload, encode_image, lsb_analysis
+from .watermark import add_visible_watermark, add_invisible_watermark, detect_invisible_watermark, watermark_file
+from .workers import ProcessPool, error_message
+
+# Largest request body accepted, in bytes
+MAX_BODY = int(os.environ.get("IMAGESECURE_MAX_BODY_MB", "256")) * 1024 * 1024
+# Requests with bodies up to this size may be grouped into one process-pool task
+BATCH_MAX_BODY = 1024 * 1024
+BATCH_MAX_SIZE = 16
+BATCH_WINDOW = 0.005
+HEADER_LIMIT = 64 * 1024
+HEADER_TIMEOUT = 30
+# Longest wait for the next piece of a request body; a stalled client would hold a pending slot
+BODY_TIMEOUT = 30
+READ_SIZE = 256 * 1024
+
+STATUS_TEXT = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    408: "Request Timeout", 411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+# Image operations run in worker processes: each takes the request body as a
+# file-like object and the parsed options and returns (content type, bytes)
+def _image_bytes(image, image_format):
+    output = io.BytesIO()
+    image.save(output, format=image_format or "PNG")
+    return output.getvalue()
+
+
+def _json(value):
+    return "application/json", json.dumps(value, default=float).encode("utf-8")
+
+
+def _stego_encode(source, options):
+    return "image/png", encode_image(source, options["message"], options["bits"], options["channels"]).getvalue()
+
+
+def _stego_decode(source, options):
+    return "application/octet-stream", decode_payload(source)
+
+
+def _stego_analyze(source, options):
+    lsb_percentage, report = lsb_analysis(source)
+    return _json(report)
+
+
+def _watermarked(source, watermark, *args):
+    watermarked, image_format = watermark_file(source, watermark, *args)
+    return Image.MIME.get(image_format, "image/png"), _image_bytes(watermarked, image_format)
+
+
+def _watermark_visible(source, options):
+    return _watermarked(source, add_visible_watermark, options["text"], options["size"], options["opacity"])
+
+
+def _watermark_invisible(source, options):
+    return _watermarked(source, add_invisible_watermark, options["text"])
+
+
+def _watermark_invisible_detect(source, options):
+    with Image.open(source) as image:
+        return _json({"text": detect_invisible_watermark(image.convert("RGB"), options["length"])})
+
+
+def _watermark_robust(source, options):
+    return _watermarked(source, add_robust_watermark, options["text"], options["key"])
+
+
+def _watermark_robust_detect(source, options):
+    with Image.open(source) as image:
+        text, confidence = detect_robust_watermark_image(image.convert("RGB"), options["key"])
+    return _json({"text": text, "confidence": confidence})
+
+
+def _decrypt_whole(source, options):
+    # Streaming (ISS1) and legacy AES-ECB files, which have no chunk index
+    output = io.BytesIO()
+    decrypt_file(source, output, options["aes_key"], workers=1)
+    return "application/octet-stream", output.getvalue()
+
+
+OPERATIONS = {
+    "/stego/encode": _stego_encode,
+    "/stego/decode": _stego_decode,
+    "/stego/analyze": _stego_analyze,
+    "/watermark/visible": _watermark_visible,
+    "/watermark/invisible": _watermark_invisible,
+    "/watermark/invisible/detect": _watermark_invisible_detect,
+    "/watermark/robust": _watermark_robust,
+    "/watermark/robust/detect": _watermark_robust_detect,
+    "/decrypt": _decrypt_whole,
+}
+
+
+def run_batch(path, options, bodies):
+    """
+    Runs one operation on several request bodies inside a worker process.
+    Returns one (status, content type, bytes) per body; a failing body never
+    affects the others.
+    """
+    results = []
+    for body in bodies:
+        try:
+            results.append((200,) + OPERATIONS[path](io.BytesIO(body), options))
+        except (ValueError, OSError) as e:
+            # Bad parameters and files PIL cannot read are the caller's error
+            results.append((400, "text/plain; charset=utf-8", str(e).encode("utf-8")))
+        except Exception as e:
+            results.append((500, "text/plain; charset=utf-8", error_message(e).encode("utf-8")))
+    return results
+
+
+def _pool_error(error):
+    """The error every request of a process-pool task gets when the task fails as a whole."""
+    if isinstance(error, BrokenProcessPool):
+        # The pool is already replaced, so a retry runs on fresh workers
+        return HTTPError(503, "A worker process died while handling the request, retry it", {"Retry-After": "1"})
+    if isinstance(error, (asyncio.CancelledError, RuntimeError)):
+        # Cancelled, or refused by a pool that is shutting down
+        return HTTPError(503, "The service is shutting down", {"Retry-After": "1"})
+    return error
+
+
+def _parse_options(path, query, headers):
+    """Validates the query string and headers of an operation into an options dict."""
+    def get(name, default=None, convert=str):
+        values = query.get(name)
+        if not values:
+            if default is None:
+                raise HTTPError(400, f"Missing query parameter '{name}'")
+            return default
+        try:
+            return convert(values[0])
+        except ValueError:
+            raise HTTPError(400, f"Invalid value for query parameter '{name}'")
+
+    options = {}
+    if path in ("/encrypt", "/decrypt"):
+        key_input = headers.get("x-key")
+        if not key_input:
+            raise HTTPError(400, "Missing X-Key header")
+        key_length = get("key_length", 16, int)
+        if key_length not in (16, 24, 32):
+            raise HTTPError(400, "key_length must be 16, 24 or 32")
+        options["aes_key"] = generate_key(key_input, key_length)
+    elif path == "/stego/encode":
+        options.update(message=get("message"), bits=get("bits", 1, int),
+                       channels=4 if get("alpha", "0") in ("1", "true") else 3)
+    elif path == "/watermark/visible":
+        options.update(text=get("text"), size=get("size", 50, int), opacity=get("opacity", 128, int))
+    elif path == "/watermark/invisible":
+        options["text"] = get("text")
+    elif path == "/watermark/invisible/detect":
+        options["length"] = get("length", convert=int)
+    elif path == "/watermark/robust":
+        options.update(text=get("text"), key=get("key", "0"))
+    elif path == "/watermark/robust/detect":
+        options["key"] = get("key", "0")
+    return options
+
+
+class _Body:
+    """Request body read from the connection on demand, with a size limit."""
+
+    def __init__(self, reader, headers, limit):
+        self.reader = reader
+        self.limit = limit
+        self.length = None
+        self.chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+        if not self.chunked:
+            try:
+                self.length = int(headers.get("content-length", "0"))
+            except ValueError:
+                raise HTTPError(400, "Invalid Content-Length")
+            if self.length > limit:
+                raise HTTPError(413, f"The request body is larger than {limit} bytes")
+        self.done = not self.chunked and self.length == 0
+        self._remaining = self.length or 0
+        self._received = 0
+        self._buffer = bytearray()
+
+    async def _receive(self, read):
+        try:
+            return await asyncio.wait_for(read, BODY_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPError(408, f"No request body data received for {BODY_TIMEOUT} seconds")
+
+    async def _next(self):
+        """Next piece of the body from the connection, or b'' at its end."""
+        if self.done:
+            return b""
+        if self.chunked:
+            if self._remaining == 0:
+                size_line = await self._receive(self.reader.readline())
+                try:
+                    self._remaining = int(size_line.split(b";")[0], 16)
+                except ValueError:
+                    raise HTTPError(400, "Invalid chunked encoding")
+                if self._remaining == 0:
+                    # Skip the trailer section
+                    while (await self._receive(self.reader.readline())) not in (b"\r\n", b"\n", b""):
+                        pass
+                    self.done = True
+                    return b""
+            data = await self._receive(self.reader.read(min(self._remaining, READ_SIZE)))
+            if not data:
+                raise ConnectionError("connection closed inside the request body")
+            self._remaining -= len(data)
+            if self._remaining == 0:
+                await self._receive(self.reader.readexactly(2))
+        else:
+            data = await self._receive(self.reader.read(min(self._remaining, READ_SIZE)))
+            if not data:
+                raise ConnectionError("connection closed inside the request body")
+            self._remaining -= len(data)
+            self.done = self._remaining == 0
+        self._received += len(data)
+        if self._received > self.limit:
+            raise HTTPError(413, f"The request body is larger than {self.limit} bytes")
+        return data
+
+    async def read(self, size=-1):
+        """Returns exactly size bytes, fewer only at the end of the body (size -1: the rest)."""
+        while size < 0 or len(self._buffer) < size:
+            data = await self._next()
+            if not data:
+                break
+            self._buffer += data
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def exhausted(self):
+        return self.done and not self._buffer
+
+    async def discard(self):
+        """Reads and drops the rest of the body, so an error response can reach the client."""
+        self._buffer.clear()
+        while await self._next():
+            pass
+
+
+class _Response:
+    """Writes a response, whole or with chunked transfer encoding."""
+
+    def __init__(self, writer, keep_alive):
+        self.writer = writer
+        self.keep_alive = keep_alive
+        self.started = False
+
+    def _head(self, status, headers):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+        headers.setdefault("Connection", "keep-alive" if self.keep_alive else "close")
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        self.started = True
+
+    async def send(self, status, content_type, body, headers=None):
+        headers = dict(headers or {}, **{"Content-Type": content_type, "Content-Length": str(len(body))})
+        self._head(status, headers)
+        self.writer.write(body)
+        await self.writer.drain()
+
+    async def start(self, status, content_type):
+        self._head(status, {"Content-Type": content_type, "Transfer-Encoding": "chunked"})
+
+    async def write(self, data):
+        if data:
+            self.writer.write(b"%x\r\n" % len(data) + data + b"\r\n")
+            # Waits while the client reads slower than we produce
+            await self.writer.drain()
+
+    async def end(self):
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+
+class _MicroBatcher:
+    """Groups small requests with the same operation and options into one process-pool task."""
+
+    def __init__(self, pool, window=BATCH_WINDOW, max_size=BATCH_MAX_SIZE):
+        self.pool = pool
+        self.window = window
+        self.max_size = max_size
+        self._batches = {}
+
+    async def submit(self, path, options, body):
+        loop = asyncio.get_running_loop()
+        if len(body) > BATCH_MAX_BODY:
+            future = loop.create_future()
+            self._run(path, options, [(body, future)])
+            return await future
+
+        key = (path, tuple(sorted(options.items())))
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = []
+            loop.call_later(self.window, self._flush, key, batch)
+        future = loop.create_future()
+        batch.append((body, future))
+        if len(batch) >= self.max_size:
+            self._flush(key, batch)
+        return await future
+
+    def _flush(self, key, batch):
+        # The timer of a batch already flushed because it was full does nothing
+        if self._batches.get(key) is not batch:
+            return
+        del self._batches[key]
+        self._run(key[0], dict(key[1]), batch)
+
+    def _run(self, path, options, batch):
+        """
+        Runs a list of (body, future) as one pool task and resolves every future with
+        its result. Runs in event loop callbacks, where nothing else would see an
+        error, so a failing submit or task fails every future instead.
+        """
+        def fail(error):
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(_pool_error(error))
+
+        try:
+            task = asyncio.wrap_future(self.pool.submit(run_batch, path, options, [body for body, _ in batch]))
+        except Exception as e:
+            fail(e)
+            return
+
+        def distribute(task):
+            try:
+                results = task.result()
+            except (Exception, asyncio.CancelledError) as e:
+                fail(e)
+                return
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        task.add_done_callback(distribute)
+
+
+class ImageService:
+    """The HTTP service: connection handling, admission control and request routing."""
+
+    def __init__(self, workers=None, max_pending=None, threads=None, max_body=MAX_BODY):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 8
+        self.max_body = max_body
+        self.threads = threads or os.cpu_count() or 1
+        self.pending = 0
+        self.served = 0
+        self.rejected = 0
+        # Forked workers would inherit the sockets of open connections and keep them
+        # from closing; spawned workers start clean. A pool whose worker dies is replaced.
+        self.process_pool = ProcessPool(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self.thread_pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.batcher = _MicroBatcher(self.process_pool)
+
+    def close(self):
+        self.process_pool.close(cancel_futures=True)
+        self.thread_pool.shutdown(cancel_futures=True)
+
+    async def start(self, host="127.0.0.1", port=8080):
+        return await asyncio.start_server(self._connection, host, port, limit=HEADER_LIMIT)
+
+    async def _read_request(self, reader):
+        """Reads a request line and headers; returns None when the client closed the connection."""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise HTTPError(400, "Incomplete request")
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(400, "Request headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        return method, url.path.rstrip("/") or "/", parse_qs(url.query), headers, keep_alive
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                keep_alive = await self._serve_one(reader, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_one(self, reader, writer):
+        """Serves one request; returns whether the connection can be reused."""
+        response = _Response(writer, keep_alive=False)
+        body = None
+        try:
+            request = await self._read_request(reader)
+            if request is None:
+                return False
+            method, path, query, headers, keep_alive = request
+            response.keep_alive = keep_alive
+            body = _Body(reader, headers, self.max_body)
+
+            if path == "/health":
+                await response.send(200, *_json({
+                    "pending": self.pending, "max_pending": self.max_pending, "workers": self.workers,
+                    "served": self.served, "rejected": self.rejected, "pool_restarts": self.process_pool.restarts,
+                }))
+            elif path != "/encrypt" and path not in OPERATIONS:
+                raise HTTPError(404, f"Unknown path {path}")
+            elif method != "POST":
+                raise HTTPError(405, "Use POST", {"Allow": "POST"})
+            elif self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HTTPError(503, "The service is busy, retry later", {"Retry-After": "1"})
+            else:
+                self.pending += 1
+                try:
+                    await self._operation(path, query, headers, body, response)
+                    self.served += 1
+                finally:
+                    self.pending -= 1
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            raise
+        except Exception as e:
+            if response.started:
+                # Part of a streamed response is already out; closing without the final
+                # chunk tells the client the response is incomplete
+                return False
+            if isinstance(e, HTTPError):
+                status, headers = e.status, e.headers
+            else:
+                # ValueError is a wrong key, corrupted data or an invalid parameter
+                status, headers = (400 if isinstance(e, ValueError) else 500), {}
+            message = str(e) if status != 500 else f"{type(e).__name__}: {e}"
+            if body is not None and not body.exhausted():
+                if status in (408, 413, 503):
+                    # Reading a body that stalled, is too large, or while overloaded, is
+                    # the work being refused; the connection is closed instead
+                    response.keep_alive = False
+                else:
+                    try:
+                        await body.discard()
+                    except HTTPError:
+                        response.keep_alive = False
+            await response.send(status, "text/plain; charset=utf-8", message.encode("utf-8"), headers)
+        # A body left unread would be parsed as the next request
+        return response.keep_alive and body is not None and body.exhausted()
+
+    async def _operation(self, path, query, headers, body, response):
+        options = _parse_options(path, query, headers)
+        if path == "/encrypt":
+            await self._encrypt(body, options, response)
+        elif path == "/decrypt":
+            await self._decrypt(body, options, response)
+        else:
+            status, content_type, data = await self.batcher.submit(path, options, await body.read())
+            await response.send(status, content_type, data)
+
+    async def _stream(self, response, first, function, pieces):
+        """
+        Sends first, then function(index, piece) for every (index, piece) from the
+        async iterator pieces, computed on the thread pool with a bounded number in
+        flight and sent in order. The status line goes out only once the first
+        piece has been processed, so a wrong key still gets a plain error response.
+        """
+        loop = asyncio.get_running_loop()
+        pending = deque()
+
+        async def send_next():
+            data = await pending.popleft()
+            if not response.started:
+                await response.start(200, "application/octet-stream")
+                await response.write(first)
+            await response.write(data)
+
+        try:
+            async for index, piece in pieces:
+                pending.append(loop.run_in_executor(self.thread_pool, function, index, piece))
+                if len(pending) >= 2 * self.threads:
+                    await send_next()
+            while pending:
+                await send_next()
+        finally:
+            for future in pending:
+                if not future.cancel():
+                    # Already finished; retrieving its exception keeps asyncio from logging it
+                    future.exception()
+        await response.end()
+
+    async def _encrypt(self, body, options, response):
+        if body.length is None:
+            raise HTTPError(411, "Encryption needs a Content-Length")
+        header, seal, count = indexed_sealer(options["aes_key"], body.length)
+
+        async def pieces():
+            for index in range(count):
+                yield index, await body.read(INDEXED_CHUNK_SIZE)
+        await self._stream(response, header, seal, pieces())
+
+    async def _decrypt(self, body, options, response):
+        header = await body.read(len(INDEXED_MAGIC))
+        if is_indexed_encrypted(header):
+            header += await body.read(indexed_header_size(header) - len(header))
+        else:
+            # Older formats have no chunk index and are decrypted in one piece
+            status, content_type, data = await self.batcher.submit("/decrypt", options, header + await body.read())
+            await response.send(status, content_type, data)
+            return
+        open_chunk, count, chunk_size, length = indexed_opener(options["aes_key"], header)
+
+        async def pieces():
+            for index in range(count):
+                yield index, await body.read(min(chunk_size, length - index * chunk_size) + TAG_SIZE)
+            if await body.read(1):
+                raise ValueError("Decryption Error: unexpected data after the last chunk")
+        await self._stream(response, b"", open_chunk, pieces())
+
+
+async def serve(host="127.0.0.1", port=8080, workers=None, max_pending=None):
+    service = ImageService(workers=workers, max_pending=max_pending)
+    server = await service.start(host, port)
+    print(f"Serving on http://{host}:{port} ({service.workers} workers, {service.max_pending} pending requests max)",
+          file=sys.stderr, flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m imagesecure.service", description="Serve the image operations over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (defaults to the number of CPUs)")
+    parser.add_argument("--max-pending", type=int, default=None, help="requests admitted at once before answering 503 (default 8 per worker)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_pending))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+import numpy as np
+import io
+import struct
+import zlib
+
+from .profiling import profiled, span
+from .raster import Raster
+from .steganalysis import analyze_strips
+
+# Container format: a fixed-size header always stored in the lowest bit of the R, G, B
+# channels of the first HEADER_PIXELS pixels, followed by the payload in the lowest
+# `bits` bits of the first `channels` channels of the following pixels.
+#   magic (3) | version (1) | bits per channel (1) | channels (1) | length (4) | CRC-32 (4)
+STEGO_MAGIC = b"ISG"
+STEGO_VERSION = 1
+STEGO_HEADER = struct.Struct(">3sBBBII")
+HEADER_PIXELS = -(-STEGO_HEADER.size * 8 // 3)
+
+
+def _open_raster(image, channels=3):
+    """Opens an image for strip access in RGBA if channels is 4 (or it has alpha), else RGB."""
+    return Raster(image, lambda mode: "RGBA" if channels == 4 or mode == "RGBA" else "RGB")
+
+
+def _embed_bits(carrier, data, bits):
+    """Writes data into the low `bits` bits of the first values of a flat uint8 array, in place."""
+    stream = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    if stream.size % bits:
+        stream = np.concatenate([stream, np.zeros(bits - stream.size % bits, dtype=np.uint8)])
+    groups = stream.reshape(-1, bits)
+    values = (groups << np.arange(bits - 1, -1, -1, dtype=np.uint8)).sum(axis=1, dtype=np.uint8)
+    carrier[:values.size] = (carrier[:values.size] & (0xFF ^ ((1 << bits) - 1))) | values
+
+
+def _extract_bits(carrier, length, bits):
+    """Reads length bytes back from the low `bits` bits of a flat uint8 array."""
+    values = carrier[:-(-length * 8 // bits)] & ((1 << bits) - 1)
+    stream = (values[:, None] >> np.arange(bits - 1, -1, -1, dtype=np.uint8)) & 1
+    return np.packbits(stream.reshape(-1)[:length * 8]).tobytes()
+
+
+def _write_region(pixels, start, data, bits, channels):
+    """Embeds data into the pixels from index start on, using `channels` channels per pixel."""
+    flat = pixels.reshape(-1, pixels.shape[-1])
+    pixel_count = -(-len(data) * 8 // (bits * channels))
+    region = flat[start:start + pixel_count, :channels].reshape(-1)
+    _embed_bits(region, data, bits)
+    flat[start:start + pixel_count, :channels] = region.reshape(pixel_count, channels)
+
+
+def _read_region(pixels, start, length, bits, channels):
+    """Reads length bytes embedded by _write_region, touching only the pixels that hold them."""
+    flat = pixels.reshape(-1, pixels.shape[-1])
+    pixel_count = -(-length * 8 // (bits * channels))
+    return _extract_bits(flat[start:start + pixel_count, :channels].reshape(-1), length, bits)
+
+
+def embedding_capacity(width, height, bits=1, channels=3):
+    """Number of payload bytes that fit in a width x height image."""
+    return max(0, (width * height - HEADER_PIXELS) * channels * bits // 8)
+
+
+@profiled("encode_image")
+def encode_image(input_image, secret_message, bits=1, channels=3):
+    """
+    Encodes a secret message (str, encoded as UTF-8, or bytes) into an image.
+    bits is the number of low bits used per channel (1-4) and channels is 3 for RGB
+    or 4 to use the alpha channel too. Returns the encoded PNG in a BytesIO.
+    """
+    if bits not in (1, 2, 3, 4):
+        raise ValueError("The number of bits per channel must be between 1 and 4.")
+    if channels not in (3, 4):
+        raise ValueError("Channels must be 3 (RGB) or 4 (RGBA).")
+    payload = secret_message.encode("utf-8") if isinstance(secret_message, str) else bytes(secret_message)
+
+    raster = _open_raster(input_image, channels)
+    capacity = embedding_capacity(raster.width, raster.height, bits, channels)
+    if raster.width * raster.height < HEADER_PIXELS:
+        raise ValueError("The image is too small to hold hidden data.")
+    if len(payload) > capacity:
+        raise ValueError(f"The secret message is {len(payload)} bytes, but this image can hold at most {capacity} bytes with these settings.")
+
+    # Only the leading rows that hold the header and payload are turned into an array
+    used = HEADER_PIXELS + -(-len(payload) * 8 // (bits * channels))
+    with span("encode_image.embed", nbytes=len(payload), pixels=used):
+        pixels = raster.rows(0, -(-used // raster.width))
+        header = STEGO_HEADER.pack(STEGO_MAGIC, STEGO_VERSION, bits, channels, len(payload), zlib.crc32(payload))
+        _write_region(pixels, 0, header, 1, 3)
+        _write_region(pixels, HEADER_PIXELS, payload, bits, channels)
+        raster.paste(0, pixels)
+
+    output = io.BytesIO()
+    with span("encode_image.save_png", pixels=raster.width * raster.height) as stage:
+        raster.image.save(output, format='PNG')
+        stage.add(nbytes=output.tell())
+    raster.close()
+    output.seek(0)
+    return output
+
+
+@profiled("decode.legacy")
+def _decode_legacy(raster):
+    """Reads a message stored by the delimiter-terminated format of earlier versions."""
+    total = raster.width * raster.height
+
+    # Read the LSBs in growing windows and stop as soon as the delimiter shows up,
+    # so short messages never touch the rest of the image. Windows are a multiple
+    # of 8 pixels (24 bits), so every window yields whole bytes.
+    chunks = []
+    end = -1
+    start = 0
+    window = 8 * 1024
+    while start < total:
+        lsbs = (raster.span(start, min(total, start + window))[:, :3] & 1).reshape(-1)
+        chunk = np.packbits(lsbs[:lsbs.size - lsbs.size % 8]).tobytes()
+        end = chunk.find(b'\xfe')
+        if end != -1:
+            chunks.append(chunk[:end])
+            break
+        chunks.append(chunk)
+        start += window
+        window *= 2
+
+    message = b"".join(chunks)
+    if end != -1 and message.endswith(b'\xff'):
+        # First half of the 16-bit delimiter
+        message = message[:-1]
+    return message
+
+
+@profiled("decode.container")
+def _read_container(raster):
+    """Returns the payload of a container, or None if the image has no valid container header."""
+    width, height = raster.size
+    if width * height < HEADER_PIXELS:
+        return None
+    magic, version, bits, channels, length, checksum = STEGO_HEADER.unpack(
+        _read_region(raster.span(0, HEADER_PIXELS), 0, STEGO_HEADER.size, 1, 3))
+    if magic != STEGO_MAGIC or version != STEGO_VERSION or bits not in (1, 2, 3, 4) or channels not in (3, 4):
+        return None
+    if channels > raster.bands or length > embedding_capacity(width, height, bits, channels):
+        raise ValueError("The image has a corrupted steganography header.")
+    # Only the rows that hold the payload are decoded into an array
+    stop = HEADER_PIXELS + -(-length * 8 // (bits * channels))
+    payload = _read_region(raster.span(HEADER_PIXELS, stop), 0, length, bits, channels)
+    if zlib.crc32(payload) != checksum:
+        raise ValueError("The hidden data is corrupted (checksum mismatch).")
+    return payload
+
+
+@profiled("decode_payload")
+def decode_payload(encoded_image):
+    """Decodes the hidden bytes from an image."""
+    with _open_raster(encoded_image) as raster:
+        payload = _read_container(raster)
+        return _decode_legacy(raster) if payload is None else payload
+
+
+@profiled("decode_image")
+def decode_image(encoded_image):
+    """Decodes a secret message from an image."""
+    with _open_raster(encoded_image) as raster:
+        payload = _read_container(raster)
+        if payload is None:
+            # Older images hide Latin-1 text terminated by a delimiter
+            return _decode_legacy(raster).decode('latin-1')
+    return payload.decode("utf-8", errors="replace")
+
+
+@profiled("lsb_analysis")
+def lsb_analysis(image):
+    """
+    Analyzes the Least Significant Bits (LSB) of the image pixels
+    and checks for irregularities that might indicate hidden data.
+    Returns the percentage of 0s and 1s in the LSBs and the full detector report
+    (chi-square, RS and sample pair analysis per channel and per region, see
+    steganalysis.analyze_pixels), or (None, None) for an empty image.
+    """
+    # Ensure RGB mode; strips are converted and analysed one at a time
+    with Raster(image, "RGB") as raster:
+        if raster.width * raster.height == 0:
+            return None, None
+        with span("lsb_analysis.analyze", pixels=raster.width * raster.height):
+            report = analyze_strips(raster.strips(), raster.size)
+    return report["lsb_percentage"], report
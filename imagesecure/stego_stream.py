@@ -0,0 +1,276 @@
+"""
+Hiding one large payload (a file, an archive) across many cover images.
+
+    python -m imagesecure.stego_stream hide archive.zip covers/ carriers/ --bits 2
+    python -m imagesecure.stego_stream reveal carriers/ archive.zip
+
+The payload is read as a stream and cut into fragments sized to each cover's
+capacity; every fragment is hidden with encode_image, so it is protected by
+the container's CRC. A fragment header records the stream it belongs to, its
+sequence number, whether it is the last one and its byte offset in the
+payload, so carriers can be revealed in any order and every fragment is
+written straight to its place in the output. Images that carry no fragment
+(other pictures in the same folder) are skipped and reported; revealing only
+fails when fragments are actually missing. Covers are encoded and carriers
+decoded on a thread pool with a bounded number of fragments in flight, so
+memory use depends on the fragment size, not on the payload size.
+"""
+import argparse
+import os
+import struct
+import sys
+from pathlib import Path
+
+from PIL import Image
+
+from .batch import IMAGE_EXTENSIONS, find_inputs
+from .stego import decode_payload, embedding_capacity, encode_image
+from .workers import capture_errors, ordered_map
+
+FRAGMENT_MAGIC = b"ISF1"
+# magic, stream id, sequence number, flags, offset of the fragment in the payload
+FRAGMENT_HEADER = struct.Struct(">4s16sIBQ")
+FRAGMENT_FINAL = 1
+# Bytes read from the payload source at a time when it is a file-like object
+READ_SIZE = 1024 * 1024
+
+
+class _PayloadReader:
+    """Reads exact-size pieces from bytes, a file-like object or an iterable of byte chunks."""
+
+    def __init__(self, payload):
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            payload = [bytes(payload)]
+        elif hasattr(payload, "read"):
+            source = payload
+            payload = iter(lambda: source.read(READ_SIZE), b"")
+        self._chunks = iter(payload)
+        self._buffer = bytearray()
+
+    def _fill(self, size):
+        while len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return
+            self._buffer += chunk
+
+    def read(self, size):
+        self._fill(size)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def at_end(self):
+        self._fill(1)
+        return not self._buffer
+
+
+def _cover_size(cover):
+    if isinstance(cover, Image.Image):
+        return cover.size
+    if isinstance(cover, (str, os.PathLike)):
+        with Image.open(cover) as image:
+            return image.size
+    # Files given as objects belong to the caller: only the header is read, then rewound
+    position = cover.tell()
+    size = Image.open(cover).size
+    cover.seek(position)
+    return size
+
+
+def _plan(payload, covers, bits, channels):
+    """Yields (cover index, cover, fragment) until the payload is used up."""
+    reader = _PayloadReader(payload)
+    stream_id = os.urandom(16)
+    offset = 0
+    sequence = 0
+    for cover_index, cover in enumerate(covers):
+        room = embedding_capacity(*_cover_size(cover), bits, channels) - FRAGMENT_HEADER.size
+        if room <= 0:
+            # Too small to be worth a fragment
+            continue
+        data = reader.read(room)
+        final = reader.at_end()
+        header = FRAGMENT_HEADER.pack(FRAGMENT_MAGIC, stream_id, sequence, FRAGMENT_FINAL if final else 0, offset)
+        yield cover_index, cover, header + data
+        if final:
+            return
+        offset += len(data)
+        sequence += 1
+    raise ValueError(f"The cover images can hold only {offset} bytes of the payload; add more or larger covers.")
+
+
+def hide_stream(payload, covers, bits=1, channels=3, workers=None):
+    """
+    Hides payload (bytes, a readable file-like object or an iterable of byte
+    chunks) across covers (an iterable of image paths, file-like objects or PIL
+    images), each filled to capacity with encode_image(bits, channels).
+
+    Yields (cover index, encoded PNG in a BytesIO) in cover order as carriers are
+    ready; covers left over once the payload is used up are not touched. Both the
+    payload and the covers are consumed lazily. Raises ValueError once the covers
+    run out before the payload does.
+    """
+    def embed(cover_index, cover, fragment):
+        return cover_index, encode_image(cover, fragment, bits, channels)
+
+    yield from ordered_map(embed, _plan(payload, covers, bits, channels), workers)
+
+
+def parse_fragment(data):
+    """Splits a revealed fragment into (stream id, sequence number, final, offset, data)."""
+    if len(data) < FRAGMENT_HEADER.size:
+        raise ValueError("The image does not carry a payload fragment.")
+    magic, stream_id, sequence, flags, offset = FRAGMENT_HEADER.unpack_from(data)
+    if magic != FRAGMENT_MAGIC:
+        raise ValueError("The image does not carry a payload fragment.")
+    return stream_id, sequence, bool(flags & FRAGMENT_FINAL), offset, data[FRAGMENT_HEADER.size:]
+
+
+class PayloadAssembler:
+    """
+    Reassembles a payload from fragments given in any order, writing each one at
+    its offset in a seekable destination. Only the sequence numbers, offsets and
+    lengths are kept in memory.
+    """
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.stream_id = None
+        self.final = None
+        # sequence number -> (offset, length)
+        self.fragments = {}
+
+    def add(self, fragment):
+        """Adds one fragment (bytes revealed from a carrier). Returns False for a duplicate."""
+        stream_id, sequence, final, offset, data = parse_fragment(fragment)
+        if self.stream_id is None:
+            self.stream_id = stream_id
+        elif stream_id != self.stream_id:
+            raise ValueError("The carrier belongs to a different payload.")
+        if sequence in self.fragments:
+            return False
+        if final:
+            self.final = sequence
+        self.fragments[sequence] = (offset, len(data))
+        self.destination.seek(offset)
+        self.destination.write(data)
+        return True
+
+    @property
+    def missing(self):
+        """Sequence numbers known to be missing (None while the last fragment is unseen)."""
+        if self.final is None:
+            return None
+        return [sequence for sequence in range(self.final + 1) if sequence not in self.fragments]
+
+    def finish(self):
+        """Checks that the payload is complete and consistent. Returns its length."""
+        if self.final is None:
+            raise ValueError("The last fragment of the payload is missing.")
+        missing = self.missing
+        if missing:
+            raise ValueError(f"{len(missing)} fragment(s) of the payload are missing: {missing[:10]}")
+        expected = 0
+        for sequence in range(self.final + 1):
+            offset, length = self.fragments[sequence]
+            if offset != expected:
+                raise ValueError("The payload fragments are inconsistent.")
+            expected += length
+        self.destination.seek(expected)
+        self.destination.truncate()
+        return expected
+
+
+def _read_fragment(carrier):
+    fragment, error = capture_errors(decode_payload, carrier)
+    if error is None:
+        error = capture_errors(parse_fragment, fragment)[1]
+    return carrier, fragment, error
+
+
+def reveal_stream(carriers, destination, workers=None, skipped=None):
+    """
+    Reassembles a payload hidden by hide_stream from its carriers (image paths,
+    file-like objects or PIL images, in any order) into a seekable, writable
+    destination. Carriers are decoded on `workers` threads. Images that do not
+    decode to a fragment are skipped; skipped, if given, is called as
+    skipped(carrier, error) for each of them.
+    Raises ValueError if a fragment is missing or a carrier is from another
+    payload. Returns the payload length.
+    """
+    assembler = PayloadAssembler(destination)
+    for carrier, fragment, error in ordered_map(_read_fragment, ((carrier,) for carrier in carriers), workers):
+        if error is not None:
+            if skipped is not None:
+                skipped(carrier, error)
+            continue
+        assembler.add(fragment)
+    return assembler.finish()
+
+
+def _carrier_name(rel):
+    # Carriers are PNGs; other covers keep their extension in the name, so a.jpg
+    # and a.png do not both become a.png
+    return rel if rel.suffix.lower() == ".png" else rel.with_name(rel.name + ".png")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m imagesecure.stego_stream",
+                                     description="Hide a file across many cover images, or reassemble it.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    hide = commands.add_parser("hide", help="hide a file across the images of a directory")
+    hide.add_argument("payload", help="file to hide ('-' for standard input)")
+    hide.add_argument("covers", help="directory of cover images, used in sorted order")
+    hide.add_argument("destination", help="directory to write the carrier PNGs to")
+    hide.add_argument("--bits", type=int, choices=[1, 2, 3, 4], default=1, help="low bits per channel used")
+    hide.add_argument("--alpha", action="store_true", help="also use the alpha channel")
+    hide.add_argument("--workers", type=int, default=None, help="worker threads (defaults to the number of CPUs)")
+    reveal = commands.add_parser("reveal", help="reassemble a file from a directory of carriers")
+    reveal.add_argument("carriers", help="directory of carrier images, in any order")
+    reveal.add_argument("output", help="file to write the payload to")
+    reveal.add_argument("--workers", type=int, default=None, help="worker threads (defaults to the number of CPUs)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "hide":
+        covers_dir, destination = Path(args.covers), Path(args.destination)
+        covers = [covers_dir / rel for rel in find_inputs(covers_dir, IMAGE_EXTENSIONS)]
+        targets = {}
+        for cover in covers:
+            target = _carrier_name(cover.relative_to(covers_dir))
+            # Lower-cased, as on case-insensitive file systems
+            other = targets.setdefault(target.as_posix().lower(), cover)
+            if other != cover:
+                raise SystemExit(f"{other} and {cover} would both be written to {destination / target}; rename one of them")
+        destination.mkdir(parents=True, exist_ok=True)
+        source = sys.stdin.buffer if args.payload == "-" else open(args.payload, "rb")
+        with source:
+            used = 0
+            for cover_index, carrier in hide_stream(source, covers, args.bits, 4 if args.alpha else 3, args.workers):
+                target = destination / _carrier_name(covers[cover_index].relative_to(covers_dir))
+                target.parent.mkdir(parents=True, exist_ok=True)
+                target.write_bytes(carrier.getbuffer())
+                used += 1
+        print(f"{used} of {len(covers)} cover images used", file=sys.stderr)
+        return 0
+
+    carriers_dir = Path(args.carriers)
+    carriers = [carriers_dir / rel for rel in find_inputs(carriers_dir, {".png"})]
+    skipped = []
+
+    def skip(carrier, error):
+        skipped.append(carrier)
+        print(f"{carrier}: skipped ({error})", file=sys.stderr, flush=True)
+
+    with open(args.output, "wb") as output:
+        length = reveal_stream(carriers, output, args.workers, skip)
+    print(f"{length} bytes recovered from {len(carriers) - len(skipped)} carriers "
+          f"({len(skipped)} other images skipped)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
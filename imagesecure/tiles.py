@@ -0,0 +1,308 @@
+"""
+Tile-level encryption of raw pixel data, with random access to any region.
+
+The pixel array is cut into fixed-size square tiles. Each tile is compressed
+with zlib and, if it overlaps one of the selected regions (or always, when no
+regions are given), sealed with AES-GCM. A tile index after the header records
+where every tile is stored and whether it is encrypted, so a viewer reads,
+decrypts and decodes only the tiles under its viewport: the cost of showing a
+region grows with the region, not with the image.
+
+Layout: header | tile index (offset, length, flags per tile, row by row) |
+index tag | tiles. Every file is sealed under its own key, derived from the
+key and a random salt in the header. The index tag authenticates the header
+and the whole index, so with the key no tile can be moved, swapped or turned
+from encrypted into plain (attacker-chosen) pixels. Unencrypted tiles are
+stored in the clear followed by an AES-GCM tag over their bytes, so with the
+key they cannot be replaced either. They are readable without the key, so a
+partly encrypted image can be shown with its protected regions blacked out;
+without the key nothing is authenticated.
+
+Compression runs before encryption, so the stored length of an encrypted
+tile says how compressible its pixels are (a flat patch of sky is shorter
+than a face). Pass pad=True to store encrypted tiles uncompressed, making
+their length depend only on their size.
+"""
+import os
+import struct
+import zlib
+
+import numpy as np
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from PIL import Image
+
+from .crypto import TAG_SIZE, derive_file_key
+from .profiling import profiled
+from .workers import ordered_map
+
+TILED_MAGIC = b"IST2"
+# magic, width, height, bands, tile size, salt
+TILED_HEADER = struct.Struct(">4sIIBI16s")
+# Files of the first version have a nonce prefix instead of the salt, use the key
+# directly and have no index tag; they are only read when asked for explicitly
+LEGACY_TILED_MAGIC = b"IST1"
+LEGACY_TILED_HEADER = struct.Struct(">4sIIBI7s")
+# offset of the tile from the start of the file, stored length, flags
+TILE_ENTRY = struct.Struct(">QIB")
+TILE_ENCRYPTED = 1
+TILE_COMPRESSED = 2
+DEFAULT_TILE_SIZE = 256
+
+_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+
+def is_tiled_encrypted(header_bytes):
+    """Returns True if the bytes start with a tiled container header (of any version)."""
+    return header_bytes[:len(TILED_MAGIC)] in (TILED_MAGIC, LEGACY_TILED_MAGIC)
+
+
+def _nonce(index, final=False):
+    # Every file has its own key, so the tile number alone keeps nonces unique;
+    # the index tag is the only value sealed with the final flag set
+    return struct.pack(">7xIB", index, 1 if final else 0)
+
+
+def _pixels(image):
+    if isinstance(image, Image.Image):
+        if image.mode not in _MODES.values():
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        image = np.asarray(image)
+    pixels = np.asarray(image, dtype=np.uint8)
+    if pixels.ndim == 2:
+        pixels = pixels[..., None]
+    if pixels.ndim != 3 or pixels.shape[2] not in _MODES:
+        raise ValueError("Expected an L, RGB or RGBA image.")
+    return pixels
+
+
+def _overlaps(box, regions):
+    left, top, right, bottom = box
+    return any(left < r and l < right and top < b and t < bottom for l, t, r, b in regions)
+
+
+@profiled("encrypt_tiles")
+def encrypt_tiles(image, destination, key, regions=None, tile_size=DEFAULT_TILE_SIZE, workers=None, pad=False):
+    """
+    Writes the pixels of image (PIL image or array) to a seekable destination as
+    a tiled container. regions is a list of (left, top, right, bottom) boxes:
+    only the tiles they touch are encrypted; None encrypts every tile. With pad,
+    encrypted tiles are stored uncompressed so their length leaks nothing.
+    Tiles are compressed and sealed in parallel on `workers` threads.
+    Returns the number of encrypted tiles.
+    """
+    pixels = _pixels(image)
+    height, width, bands = pixels.shape
+    rows, cols = -(-height // tile_size), -(-width // tile_size)
+
+    header = TILED_HEADER.pack(TILED_MAGIC, width, height, bands, tile_size, os.urandom(16))
+    aesgcm = AESGCM(derive_file_key(key, header[-16:], TILED_MAGIC + b" tiles"))
+
+    def seal(index, box):
+        left, top, right, bottom = box
+        data = np.ascontiguousarray(pixels[top:bottom, left:right]).tobytes()
+        if regions is not None and not _overlaps(box, regions):
+            # Left readable, and authenticated by a tag that seals nothing but covers the tile
+            data = zlib.compress(data, 1)
+            return data + aesgcm.encrypt(_nonce(index), b"", header + bytes([TILE_COMPRESSED]) + data), TILE_COMPRESSED
+        flags = TILE_ENCRYPTED
+        if not pad:
+            data = zlib.compress(data, 1)
+            flags |= TILE_COMPRESSED
+        # The flags are bound to the tile, and the index tag binds the whole index
+        return aesgcm.encrypt(_nonce(index), data, header + bytes([flags])), flags
+
+    boxes = [(c * tile_size, r * tile_size, min(width, (c + 1) * tile_size), min(height, (r + 1) * tile_size))
+             for r in range(rows) for c in range(cols)]
+
+    # The index and its tag are written once every tile's size is known
+    start = destination.tell()
+    index_size = TILE_ENTRY.size * len(boxes)
+    destination.write(header)
+    destination.write(bytes(index_size + TAG_SIZE))
+    offset = TILED_HEADER.size + index_size + TAG_SIZE
+    index = []
+    for data, flags in ordered_map(seal, enumerate(boxes), workers):
+        destination.write(data)
+        index.append(TILE_ENTRY.pack(offset, len(data), flags))
+        offset += len(data)
+    end = destination.tell()
+    index = b"".join(index)
+    destination.seek(start + TILED_HEADER.size)
+    destination.write(index)
+    destination.write(aesgcm.encrypt(_nonce(0, final=True), b"", header + index))
+    destination.seek(end)
+    return sum(1 for _, _, flags in TILE_ENTRY.iter_unpack(index) if flags & TILE_ENCRYPTED)
+
+
+def _inflate(data, size):
+    """Decompresses a tile of size bytes, never producing more, so a crafted tile cannot exhaust memory."""
+    inflater = zlib.decompressobj()
+    data = inflater.decompress(data, size)
+    if len(data) != size or not inflater.eof or inflater.unconsumed_tail or inflater.unused_data:
+        raise ValueError("tile does not decompress to its size")
+    return data
+
+
+class TiledImage:
+    """
+    Random-access reader of a tiled container in a seekable file-like object.
+    Only the header and tile index are read on open, and with a key the index is
+    authenticated before anything else; tiles are read on demand and, with a
+    key, every tile is authenticated as it is read. Without a key, encrypted
+    tiles are returned black. Files of the first version, whose index
+    cannot be authenticated, are refused unless legacy is set.
+    """
+
+    def __init__(self, source, key=None, legacy=False):
+        self.source = source
+        self.key = key
+        self._base = source.tell()
+        magic = source.read(len(TILED_MAGIC))
+        self.legacy = magic == LEGACY_TILED_MAGIC
+        if self.legacy and not legacy:
+            raise ValueError("Decryption Error: this tiled file was written by an earlier version whose tile "
+                             "index is not authenticated; open it with legacy=True only if you trust its source")
+        layout = LEGACY_TILED_HEADER if self.legacy else TILED_HEADER
+        self.header = magic + source.read(layout.size - len(magic))
+        if len(self.header) != layout.size or not is_tiled_encrypted(self.header):
+            raise ValueError("Decryption Error: not a tiled encrypted file")
+        _, width, height, bands, self.tile_size, salt = layout.unpack(self.header)
+        if bands not in _MODES or self.tile_size == 0:
+            raise ValueError("Decryption Error: corrupted header")
+        self.size = (width, height)
+        self.mode = _MODES[bands]
+        self.bands = bands
+        self.grid = (-(-height // self.tile_size), -(-width // self.tile_size))
+
+        count = self.grid[0] * self.grid[1]
+        index = source.read(TILE_ENTRY.size * count)
+        if len(index) != TILE_ENTRY.size * count:
+            raise ValueError("Decryption Error: truncated tile index")
+        self.index = list(TILE_ENTRY.iter_unpack(index))
+
+        self._aesgcm = None
+        if self.legacy:
+            self.index = [(offset, length, flags | TILE_COMPRESSED) for offset, length, flags in self.index]
+            if key is not None:
+                self._aesgcm = AESGCM(key)
+            return
+        tag = source.read(TAG_SIZE)
+        if key is not None:
+            self._aesgcm = AESGCM(derive_file_key(key, salt, TILED_MAGIC + b" tiles"))
+            try:
+                self._aesgcm.decrypt(_nonce(0, final=True), tag, self.header + index)
+            except InvalidTag:
+                raise ValueError("Decryption Error: incorrect key or corrupted tile index")
+
+    @property
+    def encrypted_tiles(self):
+        """Indices of the encrypted tiles, row by row."""
+        return [i for i, (_, _, flags) in enumerate(self.index) if flags & TILE_ENCRYPTED]
+
+    def _tile_box(self, index):
+        row, col = divmod(index, self.grid[1])
+        width, height = self.size
+        size = self.tile_size
+        return col * size, row * size, min(width, (col + 1) * size), min(height, (row + 1) * size)
+
+    def _open(self, index, data):
+        left, top, right, bottom = self._tile_box(index)
+        shape = (bottom - top, right - left, self.bands)
+        flags = self.index[index][2]
+        if not flags & TILE_ENCRYPTED and not self.legacy:
+            data, tag = data[:-TAG_SIZE], data[-TAG_SIZE:]
+            if self._aesgcm is not None:
+                try:
+                    self._aesgcm.decrypt(_nonce(index), tag, self.header + bytes([flags]) + data)
+                except InvalidTag:
+                    raise ValueError("Decryption Error: incorrect key or corrupted data")
+        elif flags & TILE_ENCRYPTED:
+            if self._aesgcm is None:
+                return np.zeros(shape, dtype=np.uint8)
+            if self.legacy:
+                nonce, aad = self.header[-7:] + struct.pack(">IB", index, 0), self.header
+            else:
+                nonce, aad = _nonce(index), self.header + bytes([flags])
+            try:
+                data = self._aesgcm.decrypt(nonce, data, aad)
+            except InvalidTag:
+                raise ValueError("Decryption Error: incorrect key or corrupted data")
+        try:
+            if flags & TILE_COMPRESSED:
+                data = _inflate(data, shape[0] * shape[1] * shape[2])
+            return np.frombuffer(data, dtype=np.uint8).reshape(shape)
+        except (zlib.error, ValueError):
+            raise ValueError("Decryption Error: corrupted tile")
+
+    def _read(self, index):
+        offset, length, flags = self.index[index]
+        self.source.seek(self._base + offset)
+        data = self.source.read(length)
+        minimum = 0 if self.legacy and not flags & TILE_ENCRYPTED else TAG_SIZE
+        if len(data) != length or length < minimum:
+            raise ValueError("Decryption Error: truncated data")
+        return index, data
+
+    @profiled("read_region")
+    def read_region(self, box=None, workers=None):
+        """
+        Returns the pixels inside box (left, top, right, bottom; default the whole
+        image) as a PIL image. Only the tiles overlapping the box are read,
+        decrypted and decompressed, in parallel on `workers` threads.
+        """
+        width, height = self.size
+        left, top, right, bottom = box or (0, 0, width, height)
+        left, top = max(0, left), max(0, top)
+        right, bottom = min(width, right), min(height, bottom)
+        if left >= right or top >= bottom:
+            raise ValueError("The region lies outside the image.")
+
+        size = self.tile_size
+        indices = [row * self.grid[1] + col
+                   for row in range(top // size, (bottom - 1) // size + 1)
+                   for col in range(left // size, (right - 1) // size + 1)]
+        region = np.empty((bottom - top, right - left, self.bands), dtype=np.uint8)
+        tiles = (self._read(index) for index in indices)
+        for index, tile in zip(indices, ordered_map(self._open, tiles, workers)):
+            tile_left, tile_top, tile_right, tile_bottom = self._tile_box(index)
+            # Intersection of the tile with the region, in image coordinates
+            x0, y0 = max(left, tile_left), max(top, tile_top)
+            x1, y1 = min(right, tile_right), min(bottom, tile_bottom)
+            region[y0 - top:y1 - top, x0 - left:x1 - left] = tile[y0 - tile_top:y1 - tile_top, x0 - tile_left:x1 - tile_left]
+        if self.bands == 1:
+            region = region[..., 0]
+        return Image.fromarray(region)
+
+    @profiled("tiled_thumbnail")
+    def thumbnail(self, max_size, workers=None):
+        """
+        Returns the whole image scaled to fit in max_size x max_size as a PIL image,
+        without assembling it at full resolution: every tile is cut down to every
+        step-th pixel as it is decoded, and without a key encrypted tiles are not
+        read at all.
+        """
+        width, height = self.size
+        step = max(1, max(width, height) // max_size)
+        reduced = np.zeros((-(-height // step), -(-width // step), self.bands), dtype=np.uint8)
+
+        def reduce(index, data):
+            left, top, _, _ = self._tile_box(index)
+            # Only the rows and columns that are multiples of step, in image coordinates
+            return self._open(index, data)[-top % step::step, -left % step::step]
+
+        indices = [index for index, (_, _, flags) in enumerate(self.index)
+                   if self._aesgcm is not None or not flags & TILE_ENCRYPTED]
+        tiles = (self._read(index) for index in indices)
+        for index, tile in zip(indices, ordered_map(reduce, tiles, workers)):
+            left, top, _, _ = self._tile_box(index)
+            row, col = -(-top // step), -(-left // step)
+            reduced[row:row + tile.shape[0], col:col + tile.shape[1]] = tile
+        image = Image.fromarray(reduced[..., 0] if self.bands == 1 else reduced)
+        image.thumbnail((max_size, max_size))
+        return image
+
+
+# Function to decrypt a whole tiled container back to an image
+def decrypt_tiles(source, key, workers=None, legacy=False):
+    return TiledImage(source, key, legacy).read_region(workers=workers)
@@ -0,0 +1,136 @@
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from .profiling import profiled, span
+from .raster import Raster
+
+
+DEFAULT_FONT = "arial.ttf"
+
+
+# Fonts, text stamps and stamp placements are cached, so Streamlit reruns and
+# batches of same-size images do not load fonts or render text again
+@lru_cache(maxsize=32)
+def _load_font(font_path, font_size):
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except IOError:
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=64)
+def _render_stamp(watermark_text, size, opacity, font_path, color):
+    """Renders the text once into a tightly sized RGBA stamp."""
+    font = _load_font(font_path, int(size))
+    right, bottom = ImageDraw.Draw(Image.new("RGBA", (1, 1))).textbbox((0, 0), watermark_text, font=font)[2:]
+    stamp = Image.new("RGBA", (max(right, 1), max(bottom, 1)), (255, 255, 255, 0))
+    ImageDraw.Draw(stamp).text((0, 0), watermark_text, font=font, fill=color + (int(opacity),))
+    return stamp
+
+
+@lru_cache(maxsize=64)
+def _watermark_layer(image_size, watermark_text, size, opacity, font_path):
+    """
+    Returns the (stamp, destination, source box) placements of the watermark on an
+    image of the given size, clipped to the image, so only the areas the text lands
+    on are ever composited.
+    """
+    width, height = image_size
+    shadow = _render_stamp(watermark_text, size, opacity * 0.3, font_path, (0, 0, 0))
+    stamp = _render_stamp(watermark_text, size, opacity, font_path, (255, 255, 255))
+    text_width, text_height = stamp.size
+
+    # Calculate center position
+    x = (width - text_width) // 2
+    y = (height - text_height) // 2
+
+    # Shadow at the center, then the main watermark in a slant line
+    positions = [(shadow, x + 3, y + 3)]
+    positions += [(stamp, x + i, y + i) for i in range(-width, width, text_width + 20)]
+
+    placements = []
+    for image, left, top in positions:
+        box = (max(0, -left), max(0, -top), min(text_width, width - left), min(text_height, height - top))
+        if box[0] < box[2] and box[1] < box[3]:
+            placements.append((image, (max(0, left), max(0, top)), box))
+    return tuple(placements)
+
+
+# Function to create a visible watermark on an image
+@profiled("add_visible_watermark")
+def add_visible_watermark(image, watermark_text, size, opacity, font_path=DEFAULT_FONT):
+    pixels = image.width * image.height
+    with span("add_visible_watermark.layer"):
+        placements = _watermark_layer(image.size, watermark_text, size, opacity, font_path)
+    with span("add_visible_watermark.to_rgba", pixels=pixels):
+        combined_image = image.convert("RGBA")
+    with span("add_visible_watermark.composite", pixels=sum((box[2] - box[0]) * (box[3] - box[1]) for _, _, box in placements)):
+        for stamp, destination, box in placements:
+            combined_image.alpha_composite(stamp, destination, box)
+    with span("add_visible_watermark.to_rgb", pixels=pixels):
+        return combined_image.convert("RGB")
+
+
+def _rows_for(raster, values):
+    """Number of leading rows holding the first `values` channel values of the image."""
+    row_values = raster.width * raster.bands
+    if values > row_values * raster.height:
+        raise ValueError("The image is too small for this watermark.")
+    return max(1, -(-values // row_values))
+
+
+def watermark_bits(watermark_text):
+    """The bits add_invisible_watermark embeds for watermark_text, as a uint8 array of 0s and 1s."""
+    try:
+        return np.unpackbits(np.frombuffer(watermark_text.encode("latin-1"), dtype=np.uint8))
+    except UnicodeEncodeError:
+        # Characters past U+00FF take more than 8 bits each
+        return np.array([int(bit) for char in watermark_text for bit in format(ord(char), '08b')], dtype=np.uint8)
+
+
+def extract_bits(raster, count):
+    """The low bits of the first `count` channel values of a Raster, decoding only their rows."""
+    return raster.rows(0, _rows_for(raster, count)).reshape(-1)[:count] & 1
+
+
+# Function to embed an invisible watermark in an image
+@profiled("add_invisible_watermark")
+def add_invisible_watermark(image, watermark_text):
+    binary_watermark = watermark_bits(watermark_text)
+    raster = Raster(image)
+
+    # Only the leading rows that carry the watermark bits are turned into an array
+    strip = raster.rows(0, _rows_for(raster, len(binary_watermark)))
+    flat_image = strip.reshape(-1)
+    with span("add_invisible_watermark.embed", nbytes=len(watermark_text)):
+        flat_image[:len(binary_watermark)] = flat_image[:len(binary_watermark)] & 0xFE | binary_watermark
+
+    with span("add_invisible_watermark.paste", pixels=strip.shape[0] * raster.width):
+        raster.paste(0, strip)
+    return raster.image
+
+
+def watermark_file(source, watermark, *args):
+    """
+    Applies watermark(RGB image, *args) to an image file. Returns the watermarked
+    image and the format to save it in: PNG for add_invisible_watermark, whose bits
+    lossy compression would erase; the source's own format for the visible and
+    robust watermarks, which survive re-encoding.
+    """
+    with Image.open(source) as image:
+        image_format = image.format
+        watermarked = watermark(image.convert("RGB"), *args)
+    if watermark is add_invisible_watermark or image_format is None:
+        image_format = "PNG"
+    return watermarked, image_format
+
+
+# Function to detect an invisible watermark in an image
+@profiled("detect_invisible_watermark")
+def detect_invisible_watermark(image, watermark_length):
+    raster = Raster(image)
+    with span("detect_invisible_watermark.extract", nbytes=watermark_length):
+        watermark = np.packbits(extract_bits(raster, watermark_length * 8)).tobytes().decode("latin-1")
+    return watermark
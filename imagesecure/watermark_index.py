@@ -0,0 +1,242 @@
+"""
+Batch verification of invisible (LSB) watermarks against a set of known signatures.
+
+    python -m imagesecure.watermark_index signatures.txt images/ --min-confidence 0.9
+
+The watermark texts are indexed once: per bit length, a hash set of their
+bit-packed forms answers exact matches in O(1), and a bit-packed matrix of
+all of them gives Hamming distances with a byte-wise XOR and a popcount table.
+Each image only has the rows holding the longest signature decoded (PNGs stop
+decoding there), its low bits are extracted with NumPy and packed, and images
+are matched in chunks as one array. A signature is compared in full only if
+the first PREFIX_BYTES of it are already within the error budget that
+min_confidence allows, so most non-matching pairs are rejected after 8 bytes.
+
+Confidence is the fraction of the signature's bits found in the image: 1.0
+for an intact watermark, about 0.5 for an unmarked image.
+"""
+import argparse
+import csv
+import json
+import math
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from .batch import IMAGE_EXTENSIONS, find_inputs
+from .profiling import span
+from .raster import Raster
+from .watermark import extract_bits, watermark_bits
+from .workers import capture_errors, ordered_map
+
+DEFAULT_MIN_CONFIDENCE = 0.9
+# Leading bytes of each signature compared before the rest of it
+PREFIX_BYTES = 8
+# Images matched together as one array
+CHUNK_IMAGES = 256
+# Image and signature byte pairs XORed at once when comparing prefixes
+PAIR_BLOCK = 4 * 1024 * 1024
+# Set bits in every byte value
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint16)
+RESULT_COLUMNS = ("source", "status", "signature", "confidence", "exact", "error")
+
+
+class SignatureIndex:
+    """
+    Known watermark texts, grouped by bit length into a hash set of their packed
+    bits (exact matches) and a packed (signatures, bytes) matrix (Hamming distances).
+    """
+
+    def __init__(self, signatures):
+        self.signatures = list(dict.fromkeys(signatures))
+        if not self.signatures:
+            raise ValueError("At least one watermark signature is needed.")
+        by_length = {}
+        for number, text in enumerate(self.signatures):
+            bits = watermark_bits(text)
+            if not len(bits):
+                raise ValueError("Watermark signatures cannot be empty.")
+            by_length.setdefault(len(bits), []).append((number, np.packbits(bits)))
+        # bit length -> (signature numbers, packed matrix, {packed bytes: signature number})
+        self.groups = {}
+        for length, members in sorted(by_length.items()):
+            numbers = np.array([number for number, _ in members])
+            matrix = np.stack([packed for _, packed in members])
+            exact = {packed.tobytes(): number for number, packed in members}
+            self.groups[length] = (numbers, matrix, exact)
+        self.max_bits = max(self.groups)
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def match(self, bits, available, min_confidence=DEFAULT_MIN_CONFIDENCE):
+        """
+        Matches extracted bits, an (images, max_bits) array of 0s and 1s of which the
+        first available[i] are real for image i. Returns (signature numbers, -1 where
+        nothing matched, confidences, exact) arrays.
+        """
+        count = len(bits)
+        best = np.full(count, -1)
+        confidence = np.zeros(count)
+        exact = np.zeros(count, dtype=bool)
+        # Groups go from short to long, so an exact hit on a longer signature wins a tie
+        for length, (numbers, matrix, hashed) in self.groups.items():
+            fits = np.flatnonzero(available >= length)
+            if not len(fits):
+                continue
+            packed = np.packbits(bits[fits, :length], axis=1)
+            with span("SignatureIndex.match.exact", nbytes=packed.nbytes):
+                hits = np.array([hashed.get(row.tobytes(), -1) for row in packed])
+            found = hits >= 0
+            best[fits[found]], confidence[fits[found]], exact[fits[found]] = hits[found], 1.0, True
+            # Bit errors allowed; in integers, as (1 - 0.9) * 80 is 7.999... in floating point
+            budget = length - math.ceil(min_confidence * length - 1e-9)
+            if budget == 0 or found.all():
+                continue
+            rest, packed = fits[~found], packed[~found]
+            with span("SignatureIndex.match.hamming", nbytes=packed.nbytes * len(numbers)):
+                rows, columns, distance = self._near(packed, matrix, budget)
+            scores = 1 - distance / length
+            # Best pair per image: in ascending score order the last write for an image is its best
+            order = np.argsort(scores, kind="stable")
+            rows, columns, scores = rows[order], columns[order], scores[order]
+            better = scores > confidence[rest[rows]]
+            images = rest[rows[better]]
+            best[images], confidence[images], exact[images] = numbers[columns[better]], scores[better], False
+        return best, confidence, exact
+
+    @staticmethod
+    def _near(packed, matrix, budget):
+        """(image rows, signature rows, Hamming distances) of every pair within budget bit errors."""
+        prefix = min(PREFIX_BYTES, matrix.shape[1])
+        block = max(1, PAIR_BLOCK // (len(packed) * prefix))
+        found = []
+        for first in range(0, len(matrix), block):
+            signatures = matrix[first:first + block]
+            distance = POPCOUNT[packed[:, None, :prefix] ^ signatures[None, :, :prefix]].sum(axis=2)
+            # Early rejection: pairs already over budget on the prefix are never compared in full
+            rows, columns = np.nonzero(distance <= budget)
+            distance = distance[rows, columns]
+            if prefix < matrix.shape[1]:
+                distance += POPCOUNT[packed[rows, prefix:] ^ signatures[columns, prefix:]].sum(axis=1)
+            keep = distance <= budget
+            found.append((rows[keep], columns[keep] + first, distance[keep]))
+        return tuple(np.concatenate(parts) for parts in zip(*found))
+
+
+def _extract(source, count):
+    """Low bits of the first `count` channel values of an image (fewer if it is smaller)."""
+    with Raster(source) as raster:
+        return extract_bits(raster, min(count, raster.width * raster.height * raster.bands))
+
+
+def _extract_task(source, count):
+    return (source,) + capture_errors(_extract, source, count)
+
+
+def _match_chunk(chunk, index, min_confidence):
+    """Matches a list of (source, extracted bits, error) and yields their result dicts."""
+    bits = np.zeros((len(chunk), index.max_bits), dtype=np.uint8)
+    available = np.zeros(len(chunk), dtype=np.int64)
+    for row, (_, extracted, _) in enumerate(chunk):
+        if extracted is not None:
+            bits[row, :len(extracted)] = extracted
+            available[row] = len(extracted)
+    with span("verify_watermarks.match", nbytes=bits.nbytes // 8):
+        best, confidence, exact = index.match(bits, available, min_confidence)
+    for row, (source, _, error) in enumerate(chunk):
+        result = {"source": source, "status": "no match", "signature": None, "confidence": None,
+                  "exact": False, "error": error}
+        if error is not None:
+            result["status"] = "error"
+        elif best[row] >= 0:
+            result.update(status="match", signature=index.signatures[best[row]],
+                          confidence=float(confidence[row]), exact=bool(exact[row]))
+        yield result
+
+
+def verify_watermarks(sources, index, min_confidence=DEFAULT_MIN_CONFIDENCE, workers=None):
+    """
+    Checks images (paths, file-like objects or PIL images) against a SignatureIndex.
+    Images are read on `workers` threads and matched in chunks of CHUNK_IMAGES.
+
+    Yields one dict per image, in order: source, status ("match", "no match" or
+    "error"), signature (the matching watermark text or None), confidence (the
+    fraction of the signature's bits found, for a match), exact and error. A
+    signature matches when its confidence is at least min_confidence; with
+    min_confidence=0 every pair is compared in full and each image reports its
+    best signature.
+    """
+    chunk = []
+    for item in ordered_map(_extract_task, ((source, index.max_bits) for source in sources), workers):
+        chunk.append(item)
+        if len(chunk) == CHUNK_IMAGES:
+            yield from _match_chunk(chunk, index, min_confidence)
+            chunk = []
+    if chunk:
+        yield from _match_chunk(chunk, index, min_confidence)
+
+
+def verify_watermark(source, index, min_confidence=DEFAULT_MIN_CONFIDENCE):
+    """verify_watermarks for a single image; errors reading it are raised."""
+    return next(_match_chunk([(source, _extract(source, index.max_bits), None)], index, min_confidence))
+
+
+def write_results(results, output, format="table", statuses=None):
+    """
+    Writes verify_watermarks results as an aligned table, JSON lines or CSV, only
+    those with one of the given statuses if statuses is set. Returns the counts
+    per status of all results, written or not.
+    """
+    counts = {"match": 0, "no match": 0, "error": 0}
+    writer = None
+    if format == "csv":
+        writer = csv.DictWriter(output, RESULT_COLUMNS)
+        writer.writeheader()
+    for result in results:
+        counts[result["status"]] += 1
+        if statuses is not None and result["status"] not in statuses:
+            continue
+        row = dict(result, source=str(result["source"]))
+        if format == "json":
+            output.write(json.dumps(row) + "\n")
+        elif writer is not None:
+            writer.writerow(row)
+        else:
+            confidence = "" if row["confidence"] is None else f"{row['confidence']:.3f}"
+            detail = row["error"] or row["signature"] or ""
+            output.write(f"{row['status']:<9} {confidence:>6}  {row['source']}  {detail}".rstrip() + "\n")
+    return counts
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m imagesecure.watermark_index",
+                                     description="Check images against a list of known invisible watermark texts.")
+    parser.add_argument("signatures", help="file with one watermark text per line")
+    parser.add_argument("images", help="image file or directory of images to check")
+    parser.add_argument("--min-confidence", type=float, default=DEFAULT_MIN_CONFIDENCE,
+                        help="fraction of a signature's bits that must match (default: %(default)s)")
+    parser.add_argument("--matches-only", action="store_true", help="only list images carrying a known watermark")
+    parser.add_argument("--format", choices=["table", "json", "csv"], default="table", help="output format")
+    parser.add_argument("--workers", type=int, default=None, help="worker threads (defaults to the number of CPUs)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not 0 <= args.min_confidence <= 1:
+        raise SystemExit("--min-confidence must be between 0 and 1")
+    with open(args.signatures, encoding="utf-8") as signatures:
+        index = SignatureIndex(line.rstrip("\r\n") for line in signatures if line.strip())
+    root = Path(args.images)
+    sources = [root] if root.is_file() else [root / rel for rel in find_inputs(root, IMAGE_EXTENSIONS)]
+    results = verify_watermarks(sources, index, args.min_confidence, args.workers)
+    counts = write_results(results, sys.stdout, args.format, ("match",) if args.matches_only else None)
+    print(f"{len(sources)} images checked against {len(index)} signatures: "
+          + ", ".join(f"{count} {status}" for status, count in counts.items()), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
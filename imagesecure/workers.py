@@ -0,0 +1,145 @@
+"""
+Worker pools and error reporting shared by the batch tools and the service.
+
+ProcessPool wraps a ProcessPoolExecutor that is replaced when one of its
+worker processes dies (killed for memory, say): the tasks in flight at that
+moment fail with BrokenProcessPool and everything after them runs on a fresh
+pool, so one crash cannot stop a long job or a server. Worker functions report
+their own failures through capture_errors instead of raising, so a bad file
+fails alone and never breaks the pool.
+
+ordered_map runs work that releases the GIL (AES-GCM, zlib, NumPy, image
+decoding) on a thread pool instead, keeping results in input order.
+"""
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+
+def error_message(exception):
+    """An exception as the one-line message failures are reported with."""
+    return f"{type(exception).__name__}: {exception}"
+
+
+def capture_errors(function, *args):
+    """Returns (function(*args), None), or (None, error message) if it raised."""
+    try:
+        return function(*args), None
+    except Exception as e:
+        return None, error_message(e)
+
+
+def ordered_map(function, arguments, workers=None):
+    """
+    Yields function(*args) for every args in arguments, in order, computed on
+    `workers` threads (default: one per CPU). At most 2 * workers calls are in
+    flight and arguments are consumed lazily, which bounds memory use.
+    """
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for args in arguments:
+            pending.append(pool.submit(function, *args))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def print_progress(done, total, name, error):
+    """Progress callback of the command-line tools: one line per finished item, on stderr."""
+    status = "ok" if error is None else f"FAILED ({error})"
+    print(f"[{done}/{total}] {name}: {status}", file=sys.stderr, flush=True)
+
+
+class ProcessPool:
+    """
+    A process pool that replaces its executor when a worker process dies.
+    mp_context is passed on to every executor it creates.
+    """
+
+    def __init__(self, workers=None, mp_context=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.mp_context = mp_context
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self.executor = self._new_executor()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self.mp_context)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self, cancel_futures=False):
+        self.executor.shutdown(cancel_futures=cancel_futures)
+
+    def _replace(self, broken):
+        with self._lock:
+            if self.executor is not broken:
+                # Another failed task already replaced it
+                return
+            self.executor = self._new_executor()
+            self.restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _check(self, executor, future):
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._replace(executor)
+
+    def submit(self, function, *args):
+        """
+        Submits function(*args) and returns its future. A pool found broken on submit
+        is replaced and the task goes to the new one (it never ran on the old one);
+        BrokenProcessPool is only raised if that fails too. A future failing with
+        BrokenProcessPool replaces the pool as well.
+        """
+        for attempt in range(2):
+            executor = self.executor
+            try:
+                future = executor.submit(function, *args)
+                break
+            except BrokenProcessPool:
+                self._replace(executor)
+                if attempt:
+                    raise
+        future.add_done_callback(lambda done: self._check(executor, done))
+        return future
+
+    def map_bounded(self, function, tasks, on_result, limit=None):
+        """
+        Runs function(*arguments) for every (key, arguments) in tasks, with at most
+        limit (default 4 per worker) in flight so huge inputs never queue every future
+        up front. Calls on_result(key, result, error) as tasks finish; error is None,
+        or the message of the task failing in the pool itself, as every task in flight
+        does when a worker process dies.
+        """
+        limit = limit or self.workers * 4
+        queue = iter(tasks)
+        in_flight = {}
+
+        def submit_next():
+            task = next(queue, None)
+            if task is None:
+                return
+            key, arguments = task
+            in_flight[self.submit(function, *arguments)] = key
+
+        for _ in range(limit):
+            submit_next()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key = in_flight.pop(future)
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, error_message(e)
+                on_result(key, result, error)
+                submit_next()
@@ -1,78 +1,33 @@
 import streamlit as st
 from PIL import Image
-import numpy as np
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import padding
 from io import BytesIO
+from imagesecure.buffers import SpillBuffer
+from imagesecure.preview import PREVIEW_MAX_SIZE, ciphertext_preview, display_preview
+from imagesecure.crypto import decrypt_file, encrypt_indexed, generate_key
+from imagesecure.tiles import TILED_MAGIC, TiledImage, decrypt_tiles, encrypt_tiles, is_tiled_encrypted
+from session_cache import memoize, open_image, show_upload
+
+
+# Function to parse regions typed as "left,top,right,bottom; left,top,right,bottom"
+def parse_regions(text):
+    regions = []
+    for part in text.split(";"):
+        if part.strip():
+            values = [int(value) for value in part.split(",")]
+            if len(values) != 4:
+                raise ValueError(f"'{part.strip()}' is not left,top,right,bottom")
+            regions.append(tuple(values))
+    return regions or None
+
+
 def img_cryptography():
     
-    # Function to add padding to the image bytes
-    def pad_data(data):
-        try:
-            padder = padding.PKCS7(128).padder()  # AES block size is 128 bits (16 bytes)
-            padded_data = padder.update(data) + padder.finalize()
-            return padded_data
-        except Exception as e:
-            raise ValueError(f"Padding Error: {e}")
-
-    # Function to remove padding after decryption
-    def unpad_data(data):
-        try:
-            unpadder = padding.PKCS7(128).unpadder()
-            unpadded_data = unpadder.update(data) + unpadder.finalize()
-            return unpadded_data
-        except Exception as e:
-            raise ValueError(f"Unpadding Error: {e}")
-
-    # Function to encrypt image using AES with a user-provided key
-    def encrypt_image(image_bytes, key):
-        try:
-            cipher = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
-            encryptor = cipher.encryptor()
-
-            # Pad the image bytes before encryption
-            padded_bytes = pad_data(image_bytes)
-            encrypted_bytes = encryptor.update(padded_bytes) + encryptor.finalize()
-            return encrypted_bytes
-        except Exception as e:
-            raise ValueError(f"Encryption Error: {e}")
-
-    # Function to decrypt image using AES with a user-provided key
-    def decrypt_image(encrypted_bytes, key):
-        try:
-            cipher = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
-            decryptor = cipher.decryptor()
-            decrypted_bytes = decryptor.update(encrypted_bytes) + decryptor.finalize()
-
-            # Remove padding after decryption
-            unpadded_bytes = unpad_data(decrypted_bytes)
-            return unpadded_bytes
-        except ValueError as e:
-            raise ValueError(f"Decryption Error: Invalid padding or incorrect key - {e}")
-        except Exception as e:
-            raise ValueError(f"Decryption Error: {e}")
-
     # Streamlit user interface
     st.header("Image Encryption and Decryption using AES")
 
     # Option for selecting key length
     key_length = st.selectbox("Choose AES key length:", [16, 24, 32])
 
-    # Function to generate the AES key based on user input
-    def generate_key(key_input, length):
-        try:
-            key = key_input.encode('utf-8')
-            if len(key) < length:
-                # Pad the key with null bytes if it's shorter than the selected length
-                key = key.ljust(length, b'\0')
-            elif len(key) > length:
-                # Truncate the key if it's longer than the selected length
-                key = key[:length]
-            return key
-        except Exception as e:
-            raise ValueError(f"Key Generation Error: {e}")
-
     # Input for AES Key
     key_input = st.text_input(f"Enter AES encryption key (up to {key_length} characters):", type="password")
 
@@ -94,40 +49,72 @@ def img_cryptography():
         uploaded_file = st.file_uploader("Choose an image to encrypt...", type=["jpg", "jpeg", "png"])
 
         if uploaded_file is not None and key:
-            # Display the original image
-            image = Image.open(uploaded_file)
-            st.image(image, caption=f"Original Image - Dimensions: {image.size[0]}x{image.size[1]}", use_column_width=True)
-            if st.button("Encrypt"):
-                # Convert image to bytes for encryption
-                image_bytes = BytesIO()
-                image.save(image_bytes, format="PNG")
-                image_bytes = image_bytes.getvalue()
-
-                # Encrypt the image bytes
-                encrypted_bytes = encrypt_image(image_bytes, key)
-
-                # Save the encrypted bytes as a .bin file
-                encrypted_bin_file = "encrypted_image.bin"
-                with open(encrypted_bin_file, "wb") as f:
-                    f.write(encrypted_bytes)
-
-                # To visualize encrypted data, truncate or pad it to match the original size
-                # Use numpy to create a grayscale view of the encrypted data
-                encrypted_array = np.frombuffer(encrypted_bytes, dtype=np.uint8)
-                padded_array = np.zeros(image.size[0] * image.size[1], dtype=np.uint8)
-                padded_array[:len(encrypted_array)] = encrypted_array[:len(padded_array)]
-
-                # Reshape to match image dimensions and visualize as a grayscale image
-                encrypted_image_array = padded_array.reshape(image.size[1], image.size[0])
-                encrypted_image = Image.fromarray(encrypted_image_array, mode="L")
-                encrypted_image_file = "encrypted_image.png"
-                encrypted_image.save(encrypted_image_file, format="PNG")
+            # Display a preview of the original image
+            image = open_image(uploaded_file)
+            show_upload(uploaded_file, f"Original Image - Dimensions: {image.size[0]}x{image.size[1]}")
+            # Whole-file mode encrypts the file bytes; tile mode encrypts the pixels in
+            # tiles that can be decrypted one region at a time
+            tiled = st.radio("Encryption mode", ["Whole file", "Pixel tiles"], horizontal=True) == "Pixel tiles"
+            regions_valid = True
+            if tiled:
+                tile_size = st.selectbox("Tile size (px)", [128, 256, 512], index=1)
+                regions_text = st.text_input("Regions to encrypt (left,top,right,bottom; ...), empty for the whole image")
+                try:
+                    regions = parse_regions(regions_text)
+                except ValueError as e:
+                    st.error(f"Invalid regions: {e}")
+                    regions_valid = False
+                # Compressed tile lengths reveal how detailed the encrypted regions are
+                pad = st.checkbox("Store encrypted tiles uncompressed (hides their level of detail, larger file)")
+                mode = ("tiles", tile_size, regions_text, pad)
+            else:
+                # Pass-through mode encrypts the uploaded file as-is instead of re-encoding it as PNG
+                pass_through = st.checkbox("Encrypt the uploaded file bytes directly (skip PNG re-encode)", value=True)
+                mode = ("file", pass_through)
+            preview_size = st.slider("Encrypted preview resolution (longest side, px)", 128, 2048, PREVIEW_MAX_SIZE, step=128)
+            if st.button("Encrypt", disabled=not regions_valid):
+                def encrypt():
+                    if tiled:
+                        encrypted = SpillBuffer()
+                        encrypt_tiles(image, encrypted, key, regions, tile_size, pad=pad)
+                        return encrypted
+                    if pass_through:
+                        uploaded_file.seek(0)
+                        source = uploaded_file
+                    else:
+                        # Convert image to PNG bytes for encryption
+                        source = BytesIO()
+                        image.save(source, format="PNG")
+                        source.seek(0)
+                    # Encrypt chunks in parallel into an in-memory buffer that spills to an
+                    # anonymous temp file when large
+                    encrypted = SpillBuffer()
+                    encrypt_indexed(source, encrypted, key)
+                    return encrypted
+
+                # To visualize encrypted data, lay it out over the original dimensions
+                # and sample a bounded-size grayscale thumbnail straight from the buffer
+                def visualize():
+                    if tiled:
+                        # What a viewer without the key sees: the encrypted tiles are black
+                        encrypted.seek(0)
+                        encrypted_image = TiledImage(encrypted).thumbnail(preview_size)
+                    else:
+                        with encrypted.getbuffer() as view:
+                            encrypted_image = ciphertext_preview(view, image.size, preview_size)
+                    encrypted_png = BytesIO()
+                    encrypted_image.save(encrypted_png, format="PNG")
+                    return display_preview(encrypted_image), encrypted_png
+
+                # Re-running with the same image, key and mode reuses the cached result
+                encrypted = memoize("encrypt", uploaded_file, encrypt, key, mode)
+                encrypted_preview, encrypted_png = memoize("encrypt_preview", uploaded_file, visualize, key, mode, preview_size)
 
                 # Success message and download buttons
                 st.success("Image Encrypted Successfully!")
-                st.download_button(label="Download Encrypted BIN File", data=encrypted_bytes, file_name="encrypted_image.bin")
-                st.download_button(label="Download Encrypted PNG File", data=open(encrypted_image_file, "rb").read(), file_name="encrypted_image.png")
-                st.image(encrypted_image, caption="Encrypted Image (PNG)", use_column_width=True)
+                st.download_button(label="Download Encrypted BIN File", data=encrypted, file_name="encrypted_image.bin")
+                st.download_button(label="Download Encrypted PNG File", data=encrypted_png, file_name="encrypted_image.png")
+                st.image(encrypted_preview, caption="Encrypted Image (PNG)", use_column_width=True)
 
 
     # DECRYPTION SECTION (Right Column)
@@ -139,22 +126,34 @@ def img_cryptography():
 
         if encrypted_file is not None and key:
             try:
-                # Read encrypted binary data
-                encrypted_bytes = encrypted_file.read()
-
-                # Decrypt the image
-                decrypted_bytes = decrypt_image(encrypted_bytes, key)
-
-                # Convert decrypted bytes back to image
-                decrypted_image = Image.open(BytesIO(decrypted_bytes))
-                st.image(decrypted_image, caption="Decrypted Image", use_column_width=True)
-
-                # Save decrypted image as JPG
-                decrypted_image_file = "decrypted_image.jpg"
-                decrypted_image.save(decrypted_image_file, format="JPEG")
+                def decrypt():
+                    encrypted_file.seek(0)
+                    if is_tiled_encrypted(encrypted_file.read(len(TILED_MAGIC))):
+                        # Pixel tiles decrypt straight to an image
+                        encrypted_file.seek(0)
+                        decrypted_image = decrypt_tiles(encrypted_file, key)
+                    else:
+                        # Indexed, streaming and legacy AES-ECB files are told apart by their header
+                        encrypted_file.seek(0)
+                        decrypted_buffer = SpillBuffer()
+                        decrypt_file(encrypted_file, decrypted_buffer, key)
+                        decrypted_buffer.seek(0)
+
+                        # Convert decrypted bytes back to image
+                        decrypted_image = Image.open(decrypted_buffer)
+                        decrypted_image.load()
+
+                    # Encode decrypted image as JPG for download; only a preview is shown
+                    decrypted_jpeg = SpillBuffer()
+                    decrypted_image.convert("RGB").save(decrypted_jpeg, format="JPEG")
+                    return display_preview(decrypted_image), decrypted_jpeg
+
+                # Decryption runs on every rerun, so the result is cached per file and key
+                decrypted_preview, decrypted_jpeg = memoize("decrypt", encrypted_file, decrypt, key)
+                st.image(decrypted_preview, caption="Decrypted Image", use_column_width=True)
 
                 st.success("Image Decrypted Successfully!")
-                st.download_button(label="Download Decrypted Image (JPG)", data=open(decrypted_image_file, "rb").read(), file_name="decrypted_image.jpg")
+                st.download_button(label="Download Decrypted Image (JPG)", data=decrypted_jpeg, file_name="decrypted_image.jpg")
 
             except ValueError as e:
                 st.error(f"Error in decryption: {e}. This may indicate mismatched padding or incorrect decryption keys.")
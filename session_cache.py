@@ -0,0 +1,64 @@
+import os
+import streamlit as st
+from PIL import Image
+from imagesecure.cache import ResultCache, content_digest, make_key
+from imagesecure.preview import DISPLAY_MAX_SIZE, display_preview
+
+# Per-session budget for cached images and results, in megabytes
+SESSION_CACHE_BYTES = int(os.environ.get("IMAGESECURE_SESSION_CACHE_MB", "256")) * 1024 * 1024
+# Per-session budget for upload digests (32 bytes each), so long sessions do not grow it without bound
+UPLOAD_DIGEST_BYTES = 64 * 1024
+
+
+# Function to get the cache of the current session, created on first use
+def session_cache():
+    if "imagesecure_cache" not in st.session_state:
+        st.session_state["imagesecure_cache"] = ResultCache(SESSION_CACHE_BYTES)
+    return st.session_state["imagesecure_cache"]
+
+
+# Function to get the content digest of an uploaded file, hashed once per upload
+def upload_digest(uploaded_file):
+    file_id = getattr(uploaded_file, "file_id", None)
+    if "imagesecure_digests" not in st.session_state:
+        st.session_state["imagesecure_digests"] = ResultCache(UPLOAD_DIGEST_BYTES)
+    digests = st.session_state["imagesecure_digests"]
+    if file_id is not None and file_id in digests:
+        return digests.get(file_id)
+    with uploaded_file.getbuffer() as view:
+        digest = content_digest(view)
+    if file_id is not None:
+        digests.put(file_id, digest)
+    return digest
+
+
+def memoize(operation, uploaded_file, compute, *params):
+    """
+    Returns compute() for this upload and these parameters. The result is kept in
+    the session cache, so Streamlit reruns with unchanged inputs cost a lookup.
+    """
+    key = make_key(operation, upload_digest(uploaded_file), *params)
+    return session_cache().get_or_compute(key, compute)
+
+
+def open_image(uploaded_file, mode=None):
+    """Decodes an uploaded image once per session (optionally converted to mode)."""
+    def decode():
+        uploaded_file.seek(0)
+        image = Image.open(uploaded_file)
+        if mode:
+            image = image.convert(mode)
+        image.load()
+        return image
+    return memoize("open_image", uploaded_file, decode, mode)
+
+
+def show_upload(uploaded_file, caption):
+    """
+    Shows a size-capped preview of an uploaded image, made once per upload; the
+    full-resolution file is never sent to the browser.
+    """
+    def preview():
+        uploaded_file.seek(0)
+        return display_preview(uploaded_file)
+    st.image(memoize("display_preview", uploaded_file, preview, DISPLAY_MAX_SIZE), caption=caption, use_column_width=True)
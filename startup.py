@@ -0,0 +1,98 @@
+"""
+Lazy loading of the app's pages, and a report of what starting them costs.
+
+Streamlit re-runs app.py on every interaction, but a page module is imported
+only the first time its page is opened in this server process, so a cold start
+that only shows Home never loads cryptography or the image operations (its first
+render still loads NumPy and Pillow, which st.image imports).
+
+    python startup.py
+
+measures, in a fresh interpreter per page, how long importing each page takes
+(what a new container pays before it can serve that page for the first time).
+It does not render the pages; render_page records the first render of each page
+in the running server, which the profiling panel shows.
+"""
+import importlib
+import logging
+import subprocess
+import sys
+import time
+
+# Reference point for the startup report: when the server first imported the app
+PROCESS_START = time.perf_counter()
+
+# Page name -> (module, function rendering the page)
+PAGES = {
+    "Home": ("home", "home_"),
+    "Cryptography": ("picchange", "img_cryptography"),
+    "Steganography": ("stegnography", "steganography_function"),
+    "Watermarking": ("watermark", "watermark_"),
+}
+
+logger = logging.getLogger(__name__)
+
+_import_seconds = {}
+_first_render_seconds = {}
+_first_render_at = {}
+
+
+def load_page(page):
+    """Returns the function rendering page, importing its module on first use."""
+    module_name, function_name = PAGES[page]
+    module = sys.modules.get(module_name)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        _import_seconds[page] = time.perf_counter() - start
+        logger.info("Loaded page %s (%s) in %.0f ms", page, module_name, _import_seconds[page] * 1000)
+    return getattr(module, function_name)
+
+
+def render_page(page):
+    """Loads and renders page, recording how long its first render took."""
+    start = time.perf_counter()
+    try:
+        load_page(page)()
+    finally:
+        if page not in _first_render_seconds:
+            end = time.perf_counter()
+            _first_render_seconds[page] = end - start
+            _first_render_at[page] = end - PROCESS_START
+
+
+def startup_report():
+    """
+    One row per page opened so far in this process: seconds spent importing its
+    module, its first render (including the import) and from process start to
+    the end of that render.
+    """
+    return [
+        {"page": page, "import_s": _import_seconds.get(page, 0.0), "first_render_s": _first_render_seconds[page],
+         "since_start_s": _first_render_at[page]}
+        for page in PAGES if page in _first_render_seconds
+    ]
+
+
+def measure_cold_imports(pages=None, baseline="streamlit"):
+    """
+    Imports each page's module in a fresh interpreter and returns {page: seconds},
+    not counting the baseline modules (Streamlit itself) every page needs anyway.
+    """
+    code = ("import importlib, sys, time; importlib.import_module(sys.argv[1]); start = time.perf_counter(); "
+            "importlib.import_module(sys.argv[2]); print(time.perf_counter() - start)")
+    results = {}
+    for page in pages or PAGES:
+        output = subprocess.run([sys.executable, "-c", code, baseline, PAGES[page][0]],
+                                check=True, capture_output=True, text=True).stdout
+        results[page] = float(output.strip().splitlines()[-1])
+    return results
+
+
+def main():
+    for page, seconds in measure_cold_imports().items():
+        print(f"{page:<14} {seconds * 1000:8.0f} ms  ({PAGES[page][0]})")
+
+
+if __name__ == "__main__":
+    main()
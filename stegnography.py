@@ -1,93 +1,18 @@
 import streamlit as st
-from PIL import Image
-import numpy as np
 import io
-def steganography_function():
-    # Steganography functions
-    def encode_image(input_image, secret_message):
-        """Encodes a secret message into an image."""
-        img = Image.open(input_image)
-        encoded = img.copy()
-        width, height = img.size
-        pixels = encoded.load()
-
-        # Convert the message into binary and add a delimiter
-        binary_message = ''.join(format(ord(char), '08b') for char in secret_message) + '1111111111111110'
-        data_index = 0
-
-        for y in range(height):
-            for x in range(width):
-                if data_index < len(binary_message):
-                    pixel = list(pixels[x, y])
-                    # Modify the LSB of each RGB value
-                    for i in range(3):  # Process R, G, B channels
-                        if data_index < len(binary_message):
-                            pixel[i] = (pixel[i] & ~1) | int(binary_message[data_index])
-                            data_index += 1
-                    pixels[x, y] = tuple(pixel)
-
-        output = io.BytesIO()
-        encoded.save(output, format='PNG')
-        output.seek(0)
-        return output
-
-    def decode_image(encoded_image):
-        """Decodes a secret message from an image."""
-        img = Image.open(encoded_image)
-        width, height = img.size
-        pixels = img.load()
-
-        binary_message = ""
-        for y in range(height):
-            for x in range(width):
-                pixel = pixels[x, y]
-                for i in range(3):  # Process R, G, B channels
-                    binary_message += str(pixel[i] & 1)
-
-        # Split binary string into 8-bit chunks
-        message = ""
-        for i in range(0, len(binary_message), 8):
-            byte = binary_message[i:i+8]
-            if byte == '11111110':  # Stop at the delimiter
-                break
-            message += chr(int(byte, 2))
-
-        return message
-    
-    def lsb_analysis(image):
-        """
-        Analyzes the Least Significant Bits (LSB) of the image pixels
-        and checks for irregularities that might indicate hidden data.
-        """
-        img = Image.open(image)
-        img = img.convert('RGB')  # Ensure RGB mode
-        pixels = np.array(img)  # Convert image to numpy array
-
-        if len(pixels.shape) != 3 or pixels.shape[2] != 3:
-            raise ValueError("Unsupported image format. Please use RGB images.")
-
-        height, width, _ = pixels.shape
-
-        lsb_count = [0, 0]  # Count of 0s and 1s in the LSB
-        lsb_distribution = []
-
-            # Loop through each pixel and channel
-        for y in range(height):
-            for x in range(width):
-                pixel = pixels[y, x]
-                for channel in range(3):  # Process R, G, B channels
-                    lsb = pixel[channel] & 1
-                    lsb_count[lsb] += 1
-                    lsb_distribution.append(lsb)
-
-        total_lsb = sum(lsb_count)
-        if total_lsb == 0:
-            return None, None
-
-            # Compute percentage distribution
-        lsb_percentage = [count / total_lsb * 100 for count in lsb_count]
-        return lsb_percentage, lsb_distribution    
+from imagesecure.cache import content_digest
+from imagesecure.preview import display_preview
+from imagesecure.stego import encode_image, decode_image, decode_payload, embedding_capacity, lsb_analysis
+from session_cache import memoize, open_image, show_upload
+
+
+# Function to run an operation on an uploaded file from its first byte
+def _from_start(operation, uploaded_file, *args):
+    uploaded_file.seek(0)
+    return operation(uploaded_file, *args)
+
 
+def steganography_function():
     # Streamlit App
     st.header("Steganography Tool")
     st.subheader("Hide and retrieve secret messages in images")
@@ -99,16 +24,37 @@ def steganography_function():
         st.header("Encode a Secret Message")
         uploaded_image = st.file_uploader("Upload an image to encode", type=["png", "jpg", "jpeg"])
         if uploaded_image:
-            st.image(uploaded_image, caption="Selected Image for Encoding", use_column_width=True)
+            show_upload(uploaded_image, "Selected Image for Encoding")
         secret_message = st.text_area("Enter the secret message to hide")
+        secret_file = st.file_uploader("...or upload a file to hide instead", key="secret_file")
+
+        # More low bits per channel and the alpha channel raise capacity at the cost of visibility
+        bits = st.selectbox("Bits per channel", [1, 2, 3, 4], help="Number of least significant bits replaced in each channel.")
+        use_alpha = st.checkbox("Also use the alpha channel (RGBA)")
+        channels = 4 if use_alpha else 3
+        if uploaded_image:
+            width, height = open_image(uploaded_image).size
+            st.caption(f"Capacity with these settings: {embedding_capacity(width, height, bits, channels):,} bytes")
         encode_button = st.button("Apply Encoding")
 
         if encode_button:
-            if uploaded_image and secret_message:
+            secret = secret_file.getvalue() if secret_file else secret_message
+            if uploaded_image and secret:
                 try:
-                    encoded_image = encode_image(uploaded_image, secret_message)
+                    # Results are keyed on a digest of the secret, never on the secret itself
+                    secret_digest = content_digest(secret.encode("utf-8") if isinstance(secret, str) else secret)
+                    encoded_image = memoize(
+                        "encode_image", uploaded_image,
+                        lambda: _from_start(encode_image, uploaded_image, secret, bits, channels).getvalue(),
+                        secret_digest, bits, channels
+                    )
+                    encoded_preview = memoize(
+                        "encode_preview", uploaded_image,
+                        lambda: display_preview(io.BytesIO(encoded_image)),
+                        secret_digest, bits, channels
+                    )
                     st.success("Message encoded successfully!")
-                    st.image(encoded_image, caption="Encoded Image", use_column_width=True)
+                    st.image(encoded_preview, caption="Encoded Image", use_column_width=True)
                     st.download_button(
                         label="Download Encoded Image",
                         data=encoded_image,
@@ -118,20 +64,22 @@ def steganography_function():
                 except Exception as e:
                     st.error(f"An error occurred: {e}")
             else:
-                st.error("Please upload an image and enter a secret message.")
+                st.error("Please upload an image and enter a secret message or file.")
 
     with tab2:
         st.header("Decode a Secret Message")
         encoded_image = st.file_uploader("Upload an image to decode", type=["png", "jpg", "jpeg"], key="decode")
         if encoded_image:
-            st.image(encoded_image, caption="Selected Image for Decoding", use_column_width=True)
+            show_upload(encoded_image, "Selected Image for Decoding")
         decode_button = st.button("Apply Decoding")
 
         if decode_button:
             if encoded_image:
                 try:
-                    decoded_message = decode_image(encoded_image)
+                    decoded_message = memoize("decode_image", encoded_image, lambda: _from_start(decode_image, encoded_image))
+                    decoded_payload = memoize("decode_payload", encoded_image, lambda: _from_start(decode_payload, encoded_image))
                     st.success("Message decoded successfully!")
+                    st.download_button("Download Hidden Data", decoded_payload, "hidden_data.bin")
                     st.text_area("Decoded Message", decoded_message, height=100)
                 except Exception as e:
                     st.error(f"An error occurred: {e}")
@@ -148,8 +96,8 @@ def steganography_function():
         if analyze_button:
             if uploaded_image:
                 try:
-                    st.image(uploaded_image, caption="Uploaded Image", use_column_width=True)
-                    lsb_percentage, lsb_distribution = lsb_analysis(uploaded_image)
+                    show_upload(uploaded_image, "Uploaded Image")
+                    lsb_percentage, report = memoize("lsb_analysis", uploaded_image, lambda: _from_start(lsb_analysis, uploaded_image))
 
                     if lsb_percentage is None:
                         st.error("Unable to analyze the image.")
@@ -164,12 +112,25 @@ def steganography_function():
                             "Percentage": lsb_percentage
                             })
 
-                            # Detection threshold
-                        threshold = 50  # Typically, natural images have an approximately equal distribution of 0s and 1s
-                        if abs(lsb_percentage[0] - lsb_percentage[1]) > 5:
-                            st.warning("The image shows irregular LSB distribution, suggesting possible steganographic modification.")
+                        # Statistical detectors, per channel and per region
+                        st.write("### Statistical Detectors")
+                        st.write("Chi-square: probability that LSBs were overwritten. RS / Sample pair: estimated fraction of pixels carrying data.")
+                        st.table([
+                            {"Channel": name, "LSB 1s (%)": f"{result['lsb_ones'] * 100:.2f}", "Chi-square": f"{result['chi_square']:.3f}",
+                             "RS": f"{result['rs']:.3f}", "Sample pair": f"{result['sample_pair']:.3f}"}
+                            for name, result in report["channels"].items()
+                        ])
+                        with st.expander("Per-region results"):
+                            st.table([
+                                {"Region (left, top, right, bottom)": str(region["box"]), "Chi-square": f"{region['chi_square']:.3f}",
+                                 "RS": f"{region['rs']:.3f}", "Sample pair": f"{region['sample_pair']:.3f}"}
+                                for region in report["regions"]
+                            ])
+
+                        if report["suspicious"]:
+                            st.warning(f"The image shows LSB irregularities suggesting steganographic modification (estimated embedding rate {report['estimate'] * 100:.1f}%).")
                         else:
-                            st.success("The LSB distribution appears normal, with no clear indication of hidden data.")
+                            st.success("The LSB statistics appear normal, with no clear indication of hidden data.")
 
                 except Exception as e:
                     st.error(f"An error occurred while analyzing the image: {e}")
@@ -0,0 +1,82 @@
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+import pytest
+
+from imagesecure import batch
+from imagesecure.workers import ProcessPool
+
+
+def _double_or_die(value):
+    if value == 5:
+        # A worker killed for memory, say
+        os._exit(1)
+    time.sleep(0.02)
+    return value * 2
+
+
+def _copy_or_die(source, destination, options):
+    if os.path.basename(source).startswith("crash"):
+        os._exit(1)
+    shutil.copyfile(source, destination)
+
+
+def test_map_bounded_survives_a_dead_worker():
+    results = {}
+    with ProcessPool(2) as pool:
+        pool.map_bounded(_double_or_die, ((value, (value,)) for value in range(40)),
+                         lambda key, result, error: results.__setitem__(key, (result, error)), limit=4)
+        assert pool.restarts >= 1
+    assert sorted(results) == list(range(40))
+    assert "BrokenProcessPool" in results[5][1]
+    failed = [key for key, (_, error) in results.items() if error is not None]
+    # Only the tasks sent to the pool before its breakage was noticed fail; the rest run in the new pool
+    assert all("BrokenProcessPool" in results[key][1] for key in failed)
+    assert len(failed) <= 8
+    assert all(results[key] == (key * 2, None) for key in range(20, 40))
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="workers must inherit the test operation")
+def test_run_batch_records_files_lost_with_a_dead_worker(tmp_path, monkeypatch):
+    source, output = tmp_path / "in", tmp_path / "out"
+    source.mkdir()
+    names = [f"file{i:02d}.png" for i in range(20)] + ["crash.png"]
+    for name in names:
+        (source / name).write_bytes(name.encode())
+    monkeypatch.setitem(batch.OPERATIONS, "copy", (_copy_or_die, {".png"}, lambda rel: rel))
+
+    succeeded, failed, skipped = batch.run_batch("copy", source, output, {}, workers=2)
+
+    assert succeeded + failed == len(names) and skipped == 0
+    assert failed >= 1
+    records = batch.load_manifest(output / batch.MANIFEST_NAME)
+    assert sorted(records) == sorted(names)
+    assert records["crash.png"]["status"] == "error"
+    assert all((output / name).read_bytes() == name.encode() for name, record in records.items() if record["status"] == "ok")
+
+    # A re-run only retries the failed files
+    succeeded, failed, skipped = batch.run_batch("copy", source, output, {}, workers=2)
+    assert skipped == len(names) - sum(record["status"] == "error" for record in records.values())
+    lines = (output / batch.MANIFEST_NAME).read_text().splitlines()
+    assert all(json.loads(line)["path"] in names for line in lines)
+
+
+def test_resume_only_skips_files_done_with_the_same_options(tmp_path):
+    source, output = tmp_path / "in", tmp_path / "out"
+    source.mkdir()
+    for name in ["a.png", "b.png"]:
+        (source / name).write_bytes(os.urandom(100))
+    first, second = {"key": bytes(16)}, {"key": bytes(range(16))}
+
+    assert batch.run_batch("encrypt", source, output, first, workers=1) == (2, 0, 0)
+    assert batch.run_batch("encrypt", source, output, first, workers=1) == (0, 0, 2)
+    # Another key must not count the files encrypted under the first one as done
+    assert batch.run_batch("encrypt", source, output, second, workers=1) == (2, 0, 0)
+    records = batch.load_manifest(output / batch.MANIFEST_NAME)
+    assert {record["options_digest"] for record in records.values()} == {
+        batch.options_digest(second, bytes.fromhex(records["a.png"]["options_salt"]))}
+    # The digest does not give the key away
+    assert all(second["key"].hex() not in line for line in (output / batch.MANIFEST_NAME).read_text().splitlines())
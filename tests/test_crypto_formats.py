@@ -0,0 +1,145 @@
+import io
+import os
+import struct
+
+import pytest
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from imagesecure.crypto import (
+    INDEXED_HEADER,
+    LEGACY_INDEXED_HEADER,
+    MAX_CHUNK_SIZE,
+    STREAM_HEADER,
+    decrypt_file,
+    decrypt_range,
+    decrypt_stream,
+    encrypt_indexed,
+    encrypt_stream,
+)
+
+KEY = bytes(range(32))
+WRONG_KEY = bytes(range(1, 33))
+PLAINTEXT = os.urandom(10_000)
+
+
+def _indexed(plaintext=PLAINTEXT, chunk_size=1024, key=KEY):
+    output = io.BytesIO()
+    encrypt_indexed(io.BytesIO(plaintext), output, key, chunk_size=chunk_size, workers=2)
+    return output.getvalue()
+
+
+def _stream(plaintext=PLAINTEXT, chunk_size=1024, key=KEY):
+    output = io.BytesIO()
+    encrypt_stream(io.BytesIO(plaintext), output, key, chunk_size=chunk_size)
+    return output.getvalue()
+
+
+def _decrypt(data, key=KEY):
+    output = io.BytesIO()
+    decrypt_file(io.BytesIO(data), output, key, workers=2)
+    return output.getvalue()
+
+
+def _flip(data, position):
+    data = bytearray(data)
+    data[position] ^= 0x01
+    return bytes(data)
+
+
+def _nonce(prefix, index, final):
+    return prefix + struct.pack(">IB", index, 1 if final else 0)
+
+
+def _seal_chunks(aesgcm, prefix, header, plaintext, chunk_size):
+    chunks = [plaintext[i:i + chunk_size] for i in range(0, len(plaintext), chunk_size)] or [b""]
+    return b"".join(aesgcm.encrypt(_nonce(prefix, i, i == len(chunks) - 1), chunk, header)
+                    for i, chunk in enumerate(chunks))
+
+
+@pytest.mark.parametrize("size", [0, 1, 1023, 1024, 1025, 10_000])
+def test_indexed_round_trip(size):
+    assert _decrypt(_indexed(PLAINTEXT[:size])) == PLAINTEXT[:size]
+
+
+@pytest.mark.parametrize("size", [0, 1, 1024, 10_000])
+def test_stream_round_trip(size):
+    assert _decrypt(_stream(PLAINTEXT[:size])) == PLAINTEXT[:size]
+
+
+def test_indexed_layout_is_stable():
+    # Written by hand from the format description, so the reader is pinned to it
+    salt = os.urandom(16)
+    header = INDEXED_HEADER.pack(b"ISS3", 1024, salt, len(PLAINTEXT))
+    file_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=b"ISS3 chunks").derive(KEY)
+    data = header + _seal_chunks(AESGCM(file_key), bytes(7), header, PLAINTEXT, 1024)
+    assert _decrypt(data) == PLAINTEXT
+
+
+def test_legacy_indexed_files_still_decrypt():
+    prefix = os.urandom(7)
+    header = LEGACY_INDEXED_HEADER.pack(b"ISS2", 1024, prefix, len(PLAINTEXT))
+    data = header + _seal_chunks(AESGCM(KEY), prefix, header, PLAINTEXT, 1024)
+    assert _decrypt(data) == PLAINTEXT
+    assert decrypt_range(io.BytesIO(data), KEY, 1000, 100) == PLAINTEXT[1000:1100]
+    with pytest.raises(ValueError):
+        _decrypt(_flip(data, len(header) + 5))
+
+
+def test_every_indexed_file_gets_its_own_salt():
+    first, second = _indexed(), _indexed()
+    assert first[:4] == second[:4] == b"ISS3"
+    assert first[8:24] != second[8:24]
+
+
+@pytest.mark.parametrize("start, size", [(0, 10), (1000, 100), (1023, 2), (9_990, 100), (20_000, 5)])
+def test_decrypt_range(start, size):
+    assert decrypt_range(io.BytesIO(_indexed()), KEY, start, size) == PLAINTEXT[start:start + size]
+
+
+@pytest.mark.parametrize("encrypt", [_indexed, _stream])
+def test_wrong_key_is_rejected(encrypt):
+    with pytest.raises(ValueError):
+        _decrypt(encrypt(), WRONG_KEY)
+
+
+@pytest.mark.parametrize("encrypt", [_indexed, _stream])
+@pytest.mark.parametrize("where", ["header", "first chunk", "last byte"])
+def test_flipped_byte_is_rejected(encrypt, where):
+    data = encrypt()
+    header_size = INDEXED_HEADER.size if encrypt is _indexed else STREAM_HEADER.size
+    position = {"header": 10, "first chunk": header_size + 3, "last byte": len(data) - 1}[where]
+    with pytest.raises(ValueError):
+        _decrypt(_flip(data, position))
+
+
+@pytest.mark.parametrize("encrypt", [_indexed, _stream])
+@pytest.mark.parametrize("cut", [1, 16, 1040, 5])
+def test_truncation_is_rejected(encrypt, cut):
+    data = encrypt()
+    # cut=5 leaves a truncated header
+    truncated = data[:5] if cut == 5 else data[:-cut]
+    with pytest.raises(ValueError):
+        _decrypt(truncated)
+
+
+def test_trailing_data_is_rejected():
+    with pytest.raises(ValueError):
+        _decrypt(_indexed() + b"x")
+
+
+@pytest.mark.parametrize("encrypt, layout", [(_indexed, INDEXED_HEADER), (_stream, STREAM_HEADER)])
+def test_oversized_chunk_size_in_header_is_rejected(encrypt, layout):
+    # The chunk size is read before anything is authenticated, so it must be bounded
+    data = bytearray(encrypt())
+    struct.pack_into(">I", data, 4, MAX_CHUNK_SIZE + 1)
+    with pytest.raises(ValueError, match="corrupted header"):
+        _decrypt(bytes(data))
+
+
+def test_oversized_chunk_size_is_refused_when_writing():
+    with pytest.raises(ValueError):
+        _indexed(chunk_size=MAX_CHUNK_SIZE + 1)
+    with pytest.raises(ValueError):
+        decrypt_stream(io.BytesIO(b"ISS1"), io.BytesIO(), KEY)
@@ -0,0 +1,105 @@
+import io
+import struct
+import zlib
+
+import numpy as np
+import PIL
+import pytest
+from PIL import Image
+
+from imagesecure import raster
+from imagesecure.raster import Raster, partial_png_decode_supported
+
+# Adam7 passes as (first row, first column, row step, column step)
+ADAM7 = [(0, 0, 8, 8), (0, 4, 8, 8), (4, 0, 8, 4), (0, 2, 4, 4), (2, 0, 4, 2), (0, 1, 2, 2), (1, 0, 2, 1)]
+
+
+def _pixels(height=50, width=37, bands=3, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, bands), dtype=np.uint8)
+
+
+def _png(image, **options):
+    output = io.BytesIO()
+    image.save(output, format="PNG", **options)
+    output.seek(0)
+    return output
+
+
+def _interlaced_png(pixels):
+    # Pillow cannot write interlaced PNGs, so this one is assembled by hand (RGB, no filters)
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    height, width, _ = pixels.shape
+    raw = b""
+    for top, left, row_step, column_step in ADAM7:
+        for row in pixels[top::row_step, left::column_step]:
+            if row.size:
+                raw += b"\0" + row.tobytes()
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 1)
+    data = b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+    return io.BytesIO(data)
+
+
+def _sources():
+    pixels = _pixels()
+    yield "rgb", _png(Image.fromarray(pixels))
+    yield "rgba", _png(Image.fromarray(_pixels(bands=4)))
+    yield "grey", _png(Image.fromarray(pixels[..., 0]))
+    yield "palette", _png(Image.fromarray(pixels).quantize(64))
+    yield "interlaced", _interlaced_png(pixels)
+    jpeg = io.BytesIO()
+    Image.fromarray(pixels).save(jpeg, format="JPEG")
+    jpeg.seek(0)
+    yield "jpeg", jpeg
+
+
+@pytest.fixture(params=[name for name, _ in _sources()])
+def source(request):
+    return dict(_sources())[request.param]
+
+
+def test_the_installed_pillow_passes_the_self_check():
+    assert partial_png_decode_supported()
+
+
+@pytest.mark.parametrize("bottom", [1, 7, 49])
+@pytest.mark.parametrize("mode", [None, "RGB"])
+def test_leading_rows_match_a_full_decode(source, bottom, mode):
+    expected = np.array(Image.open(source).convert(mode) if mode else Image.open(source))[:bottom]
+    source.seek(0)
+    with Raster(source, mode) as image:
+        assert np.array_equal(image.rows(0, bottom), expected)
+        # Later strips still read correctly after the leading rows
+        assert np.array_equal(image.rows(bottom, 50), np.array(image.image.convert(image.mode))[bottom:])
+
+
+def test_head_is_only_used_for_plain_pngs():
+    sources = dict(_sources())
+    assert Raster(sources["palette"])._head(10) is not None
+    assert Raster(sources["interlaced"])._head(10) is None
+    loaded = Image.open(sources["rgb"])
+    loaded.load()
+    assert Raster(loaded)._head(10) is None
+
+
+def test_head_is_read_from_a_path(tmp_path):
+    pixels = _pixels()
+    Image.fromarray(pixels).save(tmp_path / "image.png")
+    with Raster(tmp_path / "image.png") as image:
+        head = image._head(5)
+        assert head.size == (37, 5)
+        assert np.array_equal(np.array(head), pixels[:5])
+
+
+def test_unchecked_pillow_versions_fall_back_to_a_full_decode(monkeypatch):
+    monkeypatch.setattr(PIL, "__version__", "13.0.0")
+    partial_png_decode_supported.cache_clear()
+    try:
+        assert not partial_png_decode_supported()
+        with Raster(_png(Image.fromarray(_pixels()))) as image:
+            assert image._head(5) is None
+            assert np.array_equal(image.rows(0, 5), _pixels()[:5])
+    finally:
+        monkeypatch.undo()
+        raster.partial_png_decode_supported.cache_clear()
@@ -0,0 +1,71 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagesecure.robust_watermark import (
+    MAX_PAYLOAD,
+    add_robust_watermark,
+    detect_robust_watermark,
+    detect_robust_watermark_image,
+    embed_robust_watermark,
+)
+
+TEXT = "© ImageSecure 2024"
+
+
+def _photo(seed=0, height=240, width=320):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([100 + 80 * np.sin(x / 29 + seed), 120 + 0.2 * x - 0.1 * y, 90 + 60 * np.cos(y / 17)], axis=-1)
+    return np.clip(base + rng.normal(0, 4, base.shape), 0, 255).astype(np.uint8)
+
+
+def _jpeg(image, quality):
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality)
+    output.seek(0)
+    return Image.open(output).convert("RGB")
+
+
+def test_text_survives_a_jpeg_resave():
+    marked = add_robust_watermark(Image.fromarray(_photo()), TEXT, key="k")
+    text, confidence = detect_robust_watermark_image(_jpeg(marked, 75), key="k")
+    assert text == TEXT
+    assert confidence > 0.3
+
+
+def test_wrong_key_or_unmarked_image_gives_none():
+    marked = add_robust_watermark(Image.fromarray(_photo()), TEXT, key="k")
+    assert detect_robust_watermark_image(marked, key="other")[0] is None
+    assert detect_robust_watermark_image(Image.fromarray(_photo()), key="k")[0] is None
+
+
+def test_too_long_text_is_refused():
+    assert detect_robust_watermark_image(add_robust_watermark(_photo(), "x" * MAX_PAYLOAD))[0] == "x" * MAX_PAYLOAD
+    with pytest.raises(ValueError, match=f"at most {MAX_PAYLOAD} bytes"):
+        add_robust_watermark(_photo(), "x" * (MAX_PAYLOAD + 1))
+    # Counted in UTF-8 bytes, not characters
+    with pytest.raises(ValueError, match="bytes"):
+        add_robust_watermark(_photo(), "é" * 16)
+
+
+@pytest.mark.parametrize("function", [
+    lambda pixels: embed_robust_watermark(pixels, TEXT),
+    lambda pixels: detect_robust_watermark(pixels),
+])
+def test_too_small_images_are_refused(function):
+    with pytest.raises(ValueError, match="too small"):
+        function(_photo(height=96, width=128))
+
+
+def test_stack_matches_one_image_at_a_time():
+    stack = np.stack([_photo(seed) for seed in range(3)])
+    marked = embed_robust_watermark(stack, TEXT, key=7)
+    for image, single in zip(stack, marked):
+        assert np.array_equal(embed_robust_watermark(image, TEXT, key=7)[0], single)
+    marked[1] = stack[1]
+    results = detect_robust_watermark(marked, key=7)
+    assert [text for text, _ in results] == [TEXT, None, TEXT]
+    assert results == [detect_robust_watermark(image, key=7)[0] for image in marked]
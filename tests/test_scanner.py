@@ -0,0 +1,82 @@
+import multiprocessing
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagesecure import scanner
+from imagesecure.scanner import ScanIndex, scan
+
+# The failing hash is patched in this process and reaches forked workers only
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="needs forked workers")
+
+_file_digest = scanner.file_digest
+
+
+def _unreadable(path):
+    if os.path.basename(path).startswith("unreadable"):
+        raise PermissionError(13, "Permission denied", path)
+    return _file_digest(path)
+
+
+@pytest.fixture
+def images(tmp_path):
+    root = tmp_path / "images"
+    root.mkdir()
+    rng = np.random.default_rng(0)
+    for name, size in [("a.png", (40, 30)), ("b.png", (24, 16)), ("unreadable.png", (8, 8))]:
+        Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)).save(root / name)
+    return root
+
+
+def _rows(index):
+    return {row["path"].rsplit("/", 1)[1]: row for row in index.query()}
+
+
+def test_unreadable_files_are_kept_and_reported(images, tmp_path, monkeypatch):
+    monkeypatch.setattr(scanner, "file_digest", _unreadable)
+    with ScanIndex(tmp_path / "index.sqlite") as index:
+        stats = scan(images, index, workers=2)
+        assert (stats["files"], stats["hashed"], stats["failed"]) == (3, 2, 1)
+        rows = _rows(index)
+        assert (rows["a.png"]["status"], rows["a.png"]["width"], rows["a.png"]["height"]) == ("ok", 40, 30)
+        assert (rows["b.png"]["width"], rows["b.png"]["height"]) == (24, 16)
+        assert rows["unreadable.png"]["status"] == "error"
+        assert "PermissionError" in rows["unreadable.png"]["error"]
+        summary = index.summary()
+        assert (summary["files"], summary["contents"], summary["failed"], summary["pending"]) == (3, 2, 1, 0)
+        assert [row["path"] for row in index.query(status="error")] == [rows["unreadable.png"]["path"]]
+
+        # Still unreadable: kept by the next scan instead of being dropped as gone
+        stats = scan(images, index, workers=2)
+        assert (stats["hashed"], stats["failed"], stats["removed"]) == (0, 1, 0)
+        assert _rows(index)["unreadable.png"]["status"] == "error"
+
+        # Readable again: hashed and analysed although its size and mtime did not change
+        monkeypatch.setattr(scanner, "file_digest", _file_digest)
+        stats = scan(images, index, workers=2)
+        assert (stats["hashed"], stats["analyzed"], stats["failed"]) == (1, 1, 0)
+        row = _rows(index)["unreadable.png"]
+        assert (row["status"], row["error"], row["width"]) == ("ok", None, 8)
+
+
+def test_removed_files_are_dropped(images, tmp_path):
+    with ScanIndex(tmp_path / "index.sqlite") as index:
+        scan(images, index, workers=1)
+        (images / "b.png").unlink()
+        assert scan(images, index, workers=1)["removed"] == 1
+        assert sorted(_rows(index)) == ["a.png", "unreadable.png"]
+
+
+def test_older_indexes_gain_the_error_column(tmp_path):
+    path = tmp_path / "old.sqlite"
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                           "mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL, scan_id INTEGER NOT NULL)")
+        connection.execute("INSERT INTO files VALUES ('/x.png', 1, 2, 'abc', 1)")
+    connection.close()
+    with ScanIndex(path) as index:
+        assert index.file("/x.png")["error"] is None
+        assert index.query()[0]["status"] is None
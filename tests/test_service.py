@@ -0,0 +1,93 @@
+import asyncio
+import http.client
+import io
+import json
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagesecure import service as service_module
+from imagesecure.service import BATCH_MAX_BODY, ImageService
+
+
+def _png(size, noisy=False):
+    if noisy:
+        pixels = np.random.default_rng(0).integers(0, 256, (size, size, 3), dtype=np.uint8)
+    else:
+        y, x = np.mgrid[0:size, 0:size]
+        pixels = np.stack([(x + y) % 256, (2 * x) % 256, (y // 3) % 256], axis=-1).astype(np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format="PNG")
+    return output.getvalue()
+
+
+def _request(port, method, path, body=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        connection.request(method, path, body)
+        response = connection.getresponse()
+        return response.status, response.getheader("Retry-After"), response.read()
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def service():
+    loop = asyncio.new_event_loop()
+    service = ImageService(workers=1)
+    server = loop.run_until_complete(service.start(port=0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield service, server.sockets[0].getsockname()[1]
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    service.close()
+    loop.close()
+
+
+@pytest.mark.parametrize("noisy", [False, True], ids=["batched", "large body"])
+def test_dead_worker_fails_its_request_fast_and_the_next_one_succeeds(service, noisy):
+    service, port = service
+    body = _png(4000, noisy)
+    assert (len(body) > BATCH_MAX_BODY) == noisy
+    assert _request(port, "POST", "/stego/analyze", _png(64))[0] == 200
+
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(_request(port, "POST", "/stego/analyze", body)))
+    thread.start()
+    executor = service.process_pool.executor
+    deadline = time.monotonic() + 30
+    while not executor._pending_work_items:
+        assert time.monotonic() < deadline, "the request never reached the pool"
+        time.sleep(0.005)
+    for process in list(executor._processes.values()):
+        process.kill()
+    thread.join(15)
+    assert not thread.is_alive(), "the request hung after its worker died"
+
+    status, retry_after, _ = responses[0]
+    assert (status, retry_after) == (503, "1")
+    assert _request(port, "POST", "/stego/analyze", _png(64))[0] == 200
+    health = json.loads(_request(port, "GET", "/health")[2])
+    assert health["pending"] == 0
+    assert health["pool_restarts"] == 1
+
+
+def test_stalled_body_gets_408_and_frees_its_slot(service, monkeypatch):
+    service, port = service
+    monkeypatch.setattr(service_module, "BODY_TIMEOUT", 0.2)
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as client:
+        client.sendall(b"POST /stego/analyze HTTP/1.1\r\nHost: x\r\nContent-Length: 1000\r\n\r\n" + bytes(10))
+        response = b""
+        while chunk := client.recv(4096):
+            response += chunk
+    # Answered and closed, without waiting for the rest of the body
+    assert response.startswith(b"HTTP/1.1 408 Request Timeout\r\n")
+    assert b"Connection: close" in response
+    assert json.loads(_request(port, "GET", "/health")[2])["pending"] == 0
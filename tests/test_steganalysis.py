@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagesecure.stego import embedding_capacity, encode_image
+from imagesecure.steganalysis import analyze_pixels, analyze_strips
+
+HEIGHT, WIDTH = 384, 512
+
+
+def _clean(seed=0):
+    # Smooth gradients with a little sensor-like noise, as in a photograph
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    base = np.stack([
+        96 + 60 * np.sin(x / 37) + 40 * np.cos(y / 23),
+        128 + 0.2 * x - 0.2 * y,
+        80 + 50 * np.sin((x + y) / 51),
+    ], axis=-1)
+    return np.clip(base + rng.normal(0, 2, base.shape), 0, 255).round().astype(np.uint8)
+
+
+def _embedded(pixels, fraction):
+    # Random bytes do not compress, so they fill the given fraction of the capacity
+    message = np.random.default_rng(1).bytes(int(embedding_capacity(WIDTH, HEIGHT) * fraction) - 64)
+    return np.array(Image.open(encode_image(Image.fromarray(pixels), message)))
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_clean_image_is_not_flagged(seed):
+    report = analyze_pixels(_clean(seed))
+    assert not report["suspicious"]
+    assert report["estimate"] < 0.05
+    assert report["size"] == [WIDTH, HEIGHT]
+
+
+@pytest.mark.parametrize("fraction", [0.1, 1.0])
+def test_lsb_embedding_is_flagged(fraction):
+    report = analyze_pixels(_embedded(_clean(), fraction))
+    assert report["suspicious"]
+    # The message fills the top of the image first
+    assert max(region["rs"] for region in report["regions"][:4]) > 0.2
+
+
+def test_partial_embedding_raises_the_estimate():
+    assert analyze_pixels(_embedded(_clean(), 0.1))["estimate"] > analyze_pixels(_clean())["estimate"] + 0.05
+
+
+def test_full_embedding_equalises_the_value_pairs():
+    report = analyze_pixels(_embedded(_clean(), 1.0))
+    assert all(channel["chi_square"] > 0.95 for channel in report["channels"].values())
+    assert report["lsb_percentage"][1] == pytest.approx(50, abs=1)
+
+
+@pytest.mark.parametrize("max_pixels", [None, 50_000])
+def test_strips_add_up_to_the_whole_image(max_pixels):
+    pixels = _embedded(_clean(), 0.1)
+    bounds = [0, 1, 100, 101, 250, HEIGHT]
+    strips = [(top, pixels[top:bottom]) for top, bottom in zip(bounds[:-1], bounds[1:])]
+    assert analyze_strips(strips, (WIDTH, HEIGHT), max_pixels=max_pixels) == analyze_pixels(pixels, max_pixels=max_pixels)
+
+
+def test_non_rgb_input_is_refused():
+    with pytest.raises(ValueError, match="RGB"):
+        analyze_pixels(np.zeros((8, 8, 4), dtype=np.uint8))
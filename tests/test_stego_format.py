@@ -0,0 +1,72 @@
+import io
+import zlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagesecure.stego import HEADER_PIXELS, STEGO_HEADER, decode_image, decode_payload, encode_image
+
+
+def _cover(width=64, height=48, mode="RGB", seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, (height, width, len(mode)), dtype=np.uint8)
+    return Image.fromarray(pixels, mode)
+
+
+def _pixels(encoded):
+    return np.array(Image.open(encoded))
+
+
+def _png(pixels):
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format="PNG")
+    output.seek(0)
+    return output
+
+
+def test_header_layout_is_stable():
+    # Images already written must keep decoding: the header sits in the RGB LSBs of the first pixels
+    encoded = encode_image(_cover(), b"abc")
+    lsbs = (_pixels(encoded)[..., :3].reshape(-1, 3)[:HEADER_PIXELS] & 1).reshape(-1)
+    header = np.packbits(lsbs[:STEGO_HEADER.size * 8]).tobytes()
+    assert header == STEGO_HEADER.pack(b"ISG", 1, 1, 3, 3, zlib.crc32(b"abc"))
+
+
+@pytest.mark.parametrize("bits", [1, 2, 3, 4])
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+def test_round_trip(bits, mode):
+    payload = bytes(range(256)) * 3
+    channels = len(mode)
+    encoded = encode_image(_cover(mode=mode), payload, bits, channels)
+    assert decode_payload(encoded) == payload
+    text = "Grüße, 世界"
+    assert decode_image(encode_image(_cover(mode=mode), text, bits, channels)) == text
+
+
+def test_flipped_payload_bit_is_detected():
+    pixels = _pixels(encode_image(_cover(), b"secret payload"))
+    flat = pixels.reshape(-1, 3)
+    flat[HEADER_PIXELS + 5, 1] ^= 1
+    with pytest.raises(ValueError, match="checksum"):
+        decode_payload(_png(pixels))
+
+
+def test_corrupted_length_is_detected():
+    pixels = _pixels(encode_image(_cover(), b"secret payload"))
+    # Header bit i is the LSB of channel value i; bit 48 is the high bit of the length field,
+    # which then claims more data than the image holds
+    pixels.reshape(-1)[6 * 8] ^= 1
+    with pytest.raises(ValueError, match="corrupted"):
+        decode_payload(_png(pixels))
+
+
+def test_truncated_image_is_detected():
+    payload = bytes(range(200)) * 2
+    pixels = _pixels(encode_image(_cover(), payload))
+    with pytest.raises(ValueError):
+        decode_payload(_png(pixels[:12]))
+
+
+def test_payload_too_large_is_refused():
+    with pytest.raises(ValueError, match="can hold at most"):
+        encode_image(_cover(8, 8), b"x" * 100)
@@ -0,0 +1,69 @@
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagesecure import stego_stream
+from imagesecure.stego_stream import hide_stream, reveal_stream
+
+PAYLOAD = os.urandom(6000)
+
+
+def _image(path, size=(64, 48), seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+
+
+@pytest.fixture
+def covers(tmp_path):
+    root = tmp_path / "covers"
+    root.mkdir()
+    # a.jpg and a.png must not end up as the same carrier
+    for seed, name in enumerate(["a.jpg", "a.png", "b.png", "c.png", "d.png", "e.png"]):
+        _image(root / name, seed=seed)
+    return root
+
+
+def test_reveal_in_any_order_skipping_other_images():
+    covers = [Image.fromarray(np.full((48, 64, 3), seed, dtype=np.uint8)) for seed in range(6)]
+    carriers = [carrier for _, carrier in hide_stream(PAYLOAD, covers, bits=2)]
+    unrelated = io.BytesIO()
+    Image.new("RGB", (30, 30)).save(unrelated, format="PNG")
+    skipped = []
+    output = io.BytesIO()
+    length = reveal_stream(carriers[::-1] + [unrelated], output, skipped=lambda carrier, error: skipped.append(error))
+    assert (length, output.getvalue()) == (len(PAYLOAD), PAYLOAD)
+    assert len(skipped) == 1
+
+
+def test_missing_fragment_is_still_an_error():
+    covers = [Image.fromarray(np.full((48, 64, 3), seed, dtype=np.uint8)) for seed in range(6)]
+    carriers = [carrier for _, carrier in hide_stream(PAYLOAD, covers, bits=2)]
+    with pytest.raises(ValueError, match="missing"):
+        reveal_stream(carriers[:1] + carriers[2:], io.BytesIO())
+
+
+def test_command_line_round_trip(covers, tmp_path, capsys):
+    payload = tmp_path / "payload.bin"
+    payload.write_bytes(PAYLOAD)
+    carriers = tmp_path / "carriers"
+    assert stego_stream.main(["hide", str(payload), str(covers), str(carriers), "--bits", "2"]) == 0
+    names = sorted(path.name for path in carriers.iterdir())
+    assert names[:2] == ["a.jpg.png", "a.png"]
+
+    _image(carriers / "holiday.png", seed=99)
+    output = tmp_path / "revealed.bin"
+    assert stego_stream.main(["reveal", str(carriers), str(output)]) == 0
+    assert output.read_bytes() == PAYLOAD
+    assert "holiday.png: skipped" in capsys.readouterr().err
+
+
+def test_colliding_carrier_names_are_refused(covers, tmp_path):
+    _image(covers / "b.jpg.png")
+    _image(covers / "b.jpg")
+    payload = tmp_path / "payload.bin"
+    payload.write_bytes(PAYLOAD)
+    with pytest.raises(SystemExit, match="b.jpg.png"):
+        stego_stream.main(["hide", str(payload), str(covers), str(tmp_path / "carriers")])
@@ -0,0 +1,168 @@
+import io
+import os
+import struct
+import zlib
+
+import numpy as np
+import pytest
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from imagesecure.crypto import TAG_SIZE
+from imagesecure.tiles import (
+    LEGACY_TILED_HEADER,
+    TILE_COMPRESSED,
+    TILE_ENCRYPTED,
+    TILE_ENTRY,
+    TILED_HEADER,
+    TiledImage,
+    decrypt_tiles,
+    encrypt_tiles,
+)
+
+KEY = bytes(range(16))
+WRONG_KEY = bytes(range(1, 17))
+TILE = 32
+# One flat tile row above three noisy ones
+PIXELS = np.concatenate([
+    np.full((TILE, 100, 3), 200, dtype=np.uint8),
+    np.random.default_rng(0).integers(0, 256, (70, 100, 3), dtype=np.uint8),
+])
+
+
+def _encrypt(pixels=PIXELS, **options):
+    output = io.BytesIO()
+    encrypt_tiles(pixels, output, KEY, tile_size=TILE, **options)
+    return output.getvalue()
+
+
+def _entries(data):
+    tiled = TiledImage(io.BytesIO(data))
+    return tiled.index
+
+
+def _region(data, key=KEY, box=None, **options):
+    return np.array(TiledImage(io.BytesIO(data), key, **options).read_region(box))
+
+
+@pytest.mark.parametrize("mode", ["L", "RGB", "RGBA"])
+@pytest.mark.parametrize("pad", [False, True])
+def test_round_trip(mode, pad):
+    bands = len(mode)
+    pixels = np.random.default_rng(1).integers(0, 256, (70, 100, bands), dtype=np.uint8)
+    data = _encrypt(pixels[..., 0] if bands == 1 else pixels, pad=pad)
+    decrypted = np.array(decrypt_tiles(io.BytesIO(data), KEY))
+    assert np.array_equal(decrypted, pixels[..., 0] if bands == 1 else pixels)
+
+
+def test_read_region_and_regions_left_plain():
+    data = _encrypt(regions=[(0, 40, 10, 50)])
+    assert np.array_equal(_region(data, box=(5, 30, 77, 101)), PIXELS[30:101, 5:77])
+    # Without the key only the tile under the region is blacked out
+    public = _region(data, key=None)
+    assert not public[TILE:2 * TILE, :TILE].any()
+    assert np.array_equal(public[:TILE], PIXELS[:TILE])
+    assert np.array_equal(public[:, TILE:], PIXELS[:, TILE:])
+
+
+@pytest.mark.parametrize("key", [KEY, None])
+def test_thumbnail_samples_the_tiles(key):
+    data = _encrypt(regions=[(0, 40, 10, 50)])
+    full = _region(data, key=key)
+    # 34 px from 102 rows: every third pixel, across tile edges that are not multiples of 3
+    thumbnail = np.array(TiledImage(io.BytesIO(data), key).thumbnail(34))
+    assert np.array_equal(thumbnail, full[::3, ::3])
+    assert max(TiledImage(io.BytesIO(data), key).thumbnail(20).size) == 20
+
+
+def test_padded_tiles_do_not_leak_their_content():
+    compressed = [length for _, length, _ in _entries(_encrypt())]
+    padded = [length for _, length, _ in _entries(_encrypt(pad=True))]
+    # Flat and noisy full tiles differ in length only when compressed
+    assert compressed[0] < compressed[4]
+    assert padded[0] == padded[4] == TILE * TILE * 3 + TAG_SIZE
+
+
+def test_wrong_key_is_rejected_on_open():
+    with pytest.raises(ValueError, match="tile index"):
+        TiledImage(io.BytesIO(_encrypt()), WRONG_KEY)
+
+
+@pytest.mark.parametrize("position", [5, TILED_HEADER.size + 3, -1])
+def test_flipped_byte_is_rejected(position):
+    data = bytearray(_encrypt())
+    data[position] ^= 0x01
+    with pytest.raises(ValueError):
+        _region(bytes(data))
+
+
+def test_encrypted_tile_cannot_be_replaced_by_a_plain_one():
+    data = bytearray(_encrypt())
+    entries = _entries(bytes(data))
+    offset, length, _ = entries[0]
+    # Point tile 0 at attacker pixels and mark it unencrypted
+    forged = zlib.compress(bytes(TILE * TILE * 3))
+    data[offset:offset + length] = forged.ljust(length, b"\0")
+    TILE_ENTRY.pack_into(data, TILED_HEADER.size, offset, len(forged), TILE_COMPRESSED)
+    with pytest.raises(ValueError, match="tile index"):
+        _region(bytes(data))
+
+
+def test_plain_tile_cannot_be_replaced():
+    data = bytearray(_encrypt(regions=[(0, 40, 10, 50)]))
+    offset, length, flags = _entries(bytes(data))[5]
+    assert flags == TILE_COMPRESSED
+    # Noisy pixels are stored, not compressed, so other noise gives a tile of the same length
+    other = np.random.default_rng(9).integers(0, 256, (TILE, TILE, 3), dtype=np.uint8)
+    forged = zlib.compress(other.tobytes(), 1)
+    assert len(forged) == length - TAG_SIZE
+    data[offset:offset + len(forged)] = forged
+    with pytest.raises(ValueError, match="corrupted data"):
+        _region(bytes(data))
+    # Without the key nothing is authenticated, as documented
+    assert np.array_equal(_region(bytes(data), key=None)[TILE:2 * TILE, TILE:2 * TILE], other)
+
+
+def test_tile_inflating_past_its_size_is_rejected():
+    data = bytearray(_encrypt(regions=[(0, 40, 10, 50)]))
+    bomb = zlib.compress(bytes(100 * TILE * TILE * 3)) + bytes(TAG_SIZE)
+    # Without the key the index is not authenticated, so tile 0 can point anywhere
+    TILE_ENTRY.pack_into(data, TILED_HEADER.size, len(data), len(bomb), TILE_COMPRESSED)
+    with pytest.raises(ValueError, match="corrupted tile"):
+        _region(bytes(data) + bomb, key=None)
+
+
+def test_swapped_tiles_are_rejected():
+    data = bytearray(_encrypt())
+    first, second = _entries(bytes(data))[4:6]
+    TILE_ENTRY.pack_into(data, TILED_HEADER.size + 4 * TILE_ENTRY.size, *second)
+    TILE_ENTRY.pack_into(data, TILED_HEADER.size + 5 * TILE_ENTRY.size, *first)
+    with pytest.raises(ValueError):
+        _region(bytes(data))
+
+
+@pytest.mark.parametrize("cut", [1, 500, None])
+def test_truncation_is_rejected(cut):
+    data = _encrypt()
+    # None leaves the tile index cut short
+    truncated = data[:TILED_HEADER.size + 10] if cut is None else data[:-cut]
+    with pytest.raises(ValueError):
+        _region(truncated)
+
+
+def test_first_version_files_need_legacy():
+    prefix = os.urandom(7)
+    height, width, _ = PIXELS.shape
+    header = LEGACY_TILED_HEADER.pack(b"IST1", width, height, 3, TILE, prefix)
+    boxes = [(c, r) for r in range(0, height, TILE) for c in range(0, width, TILE)]
+    offset = len(header) + TILE_ENTRY.size * len(boxes)
+    entries, tiles = [], []
+    for number, (left, top) in enumerate(boxes):
+        tile = zlib.compress(np.ascontiguousarray(PIXELS[top:top + TILE, left:left + TILE]).tobytes())
+        tile = AESGCM(KEY).encrypt(prefix + struct.pack(">IB", number, 0), tile, header)
+        entries.append(TILE_ENTRY.pack(offset, len(tile), TILE_ENCRYPTED))
+        tiles.append(tile)
+        offset += len(tile)
+    data = header + b"".join(entries) + b"".join(tiles)
+    with pytest.raises(ValueError, match="legacy"):
+        _region(data)
+    assert np.array_equal(_region(data, legacy=True), PIXELS)
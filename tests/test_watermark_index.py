@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagesecure import watermark_index
+from imagesecure.watermark import add_invisible_watermark
+from imagesecure.watermark_index import SignatureIndex, verify_watermark, verify_watermarks
+
+# 80 bits: at the default 0.9 a match allows exactly 8 bit errors
+SIGNATURE = "Studio0042"
+INDEX = SignatureIndex([SIGNATURE, "Other", "Another signature"])
+
+
+def _image(seed=0):
+    return Image.fromarray(np.random.default_rng(seed).integers(0, 256, (24, 32, 3), dtype=np.uint8))
+
+
+def _damaged(errors):
+    # Flips the low bit of `errors` of the values carrying the watermark
+    pixels = np.array(add_invisible_watermark(_image(), SIGNATURE))
+    flat = pixels.reshape(-1)
+    flat[:80:80 // errors][:errors] ^= 1
+    return Image.fromarray(pixels)
+
+
+def test_exact_match():
+    result = verify_watermark(add_invisible_watermark(_image(), SIGNATURE), INDEX)
+    assert (result["status"], result["signature"], result["confidence"], result["exact"]) == ("match", SIGNATURE, 1.0, True)
+
+
+@pytest.mark.parametrize("errors, status", [(8, "match"), (9, "no match")])
+def test_near_match_at_the_threshold(errors, status):
+    result = verify_watermark(_damaged(errors), INDEX, min_confidence=0.9)
+    assert result["status"] == status
+    if status == "match":
+        assert (result["signature"], result["confidence"], result["exact"]) == (SIGNATURE, 0.9, False)
+
+
+def test_unmarked_image_does_not_match():
+    result = verify_watermark(_image(1), INDEX)
+    assert (result["status"], result["signature"], result["confidence"]) == ("no match", None, None)
+
+
+def test_read_error_is_reported_per_image(tmp_path):
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+    marked = add_invisible_watermark(_image(), SIGNATURE)
+    results = list(verify_watermarks([marked, broken, _image(1)], INDEX, workers=2))
+    assert [result["status"] for result in results] == ["match", "error", "no match"]
+    assert "UnidentifiedImageError" in results[1]["error"]
+
+
+def test_matches_only_still_counts_every_image(tmp_path, capsys):
+    images = tmp_path / "images"
+    images.mkdir()
+    add_invisible_watermark(_image(), SIGNATURE).save(images / "marked.png")
+    _image(1).save(images / "plain.png")
+    (images / "broken.png").write_bytes(b"not an image")
+    signatures = tmp_path / "signatures.txt"
+    signatures.write_text(SIGNATURE + "\nOther\n")
+
+    assert watermark_index.main([str(signatures), str(images), "--matches-only"]) == 0
+    out, err = capsys.readouterr()
+    assert [line.split()[0] for line in out.splitlines()] == ["match"]
+    assert "3 images checked against 2 signatures: 1 match, 1 no match, 1 error" in err